@@ -1,31 +1,170 @@
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.forms.models import BaseInlineFormSet
+from django.utils.functional import cached_property
 from .models import Voting, VoteVariant, VoteFact
+from .series import forget_series
+from .services import check_variants
+from .tallies import recount_votings
+
+
+def estimate_count(model, using):
+    """
+    row count of the model's table from the database statistics, without scanning the table
+    :return: estimated number of rows, None if the backend keeps no estimate
+    """
+    connection = connections[using]
+    if connection.vendor == 'mysql':
+        sql = 'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+    elif connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)'
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [model._meta.db_table])
+        row = cursor.fetchone()
+    # reltuples is -1 for a table that was never analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    paginator of admin changelists: an unfiltered changelist takes its count from the database
+    statistics instead of COUNT(*), filtered ones and tables smaller than
+    ADMIN_ESTIMATED_COUNT_THRESHOLD are counted exactly
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
 
 
 class UserAdmin(admin.ModelAdmin):
     list_display = ('id', 'username', 'first_name',
                     'last_name', 'is_superuser', 'is_staff')
 
+    # VoteFacts of a deleted user go with it, the votings they were cast in are recounted
+    def delete_model(self, request, obj):
+        voting_ids = set(VoteFact.objects.filter(user=obj).values_list('voting_id', flat=True))
+        super().delete_model(request, obj)
+        recount_votings(voting_ids)
+
+    def delete_queryset(self, request, queryset):
+        voting_ids = set(VoteFact.objects.filter(user__in=queryset).values_list('voting_id', flat=True))
+        super().delete_queryset(request, queryset)
+        recount_votings(voting_ids)
+
 
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
 
 
+class VoteVariantFormSet(BaseInlineFormSet):
+    def clean(self):
+        """
+        applies the variant rules of main.services.create_voting to the voting being saved
+        """
+        super().clean()
+        descriptions = [form.cleaned_data['description'] for form in self.forms
+                        if form.cleaned_data.get('description') and not form.cleaned_data.get('DELETE')]
+        check_variants(self.instance.type, descriptions)
+
+
+class VoteVariantInline(admin.TabularInline):
+    """
+    variants are deleted through VoteVariantAdmin, which recounts the results
+    """
+    model = VoteVariant
+    formset = VoteVariantFormSet
+    fields = ('description',)
+    extra = 2
+    can_delete = False
+
+
+# the admin does not call create_voting: it saves the voting and its inline variants
+# in one transaction itself, the formset checks the same variant rules
 @admin.register(Voting)
 class VotingAdmin(admin.ModelAdmin):
+    inlines = (VoteVariantInline,)
     list_display = ('id', 'name', 'author', 'type', 'published', 'finishes', 'next_voting', 'prev_voting')
+    list_select_related = ('author', 'next_voting', 'prev_voting')
+    raw_id_fields = ('author', 'next_voting', 'prev_voting')
+    date_hierarchy = 'published'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'next_voting' in form.changed_data or 'prev_voting' in form.changed_data:
+            forget_series()
 
 
 @admin.register(VoteVariant)
 class VoteVariantAdmin(admin.ModelAdmin):
     list_display = ('id', 'voting', 'description')
+    list_select_related = ('voting',)
+    raw_id_fields = ('voting',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    # moving or deleting a variant changes the results of its votings
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'voting' in form.changed_data:
+            recount_votings({form.initial['voting'], obj.voting_id})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        recount_votings({obj.voting_id})
+
+    def delete_queryset(self, request, queryset):
+        voting_ids = set(queryset.values_list('voting_id', flat=True))
+        super().delete_queryset(request, queryset)
+        recount_votings(voting_ids)
 
 
 @admin.register(VoteFact)
 class VoteFactAdmin(admin.ModelAdmin):
-    fields = ['id', 'user', 'variants', 'created']
+    fields = ['id', 'voting', 'user', 'variants', 'created']
+    readonly_fields = ('id',)
     list_display = ('id', 'user', 'variants_str', 'created')
+    list_select_related = ('user',)
+    raw_id_fields = ('voting', 'user', 'variants')
+    date_hierarchy = 'created'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('variants')
+
+    # VoteFacts written here bypass record_vote, the tallies of their votings are recounted
+    # and the participations of their users follow them
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        fact = form.instance
+        recount_votings({form.initial.get('voting'), fact.voting_id},
+                        {(form.initial.get('voting'), form.initial.get('user')), (fact.voting_id, fact.user_id)})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        recount_votings({obj.voting_id}, {(obj.voting_id, obj.user_id)})
+
+    def delete_queryset(self, request, queryset):
+        participants = set(queryset.values_list('voting_id', 'user_id'))
+        # the delete action, unlike the change and delete views, does not run in a transaction
+        with transaction.atomic():
+            super().delete_queryset(request, queryset)
+            recount_votings({voting_id for voting_id, _ in participants}, participants)
 
     @staticmethod
     def variants_str(obj):
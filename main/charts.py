@@ -0,0 +1,64 @@
+import plotly.graph_objects as go
+from django.utils import timezone
+from plotly.io import to_html
+from plotly.subplots import make_subplots
+
+
+def create_chart(facts: dict):
+    zero_keys = [key for key, value in facts.items() if value == 0]
+    [facts.pop(key) for key in zero_keys]
+    fig = make_subplots(rows=1, cols=2, specs=[
+        [{'type': 'xy'}, {'type': 'domain'}]
+    ])
+    fig.add_bar(
+        row=1, col=1,
+        x=list(facts.keys()),
+        y=list(facts.values()),
+        name='',
+        showlegend=False,
+        hovertemplate='Вариант: %{x}<br>Количество голосов: %{y}',
+        marker_color=['grey'] * len(list(facts.items())),
+        hoverlabel_font_color='white',
+    )
+    fig.add_pie(
+        row=1, col=2,
+        values=list(facts.values()),
+        labels=list(facts.keys()),
+        textposition="auto",
+        name='',
+        hovertemplate='Вариант: %{label}<br>Количество голосов: %{value}</br>%{percent}',
+    )
+    fig.update_layout(yaxis_tickformat=',d')
+    fig.update_traces(marker=dict(line=dict(color='#000000', width=1)))
+    fig.update_yaxes(row=1, col=1, title_text='Количество голосов')
+    fig.update_xaxes(row=1, col=1, title_text='Варианты ответов')
+    return to_html(fig, full_html=False, include_plotlyjs='cdn', div_id='results-chart')
+
+
+def create_turnout_chart(buckets: list, voters: list, variants: dict):
+    """
+    :param buckets: start times of the time buckets
+    :param voters: number of ballots per bucket
+    :param variants: {variant description: votes per bucket}
+    """
+    times = [timezone.localtime(bucket) for bucket in buckets]
+    fig = go.Figure()
+    fig.add_bar(
+        x=times,
+        y=voters,
+        name='Проголосовали',
+        marker_color='grey',
+        hovertemplate='%{x}<br>Проголосовали: %{y}',
+    )
+    for description, votes in variants.items():
+        fig.add_scatter(
+            x=times,
+            y=votes,
+            name=description,
+            mode='lines+markers',
+            hovertemplate='%{x}<br>Голосов: %{y}',
+        )
+    fig.update_layout(yaxis_tickformat=',d', legend_orientation='h')
+    fig.update_yaxes(title_text='Количество голосов')
+    fig.update_xaxes(title_text='Время')
+    return to_html(fig, full_html=False, include_plotlyjs='cdn', div_id='turnout-chart')
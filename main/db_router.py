@@ -0,0 +1,44 @@
+import contextvars
+
+from django.db import DEFAULT_DB_ALIAS
+
+
+class RequestDatabases:
+    """
+    database the current request reads from, switched back to the primary once it writes
+    """
+
+    def __init__(self, read=DEFAULT_DB_ALIAS):
+        self.read = read
+        self.wrote = False
+
+
+# set by main.middleware.ReplicaMiddleware for the duration of a request
+request_databases = contextvars.ContextVar('request_databases', default=None)
+
+
+class ReplicaRouter:
+    """
+    reads of views chosen by ReplicaMiddleware go to the replica, everything else,
+    all writes and reads following a write in the same request use the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        databases = request_databases.get()
+        if databases is None or databases.wrote:
+            return DEFAULT_DB_ALIAS
+        return databases.read
+
+    def db_for_write(self, model, **hints):
+        databases = request_databases.get()
+        if databases is not None:
+            databases.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its schema through replication
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,82 @@
+import csv
+import json
+
+from main.models import VoteVariant, VoteFact
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+CSV_HEADER = ['id', 'user_id', 'username', 'created', 'variant_ids', 'variants']
+
+
+def iter_votes(voting_id, chunk_size=2000):
+    """
+    yields votes of a voting as (id, user id, username, created, variant ids, variant descriptions),
+    facts are read in keyset chunks and their variants fetched once per chunk,
+    so memory stays flat whatever the number of votes
+    """
+    descriptions = dict(VoteVariant.objects.filter(voting=voting_id).values_list('id', 'description'))
+    through = VoteFact.variants.through
+    last_id = 0
+    while True:
+        facts = list(
+            VoteFact.objects.filter(voting=voting_id, id__gt=last_id).order_by('id')
+            .values_list('id', 'user_id', 'user__username', 'created')[:chunk_size]
+        )
+        if not facts:
+            return
+        last_id = facts[-1][0]
+        chosen = {}
+        links = through.objects.filter(votefact_id__in=[fact[0] for fact in facts]) \
+            .order_by('votevariant_id').values_list('votefact_id', 'votevariant_id')
+        for fact_id, variant_id in links:
+            chosen.setdefault(fact_id, []).append(variant_id)
+        for fact_id, user_id, username, created in facts:
+            variant_ids = chosen.get(fact_id, [])
+            yield fact_id, user_id, username, created, variant_ids, [descriptions[i] for i in variant_ids]
+
+
+class Echo:
+    """
+    file-like object handing back what csv.writer writes to it
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(votes):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for fact_id, user_id, username, created, variant_ids, variants in votes:
+        yield writer.writerow([
+            fact_id,
+            user_id if user_id is not None else '',
+            username or '',
+            created.isoformat(),
+            ' '.join(str(variant_id) for variant_id in variant_ids),
+            '; '.join(variants),
+        ])
+
+
+def iter_ndjson(votes):
+    for fact_id, user_id, username, created, variant_ids, variants in votes:
+        yield json.dumps({
+            'id': fact_id,
+            'user_id': user_id,
+            'username': username,
+            'created': created.isoformat(),
+            'variant_ids': variant_ids,
+            'variants': variants,
+        }, ensure_ascii=False) + '\n'
+
+
+def export_votes(voting_id, export_format, chunk_size=2000):
+    """
+    :return: iterator over lines of the export in the given format ('csv' or 'ndjson')
+    """
+    votes = iter_votes(voting_id, chunk_size)
+    if export_format == 'csv':
+        return iter_csv(votes)
+    return iter_ndjson(votes)
@@ -1,10 +1,15 @@
 import datetime
 
+from django.core.exceptions import ValidationError
+from django.shortcuts import get_object_or_404
+from django.db.models import Case, When, Value, IntegerField, Q, prefetch_related_objects
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 
 from main.forms import InputForm
-from main.models import Voting, VoteVariant, User
+from main.models import Voting, VotingParticipation, User
+from main.services import create_voting
+from main.session_votes import get_session_votes, ranges_contain
 
 
 def get_forms(context, request):
@@ -24,46 +29,116 @@ def check_valid_and_create(context, forms, request, voteinfo):
         timezone.now() < \
         parse_datetime(voteinfo.data['start_time']).astimezone() + datetime.timedelta(minutes=3) < \
         parse_datetime(voteinfo.data['finish_time']).astimezone() + datetime.timedelta(minutes=3):
+        count = context['accordion_context'][context['type_of']]['count']
         try:
-            voting = Voting(author=request.user,
-                            name=voteinfo.cleaned_data['name'],
-                            description=voteinfo.cleaned_data['desc'],
-                            type=int(context['type_of']) - 1,
-                            image=voteinfo.files['image'],
-                            published=voteinfo.cleaned_data['start_time'],
-                            finishes=voteinfo.cleaned_data['finish_time'])
-        except KeyError:
-            voting = Voting(author=request.user,
-                            name=voteinfo.cleaned_data['name'],
-                            description=voteinfo.cleaned_data['desc'],
-                            type=int(context['type_of']) - 1,
-                            published=voteinfo.cleaned_data['start_time'],
-                            finishes=voteinfo.cleaned_data['finish_time'])
-        voting.save()
+            voting = create_voting(
+                author=request.user,
+                name=voteinfo.cleaned_data['name'],
+                description=voteinfo.cleaned_data['desc'],
+                type=int(context['type_of']) - 1,
+                image=voteinfo.files.get('image'),
+                published=voteinfo.cleaned_data['start_time'],
+                finishes=voteinfo.cleaned_data['finish_time'],
+                variants=[forms[i - 1].data[str(i) + context['type_of'] + '-var'] for i in range(1, count + 1)],
+            )
+        except ValidationError as error:
+            voteinfo.add_error(None, error)
+            context['error'] = True
+            return False
         context['v_id'] = voting.id
-        for i in range(1, context['accordion_context'][context['type_of']]['count'] + 1):
-            var = VoteVariant(voting=voting, description=forms[i - 1].data[str(i) + context['type_of'] + '-var'])
-            var.save()
     else:
         context['error'] = True
         flag = False
     return flag
 
 
+def get_request_voting(request, voting_id, variants=False) -> Voting:
+    """
+    load a voting with its author once per request, the view, forms and
+    eligibility check all share the same instance
+    :param variants: also prefetch its variants, only pages showing them need it
+    :raise Http404: if there is no such voting
+    """
+    votings = request.__dict__.setdefault('loaded_votings', {})
+    if voting_id not in votings:
+        votings[voting_id] = get_object_or_404(Voting.objects.select_related('author'), id=voting_id)
+    voting = votings[voting_id]
+    if variants and 'votevariant_set' not in getattr(voting, '_prefetched_objects_cache', {}):
+        prefetch_related_objects([voting], 'votevariant_set')
+    return voting
+
+
+def voted_in_session(request, voting_id) -> bool:
+    return ranges_contain(get_session_votes(request.session), voting_id)
+
+
 def check_eligible_to_vote(voting: Voting, request) -> bool:
-    if request.session.get('votes'):
-        if voting.id in request.session.get('votes'):
-            return False
+    if voted_in_session(request, voting.id):
+        return False
 
     # validate that voting is active
     if not (voting.published < timezone.now() < voting.finishes):
         return False
 
     # validate that user has not voted on this Voting before
-    for vote_variant in voting.votevariant_set.all():
-        vote_variant: VoteVariant = vote_variant
-        if request.user.is_authenticated:
-            if vote_variant.votefact_set.filter(user=request.user).count() != 0:
-                return False
+    if request.user.is_authenticated:
+        if VotingParticipation.objects.filter(voting=voting, user=request.user).exists():
+            return False
 
     return True
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def encode_cursor(voting: Voting) -> str:
+    microseconds = (voting.published - EPOCH) // datetime.timedelta(microseconds=1)
+    return f'{microseconds}.{voting.id}'
+
+
+def parse_positive_int(value: str):
+    """
+    :return: number written with ASCII digits that fits a database integer, None for anything else
+    """
+    if not value.isascii() or not value.isdecimal():
+        return None
+    number = int(value)
+    return number if 0 < number < 2 ** 63 else None
+
+
+def decode_cursor(cursor: str):
+    """
+    :return: (published, id) of the last voting on the previous page or None for a malformed cursor
+    """
+    try:
+        microseconds, voting_id = (int(part) for part in cursor.split('.'))
+        published = EPOCH + datetime.timedelta(microseconds=microseconds)
+    except (AttributeError, ValueError, OverflowError, OSError):
+        return None
+    # ids beyond a 64-bit integer can not be compared by the database
+    if not 0 <= voting_id < 2 ** 63:
+        return None
+    return published, voting_id
+
+
+def get_votings_page(author, cursor=None, page_size=20):
+    """
+    keyset pagination over votings of the author, newest first,
+    every page costs one indexed range scan no matter how deep it is
+    :return: (list of votings annotated with status, cursor of the next page or None)
+    """
+    now = timezone.now()
+    votings = Voting.objects.filter(author=author).annotate(status=Case(
+        When(published__gt=now, then=Value(Voting.NOT_STARTED)),
+        When(finishes__gt=now, then=Value(Voting.IN_PROGRESS)),
+        default=Value(Voting.FINISHED),
+        output_field=IntegerField(),
+    )).order_by('-published', '-id')
+    position = decode_cursor(cursor) if cursor else None
+    if position is not None:
+        published, voting_id = position
+        votings = votings.filter(Q(published__lt=published) | Q(published=published, id__lt=voting_id))
+    votings = list(votings[:page_size + 1])
+    if len(votings) > page_size:
+        return votings[:page_size], encode_cursor(votings[page_size - 1])
+    return votings, None
@@ -6,6 +6,7 @@ from django.core.exceptions import ValidationError
 from django_registration.forms import RegistrationForm
 from django.utils.translation import gettext_lazy as _
 from main.models import Voting
+from main.variant_choices import get_variant_choices
 from django.contrib.auth.backends import ModelBackend, UserModel
 
 
@@ -92,17 +93,25 @@ class VotingContext(forms.Form):
 
 
 class VoteForm(forms.Form):
-    def __init__(self, voting_id, *args, **kwargs):
+    def __init__(self, voting, *args, **kwargs):
+        """
+        :param voting: Voting or its id, submitted choices are validated against
+        its cached variants without querying the database
+        """
         super().__init__(*args, **kwargs)
-        voting = Voting.objects.get(id=voting_id)
+        if isinstance(voting, Voting):
+            variants = getattr(voting, '_prefetched_objects_cache', {}).get('votevariant_set')
+            choices = get_variant_choices(voting.id, variants)
+        else:
+            choices = get_variant_choices(voting)
         self.fields['choices'].required = True
-        self.fields['choices'].queryset = voting.votevariant_set.all()
+        self.fields['choices'].choices = choices
         self.fields['choices'].label = ''
 
 
 class VoteOneOfTwoForm(VoteForm):
-    choices = forms.ModelChoiceField(
-        queryset=None,
+    choices = forms.TypedChoiceField(
+        coerce=int,
         widget=forms.RadioSelect(
             attrs={
                 'class': 'btn-check',
@@ -112,18 +121,22 @@ class VoteOneOfTwoForm(VoteForm):
 
 
 class VoteOneOfManyForm(VoteForm):
-    choices = forms.ModelChoiceField(
-        queryset=None,
+    choices = forms.TypedChoiceField(
+        coerce=int,
         widget=forms.RadioSelect,
     )
 
 
 class VoteManyOfManyForm(VoteForm):
-    choices = forms.ModelMultipleChoiceField(
-        queryset=None,
+    choices = forms.TypedMultipleChoiceField(
+        coerce=int,
         widget=forms.CheckboxSelectMultiple,
     )
 
+    def clean_choices(self):
+        # a repeated id would count the same variant several times in one ballot
+        return list(dict.fromkeys(self.cleaned_data['choices']))
+
 
 class ProfileEditForm(forms.Form):
     name = forms.CharField(
@@ -228,26 +241,6 @@ class CustomRegistrationForm(RegistrationForm):
         }
 
 
-class VotingSearchForm(forms.Form):
-    def clean(self):
-        cleaned_data = super(VotingSearchForm, self).clean()
-        voting_id = cleaned_data.get('voting_id')
-        try:
-            Voting.objects.get(id=voting_id)
-        except Voting.DoesNotExist:
-            raise ValidationError('Опроса с таким ID не существует')
-
-    voting_id = forms.IntegerField(
-        widget=forms.NumberInput(attrs={
-            'class': "form-control",
-            'placeholder': "Введите ID опроса",
-            'style': "font-size: 1.2rem;",
-            'required': 'true'
-        }),
-        label=''
-    )
-
-
 class VotingEditForm(forms.ModelForm):
     description = forms.CharField(widget=forms.Textarea(
         attrs={'rows': "5"}
@@ -0,0 +1,161 @@
+import hashlib
+import io
+import logging
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from main.spool import Spool
+
+logger = logging.getLogger(__name__)
+
+RENDITION_FORMATS = {
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+
+
+def get_spool():
+    return Spool(settings.IMAGE_SPOOL_PATH)
+
+
+def rendition_name(name, token, width, extension):
+    stem = os.path.splitext(name)[0]
+    return f'renditions/{stem}-{token}-{width}.{extension}'
+
+
+def rendition_names(renditions):
+    return [
+        rendition_name(renditions['name'], renditions['token'], width, extension)
+        for width in renditions.get('widths', ()) for extension in RENDITION_FORMATS
+    ]
+
+
+def remember_image(instance, field_name):
+    """
+    keep the image name an instance was loaded with, called after the instance is initialized
+    """
+    # the raw value, reading a deferred field would query
+    if field_name in instance.__dict__:
+        name = instance.__dict__[field_name]
+        instance._loaded_image = getattr(name, 'name', name) or ''
+
+
+def enqueue_renditions(instance, field_name):
+    """
+    schedule resizing of a newly uploaded image, called after the instance is saved;
+    renditions of a removed image are deleted right away
+    """
+    image = getattr(instance, field_name)
+    renditions = instance.image_renditions
+    if not image:
+        if renditions:
+            type(instance).objects.filter(pk=instance.pk).update(image_renditions={})
+            instance.image_renditions = {}
+            transaction.on_commit(lambda: delete_renditions(renditions))
+        return
+    # saves that leave the image as it was loaded, e.g. of last_login, queue nothing
+    if image.name in (renditions.get('name'), getattr(instance, '_loaded_image', None)):
+        return
+    instance._loaded_image = image.name
+    payload = {
+        'model': instance._meta.label_lower,
+        'pk': instance.pk,
+        'field': field_name,
+        'name': image.name,
+    }
+    transaction.on_commit(lambda: get_spool().append(payload))
+
+
+def delete_renditions(renditions):
+    for name in rendition_names(renditions) if renditions else ():
+        default_storage.delete(name)
+
+
+def render(image: Image.Image, width, file_format, options):
+    resized = image.copy()
+    resized.thumbnail((width, width * 10), Image.LANCZOS)
+    if file_format == 'JPEG' and resized.mode != 'RGB':
+        # JPEG has no alpha channel, flatten on white like the page background
+        background = Image.new('RGB', resized.size, 'white')
+        background.paste(resized, mask=resized.convert('RGBA').getchannel('A'))
+        resized = background
+    buffer = io.BytesIO()
+    resized.save(buffer, file_format, **options)
+    return buffer.getvalue()
+
+
+def create_renditions(name):
+    """
+    write JPEG and WebP variants of an image at every configured width smaller than the original
+    :return: description of the written renditions, stored in the image_renditions field
+    """
+    with default_storage.open(name, 'rb') as file:
+        content = file.read()
+    # names carry a content hash so they can be cached forever
+    token = hashlib.sha1(content).hexdigest()[:10]
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(content)))
+    widths = [width for width in settings.IMAGE_RENDITION_WIDTHS if width < image.width]
+    for width in widths:
+        for extension, (file_format, options) in RENDITION_FORMATS.items():
+            target = rendition_name(name, token, width, extension)
+            if not default_storage.exists(target):
+                default_storage.save(target, ContentFile(render(image, width, file_format, options)))
+    return {'name': name, 'token': token, 'width': image.width, 'widths': widths}
+
+
+def process(payload):
+    """
+    :return: True if renditions were written, False if the image was replaced or removed meanwhile
+    """
+    model = apps.get_model(payload['model'])
+    instance = model.objects.filter(pk=payload['pk']).first()
+    if instance is None or getattr(instance, payload['field']).name != payload['name']:
+        return False
+    renditions = create_renditions(payload['name'])
+    model.objects.filter(pk=instance.pk).update(image_renditions=renditions)
+    if instance.image_renditions.get('token') != renditions['token']:
+        delete_renditions(instance.image_renditions)
+    if model._meta.label_lower == 'main.voting':
+        from main.page_cache import forget_voting_pages
+        forget_voting_pages(instance.pk)
+    return True
+
+
+def srcset(image, renditions, extension):
+    """
+    :return: srcset attribute value listing renditions of the image in one format,
+    empty if they were not created yet
+    """
+    if not image or not renditions or renditions.get('name') != image.name:
+        return ''
+    candidates = [
+        f'{default_storage.url(rendition_name(image.name, renditions["token"], width, extension))} {width}w'
+        for width in renditions['widths']
+    ]
+    if extension == 'jpg':
+        candidates.append(f'{default_storage.url(image.name)} {renditions["width"]}w')
+    return ', '.join(candidates)
+
+
+def drain(batch_size):
+    """
+    :return: (number of processed jobs, number of images resized)
+    """
+    spool = get_spool()
+    # claimed items are not handed to another worker until the lease runs out
+    items = spool.claim(batch_size, settings.IMAGE_SPOOL_LEASE)
+    resized = 0
+    for item_id, _, payload in items:
+        try:
+            resized += process(payload)
+        except (OSError, ValueError, Image.DecompressionBombError) as error:
+            # an unreadable or oversized upload must not block the queue, the original is served instead
+            logger.warning('could not resize %s: %s', payload['name'], error)
+        spool.ack([item_id])
+    return len(items), resized
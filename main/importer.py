@@ -0,0 +1,191 @@
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from main.models import Voting, User
+from main.series import forget_series
+from main.services import check_variants, create_votings
+
+TYPES = {
+    'checkboxes': Voting.CHECKBOXES,
+    'radios': Voting.RADIOS,
+    'buttons': Voting.BUTTONS,
+}
+# separator of variants in a CSV cell
+CSV_VARIANT_SEPARATOR = '|'
+READ_SIZE = 64 * 1024
+
+
+class MalformedFile(ValueError):
+    pass
+
+
+def iter_json(file):
+    """
+    records of a JSON array or of JSON lines, decoded one by one without loading the whole file
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    while True:
+        # skip whitespace and the array punctuation between records
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+            position += 1
+        if position == len(buffer):
+            if eof:
+                return
+            buffer, position = file.read(READ_SIZE), 0
+            eof = not buffer
+            continue
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise MalformedFile(f'malformed JSON near: {buffer[position:position + 50]!r}')
+            chunk = file.read(READ_SIZE)
+            buffer, position, eof = buffer[position:] + chunk, 0, not chunk
+            continue
+        position = end
+        yield record
+
+
+def iter_csv(file):
+    for record in csv.DictReader(file):
+        record['variants'] = [
+            variant.strip() for variant in (record.get('variants') or '').split(CSV_VARIANT_SEPARATOR) if variant.strip()
+        ]
+        yield {name: value for name, value in record.items() if value not in ('', None)}
+
+
+def iter_records(file, file_format):
+    return iter_csv(file) if file_format == 'csv' else iter_json(file)
+
+
+def parse_time(value, name):
+    moment = parse_datetime(str(value)) if value else None
+    if moment is None:
+        raise ValidationError(f'{name}: expected ISO 8601 date and time, got {value!r}')
+    return moment if timezone.is_aware(moment) else timezone.make_aware(moment)
+
+
+def parse_type(value):
+    if str(value).lower() in TYPES:
+        return TYPES[str(value).lower()]
+    if str(value).isdigit() and int(value) in TYPES.values():
+        return int(value)
+    raise ValidationError(f'type: expected one of {", ".join(TYPES)}, got {value!r}')
+
+
+class VotingImport:
+    """
+    imports votings in batches: every batch is validated with one query for its authors
+    and written in its own transaction, next/prev links between imported votings
+    are set after all of them exist
+    :param dry_run: validate everything without writing
+    """
+
+    def __init__(self, dry_run=False, batch_size=500):
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.errors = []
+        self.created = 0
+        # import key -> voting id (None in dry run)
+        self.keys = {}
+        self.links = []
+        self.authors = {}
+
+    def run(self, records):
+        batch = []
+        for row, record in enumerate(records, start=1):
+            batch.append((row, record))
+            if len(batch) == self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        self.link()
+        return self
+
+    def load_authors(self, batch):
+        usernames = {record.get('author') for _, record in batch if isinstance(record, dict)} - set(self.authors)
+        self.authors.update(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+
+    def validate(self, row, record):
+        """
+        :return: (key, unsaved Voting, variants) built from a record
+        """
+        if not isinstance(record, dict):
+            raise ValidationError('record must be an object')
+        missing = [name for name in ('name', 'author', 'finishes', 'variants') if not record.get(name)]
+        if missing:
+            raise ValidationError(f'missing fields: {", ".join(missing)}')
+        key = str(record.get('key', f'row-{row}'))
+        if key in self.keys:
+            raise ValidationError(f'duplicate key {key!r}')
+        if record['author'] not in self.authors:
+            raise ValidationError(f'unknown author {record["author"]!r}')
+        voting = Voting(
+            name=record['name'],
+            description=record.get('description', ''),
+            author_id=self.authors[record['author']],
+            type=parse_type(record.get('type', 'checkboxes')),
+            published=parse_time(record['published'], 'published') if record.get('published') else timezone.now(),
+            finishes=parse_time(record['finishes'], 'finishes'),
+        )
+        variants = record['variants']
+        if not isinstance(variants, list) or not all(isinstance(variant, str) and variant for variant in variants):
+            raise ValidationError('variants must be a list of non-empty strings')
+        check_variants(voting.type, variants)
+        voting.full_clean(exclude=['author', 'next_voting', 'prev_voting', 'image'])
+        if voting.published >= voting.finishes:
+            raise ValidationError('finishes must be later than published')
+        return key, voting, variants
+
+    def import_batch(self, batch):
+        self.load_authors(batch)
+        valid = []
+        for row, record in batch:
+            try:
+                key, voting, variants = self.validate(row, record)
+            except ValidationError as error:
+                self.errors.append((row, record.get('key') if isinstance(record, dict) else None,
+                                    '; '.join(error.messages)))
+                continue
+            self.keys[key] = None
+            valid.append((row, key, record, voting, variants))
+
+        if not self.dry_run and valid:
+            create_votings([(voting, variants) for _, _, _, voting, variants in valid])
+        for row, key, record, voting, _ in valid:
+            self.keys[key] = voting.id
+            if record.get('next') or record.get('prev'):
+                self.links.append((row, key, record.get('next'), record.get('prev')))
+        self.created += len(valid)
+
+    def link(self):
+        """
+        second pass: resolve next/prev keys to ids of imported votings
+        """
+        updates, targets = {'next': [], 'prev': []}, {'next': set(), 'prev': set()}
+        for row, key, next_key, prev_key in self.links:
+            for name, target in (('next', next_key), ('prev', prev_key)):
+                if target is None:
+                    continue
+                target = str(target)
+                if target not in self.keys:
+                    self.errors.append((row, key, f'{name}: unknown key {target!r}'))
+                elif target == key:
+                    self.errors.append((row, key, f'{name}: a voting can not follow itself'))
+                elif target in targets[name]:
+                    self.errors.append((row, key, f'{name}: {target!r} is already linked'))
+                else:
+                    targets[name].add(target)
+                    updates[name].append(Voting(id=self.keys[key], **{f'{name}_voting_id': self.keys[target]}))
+
+        if not self.dry_run:
+            for name, votings in updates.items():
+                Voting.objects.bulk_update(votings, [f'{name}_voting'], batch_size=self.batch_size)
+            if updates['next'] or updates['prev']:
+                forget_series()
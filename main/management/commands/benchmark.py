@@ -0,0 +1,224 @@
+import datetime
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from main.models import Voting, VoteVariant, VoteFact, VotingParticipation, UserProfile, User
+from main.tallies import rebuild_tallies
+
+VIEWS = ('vote', 'results_page', 'voting_page', 'profile', 'votings_list')
+
+
+class Command(BaseCommand):
+    help = 'Seed a synthetic dataset in a throwaway test database and time the voting hot paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--votings', type=int, default=10000)
+        parser.add_argument('--facts', type=int, default=1000000)
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--requests', type=int, default=200,
+                            help='number of timed requests per view')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='rows per bulk_create call while seeding')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='write results as JSON to this file')
+        parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='relative p95 growth reported as a regression')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            started = time.monotonic()
+            self.seed(options)
+            self.stdout.write(f'seeded dataset in {time.monotonic() - started:.1f}s')
+            results = {
+                'meta': {
+                    'created': timezone.now().isoformat(),
+                    'django': django.get_version(),
+                    'vendor': connection.vendor,
+                    'votings': options['votings'],
+                    'facts': options['facts'],
+                    'users': options['users'],
+                    'requests': options['requests'],
+                },
+                'views': {name: self.measure(name, options['requests']) for name in VIEWS},
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for name, stats in results['views'].items():
+            self.stdout.write(
+                f'{name:<14} p50 {stats["p50_ms"]:8.2f}ms  p95 {stats["p95_ms"]:8.2f}ms  '
+                f'queries {stats["queries"]:6.1f}  peak {stats["peak_kb"]:9.1f}KiB'
+            )
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+        if options['compare']:
+            with open(options['compare']) as file:
+                regressions = self.compare(json.load(file), results, options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'{len(regressions)} regressions found')
+
+    def seed(self, options):
+        now = timezone.now()
+        batch_size = options['batch_size']
+        password = make_password('benchmark')
+
+        # explicit ids let every backend link rows without reading them back
+        users = [
+            User(id=i, username=f'user{i}', email=f'user{i}@example.com', password=password)
+            for i in range(1, options['users'] + 1)
+        ]
+        User.objects.bulk_create(users, batch_size=batch_size)
+        UserProfile.objects.bulk_create([UserProfile(user_id=user.id) for user in users], batch_size=batch_size)
+        del users
+
+        votings, variants = [], []
+        variant_id = 0
+        self.variants = {}
+        for voting_id in range(1, options['votings'] + 1):
+            published = now - datetime.timedelta(days=self.random.randint(1, 60))
+            # most polls are still open, the rest finished
+            if self.random.random() < 0.8:
+                finishes = now + datetime.timedelta(days=self.random.randint(1, 30))
+            else:
+                finishes = published + datetime.timedelta(hours=self.random.randint(1, 24))
+            votings.append(Voting(
+                id=voting_id,
+                name=f'Voting {voting_id}',
+                description='Synthetic voting',
+                author_id=self.random.randint(1, options['users']),
+                type=self.random.choice((Voting.CHECKBOXES, Voting.RADIOS, Voting.BUTTONS)),
+                published=published,
+                finishes=finishes,
+            ))
+            ids = []
+            for number in range(2 if votings[-1].type == Voting.BUTTONS else self.random.randint(2, 5)):
+                variant_id += 1
+                ids.append(variant_id)
+                variants.append(VoteVariant(id=variant_id, voting_id=voting_id, description=f'Variant {number}'))
+            self.variants[voting_id] = ids
+        Voting.objects.bulk_create(votings, batch_size=batch_size)
+        VoteVariant.objects.bulk_create(variants, batch_size=batch_size)
+        self.votings = {voting.id: voting for voting in votings}
+        del variants
+
+        through = VoteFact.variants.through
+        for start in range(1, options['facts'] + 1, batch_size):
+            facts, links, participations = [], [], []
+            for fact_id in range(start, min(start + batch_size, options['facts'] + 1)):
+                voting_id = self.random.randint(1, options['votings'])
+                user_id = self.random.randint(1, options['users']) if self.random.random() < 0.7 else None
+                facts.append(VoteFact(
+                    id=fact_id,
+                    voting_id=voting_id,
+                    user_id=user_id,
+                    created=now - datetime.timedelta(minutes=self.random.randint(0, 60 * 24 * 30)),
+                ))
+                links.append(through(votefact_id=fact_id, votevariant_id=self.random.choice(self.variants[voting_id])))
+                if user_id is not None:
+                    participations.append(VotingParticipation(voting_id=voting_id, user_id=user_id))
+            VoteFact.objects.bulk_create(facts)
+            through.objects.bulk_create(links)
+            VotingParticipation.objects.bulk_create(participations, ignore_conflicts=True)
+        rebuild_tallies(batch_size=batch_size)
+        with connection.cursor() as cursor:
+            models = [User, UserProfile, Voting, VoteVariant, VoteFact, VotingParticipation]
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+        self.open_votings = [voting.id for voting in votings if voting.finishes > now]
+        self.users = options['users']
+
+    def requests(self, name, count):
+        """
+        :return: list of (client, method, url, data) tuples for one view
+        """
+        requests = []
+        for _ in range(count):
+            client, data, method = Client(), None, 'get'
+            if name == 'vote':
+                voting_id = self.random.choice(self.open_votings)
+                url = reverse('vote', kwargs={'id': voting_id})
+                method = 'post'
+                data = {'choices': [self.random.choice(self.variants[voting_id])]}
+            elif name in ('results_page', 'voting_page'):
+                url = reverse(name, kwargs={'id': self.random.randint(1, len(self.votings))})
+            elif name == 'profile':
+                user = User.objects.get(id=self.random.randint(1, self.users))
+                client.force_login(user)
+                url = reverse('profile', kwargs={'id': user.id})
+            else:
+                client.force_login(self.votings[self.random.randint(1, len(self.votings))].author)
+                url = reverse(name)
+            requests.append((client, method, url, data))
+        return requests
+
+    def measure(self, name, count):
+        timings, queries = [], []
+        for client, method, url, data in self.requests(name, count):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise CommandError(f'{method.upper()} {url} returned {response.status_code}')
+            queries.append(len(context))
+
+        # memory is traced in a separate pass, tracing slows the interpreter down
+        peaks = []
+        for client, method, url, data in self.requests(name, max(count // 10, 1)):
+            tracemalloc.start()
+            getattr(client, method)(url, data)
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+            tracemalloc.stop()
+
+        return {
+            'p50_ms': percentile(timings, 50),
+            'p95_ms': percentile(timings, 95),
+            'queries': statistics.mean(queries),
+            'max_queries': max(queries),
+            'peak_kb': max(peaks),
+        }
+
+    def compare(self, baseline, results, threshold):
+        regressions = []
+        for name, stats in results['views'].items():
+            before = baseline['views'].get(name)
+            if before is None:
+                continue
+            if stats['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                regressions.append(f'{name}: p95 {before["p95_ms"]:.2f}ms -> {stats["p95_ms"]:.2f}ms')
+            if stats['max_queries'] > before['max_queries']:
+                regressions.append(f'{name}: queries {before["max_queries"]} -> {stats["max_queries"]}')
+            if stats['peak_kb'] > before['peak_kb'] * (1 + threshold):
+                regressions.append(f'{name}: peak memory {before["peak_kb"]:.1f}KiB -> {stats["peak_kb"]:.1f}KiB')
+        for regression in regressions:
+            self.stdout.write(self.style.ERROR(f'REGRESSION {regression}'))
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('No regressions'))
+        return regressions
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return values[index]
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from main.rollups import compact_rollups
+
+
+class Command(BaseCommand):
+    help = 'Merge minute vote rollups older than ROLLUP_MINUTE_RETENTION into hourly ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='number of minute buckets merged per transaction')
+
+    def handle(self, *args, **options):
+        merged = compact_rollups(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Merged {merged} minute buckets'))
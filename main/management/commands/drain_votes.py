@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.vote_queue import drain, queue_lag
+
+
+class Command(BaseCommand):
+    help = 'Write queued ballots from the vote spool to the database in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='maximum number of ballots written per transaction')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='seconds to sleep when the spool is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='drain the spool and exit instead of waiting for new ballots')
+        parser.add_argument('--stats', action='store_true',
+                            help='only report queue depth and lag')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            depth, lag = queue_lag()
+            self.stdout.write(f'queued: {depth}, lag: {lag:.1f}s')
+            return
+
+        total = 0
+        started = time.monotonic()
+        while True:
+            batch_started = time.monotonic()
+            processed, written, oldest = drain(options['batch_size'])
+            if not processed:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+            elapsed = time.monotonic() - batch_started
+            total += processed
+            depth, _ = queue_lag()
+            self.stdout.write(
+                f'batch: {processed} ballots ({written} written) in {elapsed:.3f}s, '
+                f'{processed / elapsed:.0f} ballots/s, lag: {time.time() - oldest:.1f}s, queued: {depth}'
+            )
+
+        elapsed = time.monotonic() - started
+        if total:
+            self.stdout.write(self.style.SUCCESS(
+                f'Drained {total} ballots in {elapsed:.1f}s ({total / elapsed:.0f} ballots/s)'
+            ))
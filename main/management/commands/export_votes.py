@@ -0,0 +1,27 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.export import EXPORT_FORMATS, export_votes
+from main.models import Voting
+
+
+class Command(BaseCommand):
+    help = 'Stream raw votes of a voting as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('voting_id', type=int)
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help='file to write to, stdout by default')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='number of votes read per query')
+
+    def handle(self, *args, **options):
+        if not Voting.objects.filter(id=options['voting_id']).exists():
+            raise CommandError(f'Voting {options["voting_id"]} does not exist')
+        lines = export_votes(options['voting_id'], options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as file:
+                file.writelines(lines)
+        else:
+            sys.stdout.writelines(lines)
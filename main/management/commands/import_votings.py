@@ -0,0 +1,59 @@
+import csv
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.importer import CSV_VARIANT_SEPARATOR, MalformedFile, VotingImport, iter_records
+
+
+class Command(BaseCommand):
+    help = (
+        'Import votings from a JSON array, JSON lines or CSV file. Every record has name, description, '
+        'author (username), type (checkboxes, radios or buttons), published, finishes (ISO 8601), '
+        f'variants (a list, "{CSV_VARIANT_SEPARATOR}"-separated in CSV) and optional key, next and prev: '
+        'keys of other imported votings forming a series'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('json', 'csv'),
+                            help='file format, guessed from the extension by default')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='number of votings validated and written per transaction')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only validate the file and report errors')
+        parser.add_argument('--report', help='write rejected rows as CSV to this file instead of stderr')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('csv' if options['path'].lower().endswith('.csv') else 'json')
+        if not os.path.exists(options['path']):
+            raise CommandError(f'{options["path"]} does not exist')
+
+        started = time.monotonic()
+        importer = VotingImport(dry_run=options['dry_run'], batch_size=options['batch_size'])
+        with open(options['path'], encoding='utf-8-sig', newline='') as file:
+            try:
+                importer.run(iter_records(file, file_format))
+            except MalformedFile as error:
+                raise CommandError(f'{error}, {importer.created} votings were imported before it')
+
+        if importer.errors:
+            if options['report']:
+                with open(options['report'], 'w', encoding='utf-8', newline='') as report:
+                    self.write_report(report, importer.errors)
+            else:
+                self.write_report(sys.stderr, importer.errors)
+
+        action = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {importer.created} votings in {time.monotonic() - started:.1f}s, '
+            f'{len(importer.errors)} errors'
+        ))
+
+    @staticmethod
+    def write_report(file, errors):
+        writer = csv.writer(file)
+        writer.writerow(('row', 'key', 'error'))
+        writer.writerows(errors)
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.images import drain
+
+
+class Command(BaseCommand):
+    help = 'Create resized JPEG and WebP variants of uploaded images queued in the image spool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help='number of queued images taken from the spool at once')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='seconds to sleep when the spool is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='process the spool and exit instead of waiting for new uploads')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            started = time.monotonic()
+            processed, resized = drain(options['batch_size'])
+            if not processed:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+            total += resized
+            self.stdout.write(f'batch: {processed} jobs ({resized} images resized) in {time.monotonic() - started:.2f}s')
+
+        self.stdout.write(self.style.SUCCESS(f'Resized {total} images'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from main.tallies import rebuild_tallies
+
+
+class Command(BaseCommand):
+    help = 'Rebuild denormalized vote tallies from the raw VoteFact rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('voting_ids', nargs='*', type=int,
+                            help='ids of the votings to rebuild, all votings by default')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='number of votings rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        total = rebuild_tallies(options['voting_ids'] or None, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt tallies for {total} votings'))
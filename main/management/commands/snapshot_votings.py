@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from main.snapshots import create_due_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Freeze results of finished votings into immutable snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='number of votings snapshotted per query batch')
+
+    def handle(self, *args, **options):
+        created = create_due_snapshots(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Created {created} snapshots'))
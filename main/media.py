@@ -0,0 +1,95 @@
+import mimetypes
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, quote_etag
+
+# renditions written by main.images carry a hash of the image, their content never changes
+IMMUTABLE_NAME = re.compile(r'^renditions/.+-[0-9a-f]{10}-\d+\.(jpg|webp)$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def cache_control(path):
+    if IMMUTABLE_NAME.match(path):
+        return f'public, max-age={settings.MEDIA_IMMUTABLE_MAX_AGE}, immutable'
+    return f'public, max-age={settings.MEDIA_MAX_AGE}'
+
+
+def file_etag(stat):
+    return quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+
+
+def parse_range(header, size):
+    """
+    :return: (start, end) of a single byte range, None to send the whole file
+    or False if the range can not be satisfied
+    """
+    match = RANGE.match(header.replace(' ', ''))
+    # several ranges are rare for images, the whole file is a valid answer to them
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def read_range(path, start, end):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        left = end - start + 1
+        while left > 0:
+            chunk = file.read(min(CHUNK_SIZE, left))
+            if not chunk:
+                return
+            left -= len(chunk)
+            yield chunk
+
+
+def accel_response(path, full_path):
+    """
+    response handing the transfer of the file over to the front web server
+    """
+    response = HttpResponse(content_type=mimetypes.guess_type(full_path)[0] or 'application/octet-stream')
+    if settings.MEDIA_SERVE_MODE == 'nginx':
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(path)
+    else:
+        response['X-Sendfile'] = full_path
+    return response
+
+
+def file_response(request, full_path, stat):
+    """
+    response sending the file from python, supports single byte ranges
+    """
+    etag = file_etag(stat)
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    byte_range = None
+    if 'HTTP_RANGE' in request.META:
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range is None or etag in parse_etags(if_range):
+            byte_range = parse_range(request.META['HTTP_RANGE'], stat.st_size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+    elif byte_range is not None:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_range(full_path, start, end), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
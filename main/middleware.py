@@ -0,0 +1,87 @@
+import logging
+import time
+from contextlib import ExitStack
+from fnmatch import fnmatchcase
+
+from django.conf import settings
+from django.db import connections
+
+from main.db_router import RequestDatabases, request_databases
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class QueryBudgetMiddleware:
+    """
+    reports number and total time of SQL queries of every request in
+    X-Query-Count/X-Query-Time headers and warns when a view exceeds its budget
+    from QUERY_BUDGETS (keyed by url name)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+
+        response['X-Query-Count'] = str(counter.count)
+        response['X-Query-Time'] = f'{counter.duration * 1000:.1f}ms'
+
+        url_name = request.resolver_match.view_name if request.resolver_match else None
+        budget = settings.QUERY_BUDGETS.get(url_name, settings.QUERY_BUDGET_DEFAULT)
+        if budget is not None and counter.count > budget:
+            logger.warning(
+                '%s %s (%s) made %d queries in %.1fms, budget is %d',
+                request.method, request.path, url_name, counter.count, counter.duration * 1000, budget,
+            )
+        return response
+
+
+class ReplicaMiddleware:
+    """
+    sends reads of GET requests to views in REPLICA_VIEWS (url names, shell patterns allowed)
+    to the REPLICA_DATABASE. A browser that has just written anything reads from the primary
+    for REPLICA_PIN_SECONDS, so e.g. the results page after a vote already counts it
+    """
+    pin_cookie = 'primary_pin'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        databases = RequestDatabases()
+        token = request_databases.set(databases)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_databases.reset(token)
+        if databases.wrote or request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(self.pin_cookie, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ('GET', 'HEAD') or self.pin_cookie in request.COOKIES:
+            return None
+        view_name = request.resolver_match.view_name
+        if any(fnmatchcase(view_name, pattern) for pattern in settings.REPLICA_VIEWS):
+            request_databases.get().read = settings.REPLICA_DATABASE
+        return None
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.20 on 2026-10-18 05:38
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_tallies(apps, schema_editor):
+    Voting = apps.get_model('main', 'Voting')
+    VoteVariant = apps.get_model('main', 'VoteVariant')
+    for variant in VoteVariant.objects.annotate(total=Count('votefact')).iterator():
+        VoteVariant.objects.filter(id=variant.id).update(votes=variant.total)
+    for voting in Voting.objects.annotate(total=Count('votevariant__votefact', distinct=True)).iterator():
+        Voting.objects.filter(id=voting.id).update(voters=voting.total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_alter_votefact_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='votevariant',
+            name='votes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='voting',
+            name='voters',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_tallies, migrations.RunPython.noop),
+    ]
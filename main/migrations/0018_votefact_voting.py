@@ -0,0 +1,51 @@
+# Generated by Django 3.2.20 on 2026-10-18 05:38
+
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+
+BACKFILL_CHUNK_SIZE = 2000
+
+
+def fill_votefact_voting(apps, schema_editor):
+    VoteFact = apps.get_model('main', 'VoteFact')
+    through = VoteFact.variants.through
+    db = schema_editor.connection.alias
+    last_id = 0
+    while True:
+        ids = list(
+            VoteFact.objects.using(db).filter(id__gt=last_id)
+            .order_by('id').values_list('id', flat=True)[:BACKFILL_CHUNK_SIZE]
+        )
+        if not ids:
+            break
+        last_id = ids[-1]
+        by_voting = {}
+        rows = through.objects.using(db).filter(votefact_id__in=ids) \
+            .values_list('votefact_id', 'votevariant__voting_id').distinct()
+        for votefact_id, voting_id in rows:
+            by_voting.setdefault(voting_id, []).append(votefact_id)
+        with transaction.atomic(using=db):
+            for voting_id, votefact_ids in by_voting.items():
+                VoteFact.objects.using(db).filter(id__in=votefact_ids).update(voting_id=voting_id)
+
+
+class Migration(migrations.Migration):
+    # backfill commits chunk by chunk instead of holding one huge transaction
+    atomic = False
+
+    dependencies = [
+        ('main', '0017_vote_tallies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='votefact',
+            name='voting',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='main.voting'),
+        ),
+        migrations.RunPython(fill_votefact_voting, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='votefact',
+            index=models.Index(fields=['voting', 'user'], name='main_votefact_voting_user'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-18 05:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_votefact_voting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voting',
+            name='tally_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
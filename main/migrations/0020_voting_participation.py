@@ -0,0 +1,49 @@
+# Generated by Django 3.2.20 on 2026-10-18 05:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import Min
+
+BACKFILL_CHUNK_SIZE = 2000
+
+
+def fill_participations(apps, schema_editor):
+    VoteFact = apps.get_model('main', 'VoteFact')
+    VotingParticipation = apps.get_model('main', 'VotingParticipation')
+    db = schema_editor.connection.alias
+    facts = VoteFact.objects.using(db).filter(user__isnull=False, voting__isnull=False) \
+        .values('user_id', 'voting_id').annotate(created=Min('created')).order_by('user_id', 'voting_id')
+    chunk = []
+    for row in facts.iterator(chunk_size=BACKFILL_CHUNK_SIZE):
+        chunk.append(VotingParticipation(**row))
+        if len(chunk) == BACKFILL_CHUNK_SIZE:
+            VotingParticipation.objects.using(db).bulk_create(chunk, ignore_conflicts=True)
+            chunk = []
+    VotingParticipation.objects.using(db).bulk_create(chunk, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0019_voting_tally_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VotingParticipation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participations', to=settings.AUTH_USER_MODEL)),
+                ('voting', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participations', to='main.voting')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='votingparticipation',
+            constraint=models.UniqueConstraint(fields=('user', 'voting'), name='main_participation_user_voting'),
+        ),
+        migrations.RunPython(fill_participations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.20 on 2026-10-18 05:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_voting_participation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='voting',
+            index=models.Index(fields=['author', 'published'], name='main_voting_author_published'),
+        ),
+    ]
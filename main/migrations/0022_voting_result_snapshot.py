@@ -0,0 +1,25 @@
+# Generated by Django 3.2.20 on 2026-10-18 05:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0021_voting_author_published'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VotingResultSnapshot',
+            fields=[
+                ('voting', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='main.voting')),
+                ('facts', models.JSONField()),
+                ('voters', models.PositiveIntegerField()),
+                ('chart', models.TextField(blank=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.20 on 2026-10-18 05:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0022_voting_result_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='voting',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.20 on 2026-10-18 06:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0023_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VotingRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.PositiveSmallIntegerField(choices=[(0, 'Minute'), (1, 'Hour')])),
+                ('bucket', models.DateTimeField()),
+                ('voters', models.PositiveIntegerField(default=0)),
+                ('voting', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='main.voting')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VariantRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.PositiveSmallIntegerField(choices=[(0, 'Minute'), (1, 'Hour')])),
+                ('bucket', models.DateTimeField()),
+                ('votes', models.PositiveIntegerField(default=0)),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='main.votevariant')),
+                ('voting', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variant_rollups', to='main.voting')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='votingrollup',
+            constraint=models.UniqueConstraint(fields=('voting', 'granularity', 'bucket'), name='main_votingrollup_bucket'),
+        ),
+        migrations.AddIndex(
+            model_name='variantrollup',
+            index=models.Index(fields=['voting', 'granularity', 'bucket'], name='main_variantrollup_voting'),
+        ),
+        migrations.AddConstraint(
+            model_name='variantrollup',
+            constraint=models.UniqueConstraint(fields=('variant', 'granularity', 'bucket'), name='main_variantrollup_bucket'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.20 on 2026-10-18 06:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0024_vote_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='votefact',
+            index=models.Index(fields=['created'], name='main_votefact_created'),
+        ),
+        migrations.AddIndex(
+            model_name='voting',
+            index=models.Index(fields=['published'], name='main_voting_published'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.20 on 2026-10-18 06:40
+
+from django.db import migrations, OperationalError
+
+
+def create_search_index(apps, schema_editor):
+    """
+    FTS5 table on SQLite, FULLTEXT index on MySQL, other databases search without an index
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE main_voting_fts USING fts5(name, description, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        except OperationalError:
+            # SQLite built without FTS5
+            return
+        schema_editor.execute(
+            'INSERT INTO main_voting_fts (rowid, name, description) SELECT id, name, description FROM main_voting'
+        )
+    elif vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE main_voting ADD FULLTEXT INDEX main_voting_search (name, description)')
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS main_voting_fts')
+    elif vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE main_voting DROP INDEX main_voting_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0025_admin_date_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
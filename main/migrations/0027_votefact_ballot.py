@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-18 06:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0026_voting_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='votefact',
+            name='ballot',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True, unique=True),
+        ),
+    ]
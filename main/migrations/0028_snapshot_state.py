@@ -0,0 +1,28 @@
+# Generated by Django 3.2.20 on 2026-10-18 06:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0027_votefact_ballot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='votingresultsnapshot',
+            name='finishes',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='votingresultsnapshot',
+            name='tally_version',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='votingresultsnapshot',
+            name='turnout',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -19,6 +19,8 @@ class Voting(models.Model):
     published = models.DateTimeField(default=timezone.now, blank=False)
     finishes = models.DateTimeField(blank=False)
     image = models.ImageField(upload_to='votings', blank=True, null=True)
+    # resized variants of image written by main.images, see IMAGE_RENDITION_WIDTHS
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     next_voting = models.OneToOneField(
         "Voting",
         on_delete=models.PROTECT,
@@ -33,6 +35,19 @@ class Voting(models.Model):
         null=True,
         related_name='previous_voting',
     )
+    # denormalized number of accepted ballots, maintained by main.tallies
+    voters = models.PositiveIntegerField(default=0, editable=False)
+    # bumped on every tally change, used to version cached results
+    tally_version = models.PositiveIntegerField(default=0, editable=False)
+
+    NOT_STARTED, IN_PROGRESS, FINISHED = 0, 1, 2
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['author', 'published'], name='main_voting_author_published'),
+            # date hierarchy of the admin changelist
+            models.Index(fields=['published'], name='main_voting_published'),
+        ]
 
     def __str__(self):
         return self.name
@@ -41,20 +56,109 @@ class Voting(models.Model):
 class VoteVariant(models.Model):
     voting = models.ForeignKey(Voting, on_delete=models.CASCADE)
     description = models.CharField(max_length=200)
+    # denormalized number of ballots that chose this variant, maintained by main.tallies
+    votes = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.description
 
 
 class VoteFact(models.Model):
+    """
+    one accepted ballot, the tallies are counted from these rows. The admin recounts the tallies
+    after changing them, other deletions (a cascade from a deleted user in the shell) must be
+    followed by rebuild_tallies and rebuild_rollups
+    """
+    voting = models.ForeignKey(Voting, on_delete=models.CASCADE, blank=True, null=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True)
     variants = models.ManyToManyField(VoteVariant)
     created = models.DateTimeField(default=timezone.now)
+    # token of a ballot written from the vote queue, keeps a ballot from being written twice
+    ballot = models.CharField(max_length=32, blank=True, null=True, unique=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['voting', 'user'], name='main_votefact_voting_user'),
+            # date hierarchy of the admin changelist
+            models.Index(fields=['created'], name='main_votefact_created'),
+        ]
+
+
+class VotingParticipation(models.Model):
+    """
+    one row per (user, voting) pair, written in the same transaction as the user's VoteFact,
+    the unique constraint rejects a second vote of the same user at the database level
+    """
+    voting = models.ForeignKey(Voting, on_delete=models.CASCADE, related_name='participations')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='participations')
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'voting'], name='main_participation_user_voting'),
+        ]
+
+
+class VotingResultSnapshot(models.Model):
+    """
+    results of a finished voting frozen once, served instead of recounting the tallies
+    """
+    voting = models.OneToOneField(Voting, on_delete=models.CASCADE, primary_key=True, related_name='snapshot')
+    # list of [variant description, number of votes] pairs in variant order
+    facts = models.JSONField()
+    voters = models.PositiveIntegerField()
+    chart = models.TextField(blank=True)
+    turnout = models.TextField(blank=True, default='')
+    # state of the voting the results were frozen at, a snapshot of another state is stale
+    finishes = models.DateTimeField(null=True)
+    tally_version = models.PositiveIntegerField(null=True)
+    created = models.DateTimeField(default=timezone.now)
+
+
+class VotingRollup(models.Model):
+    """
+    number of ballots of a voting cast within a minute or an hour, maintained by main.rollups
+    """
+    MINUTE, HOUR = 0, 1
+    GRANULARITY_CHOICES = (
+        (MINUTE, "Minute"),
+        (HOUR, "Hour"),
+    )
+    voting = models.ForeignKey(Voting, on_delete=models.CASCADE, related_name='rollups')
+    granularity = models.PositiveSmallIntegerField(choices=GRANULARITY_CHOICES)
+    bucket = models.DateTimeField()
+    voters = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['voting', 'granularity', 'bucket'], name='main_votingrollup_bucket'),
+        ]
+
+
+class VariantRollup(models.Model):
+    """
+    number of votes a variant got within a minute or an hour, maintained by main.rollups
+    """
+    variant = models.ForeignKey(VoteVariant, on_delete=models.CASCADE, related_name='rollups')
+    voting = models.ForeignKey(Voting, on_delete=models.CASCADE, related_name='variant_rollups')
+    granularity = models.PositiveSmallIntegerField(choices=VotingRollup.GRANULARITY_CHOICES)
+    bucket = models.DateTimeField()
+    votes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['variant', 'granularity', 'bucket'], name='main_variantrollup_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['voting', 'granularity', 'bucket'], name='main_variantrollup_voting'),
+        ]
 
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     profile_image = models.ImageField(upload_to='users', blank=True, null=True)
+    # resized variants of profile_image written by main.images
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
 
 
 # hook to create UserProfile when creating User
@@ -0,0 +1,101 @@
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from main.extra_func import voted_in_session
+from main.models import Voting
+
+
+def get_voting_times(voting_id):
+    """
+    cached (published, finishes) pair of a voting or None if it does not exist
+    """
+    key = f'voting_times:{voting_id}'
+    times = cache.get(key)
+    if times is None:
+        times = Voting.objects.filter(id=voting_id).values_list('published', 'finishes').first()
+        if times is None:
+            return None
+        cache.set(key, times, settings.PAGE_CACHE_TIMEOUT)
+    return times
+
+
+def get_voting_state(voting_id):
+    times = get_voting_times(voting_id)
+    if times is None:
+        return None
+    published, finishes = times
+    now = timezone.now()
+    if now < published:
+        return Voting.NOT_STARTED
+    if now < finishes:
+        return Voting.IN_PROGRESS
+    return Voting.FINISHED
+
+
+def get_generation(voting_id):
+    """
+    random token that is part of every page key of the voting, replacing it drops all its cached pages
+    """
+    key = f'page_generation:{voting_id}'
+    generation = cache.get(key)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        cache.set(key, generation, None)
+    return generation
+
+
+def forget_voting_pages(voting_id):
+    cache.delete_many([f'voting_times:{voting_id}', f'page_generation:{voting_id}'])
+
+
+def is_cacheable(request, response):
+    return (
+        response.status_code == 200
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_USED')
+        and not response.has_header('Vary')
+    )
+
+
+def anonymous_page_cache(view):
+    """
+    caches responses of a view for anonymous visitors, pages of a voting are keyed
+    by its state (not started, in progress, finished) and dropped when it is edited or deleted
+    (in other worker processes only with a shared cache, see PAGE_CACHE_TIMEOUT),
+    visitors that have already voted on the voting always get a fresh page
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        key = f'page:{request.resolver_match.view_name}:{request.get_full_path()}'
+        voting_id = kwargs.get('id')
+        if voting_id is not None:
+            state = get_voting_state(voting_id)
+            if state is None or voted_in_session(request, voting_id):
+                return view(request, *args, **kwargs)
+            key = f'{key}:{state}:{get_generation(voting_id)}'
+
+        response = cache.get(key)
+        if response is not None:
+            return response
+
+        response = view(request, *args, **kwargs)
+
+        def store(response):
+            if is_cacheable(request, response):
+                cache.set(key, response, settings.PAGE_CACHE_TIMEOUT)
+
+        if hasattr(response, 'render') and callable(response.render):
+            response.add_post_render_callback(store)
+        else:
+            store(response)
+        return response
+
+    return wrapper
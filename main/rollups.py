@@ -0,0 +1,217 @@
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncMinute
+from django.utils import timezone
+
+from main.models import Voting, VoteFact, VotingRollup, VariantRollup
+
+MINUTE, HOUR = VotingRollup.MINUTE, VotingRollup.HOUR
+# rows per upsert statement
+UPSERT_BATCH_SIZE = 500
+
+
+def truncate(moment, granularity):
+    moment = moment.astimezone(datetime.timezone.utc).replace(second=0, microsecond=0)
+    return moment.replace(minute=0) if granularity == HOUR else moment
+
+
+def record_rollups(ballots):
+    """
+    add ballots to the minute buckets, must be called in the transaction that creates the VoteFacts
+    :param ballots: iterable of (voting id, chosen variant ids, created) tuples
+    """
+    voting_counts, variant_counts = Counter(), Counter()
+    for voting_id, variant_ids, created in ballots:
+        bucket = truncate(created, MINUTE)
+        voting_counts[voting_id, MINUTE, bucket] += 1
+        for variant_id in variant_ids:
+            variant_counts[variant_id, voting_id, MINUTE, bucket] += 1
+    add_to_buckets(VotingRollup, 'voting_id', 'voters', voting_counts)
+    add_to_buckets(VariantRollup, 'variant_id', 'votes', variant_counts)
+
+
+def add_to_buckets(model, owner, counter, counts: Counter):
+    """
+    increment counters of rollup rows, inserting the ones that do not exist yet,
+    with one upsert statement where the database has one
+    :param counts: Counter keyed by (owner id, granularity, bucket) for VotingRollup
+    and (variant id, voting id, granularity, bucket) for VariantRollup
+    """
+    if not counts:
+        return
+    connection = connections[router.db_for_write(model)]
+    if supports_upsert(connection):
+        upsert_buckets(connection, model, owner, counter, counts)
+    else:
+        update_buckets(model, owner, counter, counts)
+
+
+def supports_upsert(connection):
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 24)
+    return connection.vendor in ('mysql', 'postgresql')
+
+
+def upsert_buckets(connection, model, owner, counter, counts: Counter):
+    quote = connection.ops.quote_name
+    table, counter_column = quote(model._meta.db_table), quote(counter)
+    columns = [owner] + (['voting_id'] if model is VariantRollup else []) + ['granularity', 'bucket', counter]
+    if connection.vendor == 'mysql':
+        conflict = f'ON DUPLICATE KEY UPDATE {counter_column} = {counter_column} + VALUES({counter_column})'
+    else:
+        conflict = (f'ON CONFLICT ({quote(owner)}, {quote("granularity")}, {quote("bucket")}) '
+                    f'DO UPDATE SET {counter_column} = {table}.{counter_column} + excluded.{counter_column}')
+    rows = [
+        (*key[:-1], connection.ops.adapt_datetimefield_value(key[-1]), increment)
+        for key, increment in counts.items()
+    ]
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            placeholders = ', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * len(batch))
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(quote(column) for column in columns)}) '
+                f'VALUES {placeholders} {conflict}',
+                [value for row in batch for value in row],
+            )
+
+
+def update_buckets(model, owner, counter, counts: Counter):
+    """
+    same as upsert_buckets for other databases, one UPDATE per bucket and increment when the rows exist
+    """
+    groups = {}
+    votings = {}
+    for key, increment in counts.items():
+        owner_id, granularity, bucket = key[0], key[-2], key[-1]
+        if model is VariantRollup:
+            votings[owner_id] = key[1]
+        groups.setdefault((granularity, bucket, increment), []).append(owner_id)
+
+    for (granularity, bucket, increment), ids in groups.items():
+        rows = model.objects.filter(granularity=granularity, bucket=bucket, **{f'{owner}__in': ids})
+        updated = rows.update(**{counter: F(counter) + increment})
+        if updated == len(ids):
+            continue
+        # usually the first ballot of a minute, when none of the rows exist yet
+        missing = set(ids) - set(rows.values_list(owner, flat=True)) if updated else set(ids)
+        # concurrent ballots may insert the same rows, the increment below is applied to whichever wins
+        model.objects.bulk_create([
+            model(granularity=granularity, bucket=bucket, **new_row_owner(model, owner, owner_id, votings))
+            for owner_id in missing
+        ], ignore_conflicts=True)
+        model.objects.filter(granularity=granularity, bucket=bucket, **{f'{owner}__in': missing}).update(
+            **{counter: F(counter) + increment}
+        )
+
+
+def new_row_owner(model, owner, owner_id, votings):
+    if model is VariantRollup:
+        return {owner: owner_id, 'voting_id': votings[owner_id]}
+    return {owner: owner_id}
+
+
+def compact_rollups(batch_size=500, voting_ids=None):
+    """
+    merge minute buckets older than ROLLUP_MINUTE_RETENTION into hour buckets
+    :param voting_ids: ids of the votings to compact, all votings if None
+    :return: number of merged minute buckets
+    """
+    # only whole hours are merged, an hour bucket is filled from all of its minutes at once
+    cutoff = truncate(timezone.now() - datetime.timedelta(seconds=settings.ROLLUP_MINUTE_RETENTION), HOUR)
+    merged = 0
+    for model, owner, counter in ((VotingRollup, 'voting_id', 'voters'), (VariantRollup, 'variant_id', 'votes')):
+        buckets = model.objects.filter(granularity=MINUTE, bucket__lt=cutoff)
+        if voting_ids is not None:
+            buckets = buckets.filter(voting__in=voting_ids)
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    buckets
+                    .order_by('id').values_list('id', owner, 'voting_id', 'bucket', counter)[:batch_size]
+                )
+                if not rows:
+                    break
+                counts = Counter()
+                for _, owner_id, voting_id, bucket, count in rows:
+                    if model is VariantRollup:
+                        counts[owner_id, voting_id, HOUR, truncate(bucket, HOUR)] += count
+                    else:
+                        counts[owner_id, HOUR, truncate(bucket, HOUR)] += count
+                add_to_buckets(model, owner, counter, counts)
+                model.objects.filter(id__in=[row[0] for row in rows]).delete()
+            merged += len(rows)
+    return merged
+
+
+def rebuild_rollups(voting_ids=None, batch_size=100):
+    """
+    recount rollups from the raw VoteFact rows, then compact the old buckets of the same votings
+    :param voting_ids: ids of the votings to rebuild, all votings if None
+    :param batch_size: number of votings rebuilt per transaction
+    :return: number of rebuilt votings
+    """
+    votings = Voting.objects.order_by('id')
+    if voting_ids is not None:
+        votings = votings.filter(id__in=voting_ids)
+    ids = list(votings.values_list('id', flat=True))
+    for start in range(0, len(ids), batch_size):
+        with transaction.atomic():
+            rebuild_batch(ids[start:start + batch_size])
+    compact_rollups(voting_ids=None if voting_ids is None else ids)
+    return len(ids)
+
+
+def rebuild_batch(voting_ids):
+    minute = TruncMinute('created', tzinfo=datetime.timezone.utc)
+    VotingRollup.objects.filter(voting__in=voting_ids).delete()
+    VariantRollup.objects.filter(voting__in=voting_ids).delete()
+    VotingRollup.objects.bulk_create([
+        VotingRollup(voting_id=voting_id, granularity=MINUTE, bucket=bucket, voters=voters)
+        for voting_id, bucket, voters in VoteFact.objects.filter(voting__in=voting_ids)
+        .annotate(bucket=minute).values('voting_id', 'bucket')
+        .annotate(total=Count('id')).values_list('voting_id', 'bucket', 'total')
+    ])
+    through = VoteFact.variants.through
+    VariantRollup.objects.bulk_create([
+        VariantRollup(variant_id=variant_id, voting_id=voting_id, granularity=MINUTE, bucket=bucket, votes=votes)
+        for variant_id, voting_id, bucket, votes in through.objects.filter(votefact__voting__in=voting_ids)
+        .annotate(bucket=TruncMinute('votefact__created', tzinfo=datetime.timezone.utc))
+        .values('votevariant_id', 'votefact__voting_id', 'bucket')
+        .annotate(total=Count('id')).values_list('votevariant_id', 'votefact__voting_id', 'bucket', 'total')
+    ])
+
+
+def get_turnout(voting_id):
+    """
+    ballots and votes per variant over time, per minute while all ballots fit
+    into ROLLUP_MINUTE_RETENTION and per hour otherwise
+    :return: (buckets, voters per bucket, {variant id: votes per bucket})
+    """
+    voting_rows = list(
+        VotingRollup.objects.filter(voting=voting_id).values_list('granularity', 'bucket', 'voters')
+    )
+    if not voting_rows:
+        return [], [], {}
+    variant_rows = list(
+        VariantRollup.objects.filter(voting=voting_id).values_list('variant_id', 'granularity', 'bucket', 'votes')
+    )
+    buckets = [bucket for _, bucket, _ in voting_rows]
+    hourly = any(granularity == HOUR for granularity, _, _ in voting_rows) or \
+        max(buckets) - min(buckets) > datetime.timedelta(seconds=settings.ROLLUP_MINUTE_RETENTION)
+    granularity = HOUR if hourly else MINUTE
+
+    voters = Counter()
+    for _, bucket, count in voting_rows:
+        voters[truncate(bucket, granularity)] += count
+    variants = {}
+    for variant_id, _, bucket, count in variant_rows:
+        variants.setdefault(variant_id, Counter())[truncate(bucket, granularity)] += count
+    buckets = sorted(voters)
+    return buckets, [voters[bucket] for bucket in buckets], {
+        variant_id: [counts[bucket] for bucket in buckets] for variant_id, counts in variants.items()
+    }
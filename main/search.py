@@ -0,0 +1,113 @@
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+from django.utils import timezone
+
+from main.models import Voting
+
+# FTS5 table of SQLite, rows are keyed by voting id and kept in sync by main.signals
+FTS_TABLE = 'main_voting_fts'
+# shortest word the MySQL FULLTEXT index (maintained by the database itself)
+# holds with the default innodb_ft_min_token_size
+MYSQL_MIN_WORD = 3
+MAX_WORDS = 10
+
+# aliases of SQLite databases that have the FTS5 table, checked once per process
+fts_databases = {}
+
+
+def has_fts_table(connection) -> bool:
+    if connection.alias not in fts_databases:
+        fts_databases[connection.alias] = FTS_TABLE in connection.introspection.table_names()
+    return fts_databases[connection.alias]
+
+
+def search_words(query):
+    return re.findall(r'\w+', query.lower())[:MAX_WORDS]
+
+
+def index_votings(votings, using=None, created=False):
+    """
+    write names and descriptions of votings to the FTS5 table, a no-op on other databases
+    :param created: the votings are new and have no rows to replace yet
+    """
+    connection = connections[using or router.db_for_write(Voting)]
+    if connection.vendor != 'sqlite' or not has_fts_table(connection) or not votings:
+        return
+    with connection.cursor() as cursor:
+        if not created:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(voting.id,) for voting in votings])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+            [(voting.id, voting.name, voting.description) for voting in votings],
+        )
+
+
+def unindex_voting(voting_id, using=None):
+    connection = connections[using or router.db_for_write(Voting)]
+    if connection.vendor == 'sqlite' and has_fts_table(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [voting_id])
+
+
+def ranked_ids(connection, words, limit, offset):
+    """
+    ids of published votings matching all words as prefixes, best matches first,
+    matches in the name weigh more than matches in the description
+    :return: list of ids, None if the database has no full-text index
+    """
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    if connection.vendor == 'sqlite' and has_fts_table(connection):
+        sql = f'''
+            SELECT voting.id FROM {FTS_TABLE}
+            JOIN main_voting voting ON voting.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s AND voting.published <= %s
+            ORDER BY bm25({FTS_TABLE}, 10.0, 1.0), voting.id DESC
+            LIMIT %s OFFSET %s
+        '''
+        params = [' '.join(f'"{word}"*' for word in words), now, limit, offset]
+    elif connection.vendor == 'mysql':
+        words = [word for word in words if len(word) >= MYSQL_MIN_WORD]
+        if not words:
+            return None
+        against = ' '.join(f'+{word}*' for word in words)
+        sql = '''
+            SELECT id FROM main_voting
+            WHERE MATCH (name, description) AGAINST (%s IN BOOLEAN MODE) AND published <= %s
+            ORDER BY MATCH (name, description) AGAINST (%s IN BOOLEAN MODE) DESC, id DESC
+            LIMIT %s OFFSET %s
+        '''
+        params = [against, now, against, limit, offset]
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_votings(query, page=1, page_size=20):
+    """
+    published votings whose name or description contain all words of the query,
+    pages are counted from 1 and are not counted in total
+    :return: (list of votings of the page, whether there is a next page)
+    """
+    words = search_words(query)
+    if not words:
+        return [], False
+    using = router.db_for_read(Voting)
+    offset = (page - 1) * page_size
+    ids = ranked_ids(connections[using], words, page_size + 1, offset)
+    if ids is None:
+        # no full-text index on this database, scans the table
+        condition = Q()
+        for word in words:
+            condition &= Q(name__icontains=word) | Q(description__icontains=word)
+        votings = list(
+            Voting.objects.using(using).filter(condition, published__lte=timezone.now())
+            .order_by('-published', '-id')[offset:offset + page_size + 1]
+        )
+    else:
+        found = Voting.objects.using(using).in_bulk(ids)
+        votings = [found[voting_id] for voting_id in ids if voting_id in found]
+    return votings[:page_size], len(votings) > page_size
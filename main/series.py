@@ -0,0 +1,139 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router
+from django.db.models import Q
+
+from main.models import Voting
+
+# a link from A to B is either A.next_voting = B or B.prev_voting = A, both are followed.
+# UNION drops the rows already found at the same depth, the depth bound stops cycles
+SERIES_SQL = '''
+WITH RECURSIVE
+forward (id, depth) AS (
+    SELECT id, 0 FROM {table} WHERE id = %s
+    UNION
+    SELECT linked.id, forward.depth + 1 FROM forward
+    JOIN {table} this_voting ON this_voting.id = forward.id
+    JOIN {table} linked ON linked.id = this_voting.next_voting_id OR linked.prev_voting_id = this_voting.id
+    WHERE forward.depth < %s
+),
+backward (id, depth) AS (
+    SELECT id, 0 FROM {table} WHERE id = %s
+    UNION
+    SELECT linked.id, backward.depth - 1 FROM backward
+    JOIN {table} this_voting ON this_voting.id = backward.id
+    JOIN {table} linked ON linked.id = this_voting.prev_voting_id OR linked.next_voting_id = this_voting.id
+    WHERE backward.depth > -%s
+)
+SELECT id, depth FROM forward UNION ALL SELECT id, depth FROM backward WHERE depth < 0
+'''
+
+
+def supports_recursive_cte(connection):
+    if connection.vendor == 'mysql':
+        return connection.mysql_version >= ((10, 2) if connection.mysql_is_mariadb else (8,))
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def query_series(voting_id):
+    """
+    depths of the votings linked to a voting in one recursive query,
+    negative for the previous votings and positive for the next ones
+    :return: list of (voting id, depth) pairs, empty if there is no such voting
+    """
+    connection = connections[router.db_for_read(Voting)]
+    sql = SERIES_SQL.format(table=connection.ops.quote_name(Voting._meta.db_table))
+    limit = settings.SERIES_MAX_LENGTH
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [voting_id, limit, voting_id, limit])
+        return cursor.fetchall()
+
+
+def walk_series(voting_id):
+    """
+    same as query_series for databases without recursive queries, one query per hop in each direction
+    """
+    start = Voting.objects.filter(id=voting_id).values('id', 'next_voting_id', 'prev_voting_id').first()
+    if start is None:
+        return []
+    depths = [(voting_id, 0)]
+    for step, link, back_link in ((1, 'next_voting_id', 'prev_voting'), (-1, 'prev_voting_id', 'next_voting')):
+        current = start
+        for depth in range(step, (settings.SERIES_MAX_LENGTH + 1) * step, step):
+            current = Voting.objects.filter(
+                Q(id=current[link]) | Q(**{back_link: current['id']})
+            ).values('id', 'next_voting_id', 'prev_voting_id').first()
+            if current is None:
+                break
+            depths.append((current['id'], depth))
+    return depths
+
+
+def order_series(depths):
+    """
+    :return: voting ids from the first to the last one, a voting met in both
+    directions of a cycle keeps the position closest to the start
+    """
+    positions = {}
+    for voting_id, depth in depths:
+        if voting_id not in positions or (abs(depth), -depth) < (abs(positions[voting_id]), -positions[voting_id]):
+            positions[voting_id] = depth
+    return sorted(positions, key=positions.get)
+
+
+def get_series_generation():
+    """
+    random token that is part of every cached series, replacing it drops all of them
+    """
+    generation = cache.get('series_generation')
+    if generation is None:
+        generation = uuid.uuid4().hex
+        cache.set('series_generation', generation, None)
+    return generation
+
+
+def forget_series():
+    """
+    must be called whenever a link between votings changes, a link change can merge or split any series.
+    Reaches other workers only through a shared cache, see SERIES_CACHE_TIMEOUT
+    """
+    cache.delete('series_generation')
+
+
+def get_series(voting_id):
+    """
+    ids of all votings in the series of a voting in order, cached until the links change
+    :return: list of ids, empty if there is no such voting
+    """
+    key = f'series:{get_series_generation()}:{voting_id}'
+    ids = cache.get(key)
+    if ids is None:
+        connection = connections[router.db_for_read(Voting)]
+        depths = query_series(voting_id) if supports_recursive_cte(connection) else walk_series(voting_id)
+        ids = order_series(depths)
+        cache.set(key, ids, settings.SERIES_CACHE_TIMEOUT)
+    return ids
+
+
+def load_series(ids):
+    """
+    votings of a series with their variants, in series order
+    """
+    votings = Voting.objects.filter(id__in=ids).select_related('author').prefetch_related('votevariant_set')
+    votings = {voting.id: voting for voting in votings}
+    return [votings[voting_id] for voting_id in ids if voting_id in votings]
+
+
+def aggregate_results(votings):
+    """
+    votes summed over the votings by variant description, votings of a series usually
+    repeat the same variants
+    :return: (total number of voters, {description: votes})
+    """
+    facts = {}
+    for voting in votings:
+        for variant in sorted(voting.votevariant_set.all(), key=lambda variant: variant.id):
+            facts[variant.description] = facts.get(variant.description, 0) + variant.votes
+    return sum(voting.voters for voting in votings), facts
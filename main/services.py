@@ -0,0 +1,63 @@
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from main.models import Voting, VoteVariant
+from main.search import index_votings
+
+
+def check_variants(type, variants):
+    if len(variants) < 2:
+        raise ValidationError('Опрос должен содержать хотя бы два варианта ответа')
+    if type == Voting.BUTTONS and len(variants) != 2:
+        raise ValidationError('Опрос "Один ответ из двух вариантов" должен содержать ровно два варианта')
+
+
+def create_voting(author, name, description, type, published, finishes, variants, image=None, **fields) -> Voting:
+    """
+    create a voting with all of its variants, either everything is saved or nothing
+    :param variants: descriptions of the variants in display order
+    :param fields: other Voting fields, e.g. next_voting
+    :return: the saved voting
+    """
+    voting = Voting(
+        author=author,
+        name=name,
+        description=description,
+        type=type,
+        image=image,
+        published=published,
+        finishes=finishes,
+        **fields,
+    )
+    return create_votings([(voting, variants)])[0]
+
+
+def create_votings(votings):
+    """
+    save many votings with their variants in one transaction, variants of all votings are inserted at once,
+    the votings themselves too where the database returns ids of bulk inserted rows
+    :param votings: list of (unsaved Voting, list of variant descriptions) pairs
+    :return: list of the saved votings
+    """
+    votings = [(voting, list(variants)) for voting, variants in votings]
+    for voting, variants in votings:
+        check_variants(voting.type, variants)
+
+    with transaction.atomic():
+        saved = [voting for voting, _ in votings]
+        if len(saved) > 1 and connection.features.can_return_rows_from_bulk_insert:
+            Voting.objects.bulk_create(saved)
+            # bulk_create sends no post_save
+            index_votings(saved, created=True)
+        else:
+            # the variants need the ids of their votings, which bulk_create returns only on PostgreSQL
+            # with Django 3.2, so MySQL and SQLite save the votings one by one (an INSERT and the
+            # full-text row each), only the variants go in one query. A single voting is saved
+            # normally as well so that post_save hooks (page cache, image resizing) run for it
+            for voting in saved:
+                voting.save()
+        VoteVariant.objects.bulk_create([
+            VoteVariant(voting=voting, description=description)
+            for voting, variants in votings for description in variants
+        ])
+    return saved
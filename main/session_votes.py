@@ -0,0 +1,66 @@
+"""
+ids of votings a session has voted in are stored as a flat sorted list of half-open
+ranges [start1, end1, start2, end2, ...], ids of consecutive votings collapse into one range.
+An id is in the set when bisect lands on an odd index, i.e. between a start and an end
+"""
+from bisect import bisect_right
+
+from django.conf import settings
+
+SESSION_KEY = 'voted'
+# plain list of voting ids kept by older versions
+LEGACY_SESSION_KEY = 'votes'
+
+
+def ranges_contain(ranges, voting_id) -> bool:
+    return bisect_right(ranges, voting_id) % 2 == 1
+
+
+def ranges_add(ranges, voting_id) -> bool:
+    """
+    add id to ranges in place
+    :return: False if it was already there
+    """
+    position = bisect_right(ranges, voting_id)
+    if position % 2 == 1:
+        return False
+    joins_previous = position > 0 and ranges[position - 1] == voting_id
+    joins_next = position < len(ranges) and ranges[position] == voting_id + 1
+    if joins_previous and joins_next:
+        del ranges[position - 1:position + 1]
+    elif joins_previous:
+        ranges[position - 1] = voting_id + 1
+    elif joins_next:
+        ranges[position] = voting_id
+    else:
+        ranges[position:position] = [voting_id, voting_id + 1]
+    return True
+
+
+def ranges_from_ids(ids, ranges=None) -> list:
+    ranges = list(ranges or [])
+    for voting_id in ids:
+        ranges_add(ranges, voting_id)
+    return ranges
+
+
+def limit_ranges(ranges) -> list:
+    """
+    keep at most SESSION_VOTES_MAX_RANGES ranges, the oldest (lowest) ids are dropped first:
+    those votings are most likely finished and closed for voting anyway
+    """
+    return ranges[-settings.SESSION_VOTES_MAX_RANGES * 2:]
+
+
+def get_session_votes(session) -> list:
+    """
+    :return: ranges of votings the session has voted in, legacy lists are converted on first access
+    """
+    if LEGACY_SESSION_KEY in session:
+        ranges = ranges_from_ids(session.pop(LEGACY_SESSION_KEY) or [], session.get(SESSION_KEY))
+        session[SESSION_KEY] = limit_ranges(ranges)
+    return session.get(SESSION_KEY, [])
+
+
+def add_session_votes(session, ids):
+    session[SESSION_KEY] = limit_ranges(ranges_from_ids(ids, get_session_votes(session)))
@@ -0,0 +1,86 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from main.images import enqueue_renditions, delete_renditions, remember_image
+from main.models import Voting, VoteVariant, UserProfile
+from main.page_cache import forget_voting_pages
+from main.search import index_votings, unindex_voting
+from main.series import forget_series
+from main.tallies import forget_tally_state
+from main.variant_choices import forget_variant_choices
+
+
+# hook to drop cached pages of a voting when it is edited or deleted
+@receiver(post_save, sender=Voting)
+@receiver(post_delete, sender=Voting)
+def forget_voting_pages_on_change(sender, instance, **kwargs):
+    forget_voting_pages(instance.id)
+
+
+# hook to drop the cached tally state, the finishing time in it may have changed.
+# Frozen results keep the finishing time they were built for and are rebuilt by main.snapshots
+@receiver(post_save, sender=Voting)
+def forget_tally_state_on_change(sender, instance, **kwargs):
+    forget_tally_state(instance.id)
+
+
+# hooks to resize uploaded images in the background, only when the image was changed
+@receiver(post_init, sender=Voting)
+def remember_voting_image(sender, instance, **kwargs):
+    remember_image(instance, 'image')
+
+
+@receiver(post_init, sender=UserProfile)
+def remember_profile_image(sender, instance, **kwargs):
+    remember_image(instance, 'profile_image')
+
+
+@receiver(post_save, sender=Voting)
+def resize_voting_image(sender, instance, raw=False, **kwargs):
+    if not raw:
+        enqueue_renditions(instance, 'image')
+
+
+@receiver(post_save, sender=UserProfile)
+def resize_profile_image(sender, instance, raw=False, **kwargs):
+    if not raw:
+        enqueue_renditions(instance, 'profile_image')
+
+
+@receiver(post_delete, sender=Voting)
+@receiver(post_delete, sender=UserProfile)
+def delete_image_renditions(sender, instance, **kwargs):
+    delete_renditions(instance.image_renditions)
+
+
+# hooks to drop cached vote form choices, tallies are written with update() and do not trigger them
+@receiver(post_save, sender=Voting)
+@receiver(post_delete, sender=Voting)
+def forget_choices_of_voting(sender, instance, **kwargs):
+    forget_variant_choices(instance.id)
+
+
+@receiver(post_save, sender=VoteVariant)
+@receiver(post_delete, sender=VoteVariant)
+def forget_choices_of_variant(sender, instance, **kwargs):
+    forget_variant_choices(instance.voting_id)
+
+
+# hook to drop cached series when a linked voting appears or disappears, VotingEdit
+# and the admin drop them when a link of an existing voting changes
+@receiver(post_save, sender=Voting)
+@receiver(post_delete, sender=Voting)
+def forget_series_of_voting(sender, instance, created=True, **kwargs):
+    if created and (instance.next_voting_id or instance.prev_voting_id):
+        forget_series()
+
+
+# hooks to keep the SQLite full-text table in sync, MySQL updates its FULLTEXT index itself
+@receiver(post_save, sender=Voting)
+def index_voting(sender, instance, created=False, using=None, **kwargs):
+    index_votings([instance], using, created)
+
+
+@receiver(post_delete, sender=Voting)
+def unindex_deleted_voting(sender, instance, using=None, **kwargs):
+    unindex_voting(instance.id, using)
@@ -0,0 +1,107 @@
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from main.charts import create_chart, create_turnout_chart
+from main.models import Voting, VoteVariant, VotingResultSnapshot
+from main.rollups import get_turnout
+
+
+def snapshot_due(voting: Voting) -> bool:
+    """
+    results are frozen a little after the voting finishes so that late queued ballots are counted
+    """
+    return voting.finishes + datetime.timedelta(seconds=settings.RESULT_SNAPSHOT_DELAY) <= timezone.now()
+
+
+def render_turnout(voting_id, variants):
+    """
+    chart of votes over time read from the rollups
+    :param variants: variants of the voting, they name the lines of the chart
+    :return: rendered chart, empty if no ballots were counted
+    """
+    buckets, voters, variant_votes = get_turnout(voting_id)
+    if not buckets:
+        return ''
+    descriptions = {variant.id: variant.description for variant in variants}
+    return create_turnout_chart(buckets, voters, {
+        descriptions[variant_id]: votes for variant_id, votes in variant_votes.items() if variant_id in descriptions
+    })
+
+
+def build_snapshot(voting: Voting, variants=None) -> VotingResultSnapshot:
+    if variants is None:
+        # uses variants prefetched by get_request_voting when there are any
+        variants = sorted(voting.votevariant_set.all(), key=lambda variant: variant.id)
+    facts = [[variant.description, variant.votes] for variant in variants]
+    chart = ''
+    if any(votes for _, votes in facts):
+        chart = create_chart(dict(facts))
+    return VotingResultSnapshot(
+        voting=voting, facts=facts, voters=voting.voters, chart=chart,
+        turnout=render_turnout(voting.id, variants) if facts else '',
+        finishes=voting.finishes, tally_version=voting.tally_version,
+    )
+
+
+def is_current(snapshot: VotingResultSnapshot, voting: Voting) -> bool:
+    """
+    votes counted after the results were frozen (admin recounts, late queued ballots) bump the tally
+    version, a voting reopened and finished again has another finishing time
+    """
+    return snapshot.tally_version == voting.tally_version and snapshot.finishes == voting.finishes
+
+
+def get_snapshot(voting: Voting) -> VotingResultSnapshot:
+    """
+    snapshot of a finished voting, created on the first request after it is due
+    and built again on the first request after it went stale
+    """
+    snapshot = VotingResultSnapshot.objects.filter(voting=voting).first()
+    if snapshot is not None:
+        if is_current(snapshot, voting):
+            return snapshot
+        fresh = build_snapshot(voting)
+        fresh.save(force_update=True)
+        return fresh
+    snapshot = build_snapshot(voting)
+    try:
+        with transaction.atomic():
+            snapshot.save(force_insert=True)
+    except IntegrityError:
+        # a concurrent request has frozen the results first
+        return VotingResultSnapshot.objects.get(voting=voting)
+    return snapshot
+
+
+def create_due_snapshots(batch_size=100):
+    """
+    freeze results of every finished voting that has no snapshot yet
+    :return: number of created snapshots
+    """
+    due = timezone.now() - datetime.timedelta(seconds=settings.RESULT_SNAPSHOT_DELAY)
+    votings = Voting.objects.filter(finishes__lte=due, snapshot__isnull=True).order_by('id')
+    created = 0
+    last_id = 0
+    while True:
+        batch = list(votings.filter(id__gt=last_id).only('id', 'voters', 'finishes', 'tally_version')[:batch_size])
+        if not batch:
+            return created
+        last_id = batch[-1].id
+        # results pages freeze votings too, the ones frozen since the batch was read are not counted,
+        # ignore_conflicts below only covers a page that freezes a voting in the next few milliseconds
+        frozen = set(VotingResultSnapshot.objects.filter(voting__in=batch).values_list('voting_id', flat=True))
+        batch = [voting for voting in batch if voting.id not in frozen]
+        variants = {}
+        for variant in VoteVariant.objects.filter(voting__in=batch).order_by('id') \
+                .only('voting_id', 'description', 'votes'):
+            variants.setdefault(variant.voting_id, []).append(variant)
+        snapshots = [build_snapshot(voting, variants.get(voting.id, [])) for voting in batch]
+        VotingResultSnapshot.objects.bulk_create(snapshots, ignore_conflicts=True)
+        created += len(snapshots)
+
+
+def forget_snapshot(voting_id):
+    VotingResultSnapshot.objects.filter(voting_id=voting_id).delete()
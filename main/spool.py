@@ -0,0 +1,122 @@
+import json
+import os
+import sqlite3
+import time
+
+
+class Spool:
+    """
+    durable FIFO queue kept in a local SQLite file,
+    safe to append to from several processes at once
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS spool ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'enqueued REAL NOT NULL, '
+            'payload TEXT NOT NULL, '
+            'claimed_until REAL)'
+        )
+        # items that can never be processed, kept for inspection instead of blocking the queue
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS rejected ('
+            'id INTEGER PRIMARY KEY, '
+            'enqueued REAL NOT NULL, '
+            'payload TEXT NOT NULL, '
+            'rejected REAL NOT NULL)'
+        )
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(spool)')]
+        if 'claimed_until' not in columns:
+            # spool files created by older versions
+            connection.execute('ALTER TABLE spool ADD COLUMN claimed_until REAL')
+        return connection
+
+    def append(self, payload: dict):
+        connection = self.connect()
+        try:
+            connection.execute(
+                'INSERT INTO spool (enqueued, payload) VALUES (?, ?)',
+                (time.time(), json.dumps(payload, separators=(',', ':'))),
+            )
+        finally:
+            connection.close()
+
+    def claim(self, limit, lease):
+        """
+        take the oldest items no other worker holds, they are handed out again
+        after lease seconds unless acked, e.g. when the worker crashed
+        :return: list of (id, enqueued, payload) tuples, oldest first
+        """
+        connection = self.connect()
+        try:
+            now = time.time()
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute(
+                'SELECT id, enqueued, payload FROM spool '
+                'WHERE claimed_until IS NULL OR claimed_until < ? ORDER BY id LIMIT ?', (now, limit)
+            ).fetchall()
+            connection.executemany(
+                'UPDATE spool SET claimed_until = ? WHERE id = ?', [(now + lease, row[0]) for row in rows]
+            )
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+        return [(item_id, enqueued, json.loads(payload)) for item_id, enqueued, payload in rows]
+
+    def ack(self, ids):
+        if not ids:
+            return
+        connection = self.connect()
+        try:
+            connection.execute('BEGIN')
+            connection.executemany('DELETE FROM spool WHERE id = ?', [(item_id,) for item_id in ids])
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    def reject(self, ids):
+        """
+        move items from the queue to the rejected table
+        """
+        if not ids:
+            return
+        connection = self.connect()
+        try:
+            connection.execute('BEGIN')
+            connection.executemany(
+                'INSERT OR REPLACE INTO rejected (id, enqueued, payload, rejected) '
+                'SELECT id, enqueued, payload, ? FROM spool WHERE id = ?', [(time.time(), item_id) for item_id in ids]
+            )
+            connection.executemany('DELETE FROM spool WHERE id = ?', [(item_id,) for item_id in ids])
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    def rejected(self):
+        """
+        :return: list of (id, enqueued, payload) tuples of the rejected items, oldest first
+        """
+        connection = self.connect()
+        try:
+            rows = connection.execute('SELECT id, enqueued, payload FROM rejected ORDER BY id').fetchall()
+        finally:
+            connection.close()
+        return [(item_id, enqueued, json.loads(payload)) for item_id, enqueued, payload in rows]
+
+    def stats(self):
+        """
+        :return: (number of queued items, enqueue time of the oldest one or None)
+        """
+        connection = self.connect()
+        try:
+            return connection.execute('SELECT COUNT(*), MIN(enqueued) FROM spool').fetchone()
+        finally:
+            connection.close()
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import logging
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from main.models import Voting, VoteVariant
+
+STREAM_PATH = re.compile(r'^/voting/(?P<id>\d+)/results/stream/?$')
+
+logger = logging.getLogger(__name__)
+
+
+def read_tallies(voting_id, known_version=None):
+    """
+    :return: None if the voting does not exist, else (version, finished, voters, variants)
+    where variants is None if the version did not change and {variant id: [description, votes]} otherwise
+    """
+    state = Voting.objects.filter(id=voting_id).values_list('tally_version', 'finishes', 'voters').first()
+    if state is None:
+        return None
+    version, finishes, voters = state
+    finished = finishes <= timezone.now()
+    if version == known_version:
+        return version, finished, voters, None
+    variants = VoteVariant.objects.filter(voting=voting_id).order_by('id').values_list('id', 'description', 'votes')
+    return version, finished, voters, {variant_id: [description, votes] for variant_id, description, votes in variants}
+
+
+def poll_tallies(voting_id, known_version):
+    """
+    read_tallies for the poller, which lives outside of the request cycle and has to drop
+    broken and expired database connections itself
+    """
+    close_old_connections()
+    try:
+        return read_tallies(voting_id, known_version)
+    finally:
+        close_old_connections()
+
+
+def tally_delta(old, new):
+    """
+    variants whose votes changed between two tally states
+    """
+    return {
+        variant_id: votes for variant_id, (_, votes) in new.items()
+        if variant_id not in old or old[variant_id][1] != votes
+    }
+
+
+class Subscriber:
+    """
+    pending changes of one client, updates arriving faster than the client
+    reads them are merged so it only ever gets the latest counts
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.finished = False
+        self.changed = asyncio.Event()
+
+    def push(self, update):
+        self.finished = self.finished or update.pop('finished', False)
+        variants = update.pop('variants', {})
+        self.pending.setdefault('variants', {}).update(variants)
+        self.pending.update(update)
+        self.changed.set()
+
+    def take(self):
+        update, self.pending = self.pending, {}
+        update['finished'] = self.finished
+        self.changed.clear()
+        return update
+
+
+class ResultsBroadcaster:
+    """
+    one per worker process: polls tallies of every voting that has listeners
+    at most SSE_MAX_UPDATES_PER_SECOND times a second and fans changes out to all of them
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+        self.pollers = {}
+
+    def subscribe(self, voting_id, state):
+        subscriber = Subscriber()
+        poller = self.pollers.get(voting_id)
+        if poller is None or poller.done():
+            # a poller that stopped (the voting finished and was extended, or it crashed) is replaced,
+            # clients that stayed subscribed may have missed changes and get the full counts
+            version, finished, voters, variants = state
+            for waiting in self.subscribers.get(voting_id, ()):
+                waiting.push({'version': version, 'finished': finished, 'voters': voters, 'variants': {
+                    variant_id: votes for variant_id, (_, votes) in variants.items()
+                }})
+            self.pollers[voting_id] = asyncio.ensure_future(self.poll(voting_id, state))
+        self.subscribers.setdefault(voting_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, voting_id, subscriber):
+        subscribers = self.subscribers.get(voting_id, set())
+        subscribers.discard(subscriber)
+        if not subscribers:
+            self.subscribers.pop(voting_id, None)
+            poller = self.pollers.pop(voting_id, None)
+            if poller is not None:
+                poller.cancel()
+
+    async def poll(self, voting_id, state):
+        version, _, _, variants = state
+        while True:
+            await asyncio.sleep(1 / settings.SSE_MAX_UPDATES_PER_SECOND)
+            try:
+                version, variants, finished = await self.poll_once(voting_id, version, variants)
+            except Exception:
+                # a lost database connection must not stop the updates, the next poll retries
+                logger.exception('could not poll tallies of voting %s', voting_id)
+                continue
+            if finished:
+                return
+
+    async def poll_once(self, voting_id, version, variants):
+        """
+        push changes since the known tally state to the subscribers
+        :return: (version, variants, finished) of the new state
+        """
+        state = await sync_to_async(poll_tallies)(voting_id, version)
+        if state is None:
+            state = version, True, 0, None
+        new_version, finished, voters, new_variants = state
+        update = {'finished': finished}
+        if new_variants is not None:
+            update.update({
+                'version': new_version,
+                'voters': voters,
+                'variants': tally_delta(variants, new_variants),
+            })
+            version, variants = new_version, new_variants
+        if new_variants is not None or finished:
+            for subscriber in self.subscribers.get(voting_id, ()):
+                subscriber.push(dict(update, variants=dict(update.get('variants', {}))))
+        return version, variants, finished
+
+
+broadcaster = ResultsBroadcaster()
+
+
+def event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data, separators=(",", ":"), ensure_ascii=False)}\n\n'.encode()
+
+
+async def results_stream(scope, receive, send, voting_id):
+    """
+    ASGI handler streaming tally changes of a voting as Server-Sent Events
+    """
+    state = await sync_to_async(read_tallies)(voting_id)
+    if state is None:
+        await send({'type': 'http.response.start', 'status': 404, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'Not Found'})
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+    version, finished, voters, variants = state
+    await send({'type': 'http.response.body', 'more_body': not finished, 'body': event('tally', {
+        'version': version,
+        'finished': finished,
+        'voters': voters,
+        'variants': [[variant_id, description, votes] for variant_id, (description, votes) in variants.items()],
+    })})
+    if finished:
+        return
+
+    subscriber = broadcaster.subscribe(voting_id, state)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        while not disconnected.done():
+            changed = asyncio.ensure_future(subscriber.changed.wait())
+            await asyncio.wait({changed, disconnected}, timeout=settings.SSE_HEARTBEAT,
+                               return_when=asyncio.FIRST_COMPLETED)
+            changed.cancel()
+            if disconnected.done():
+                break
+            if not subscriber.changed.is_set():
+                # comment line keeps proxies from closing an idle connection
+                await send({'type': 'http.response.body', 'body': b': heartbeat\n\n', 'more_body': True})
+                continue
+            update = subscriber.take()
+            await send({'type': 'http.response.body', 'body': event('delta', update), 'more_body': not update['finished']})
+            if update['finished']:
+                break
+    finally:
+        disconnected.cancel()
+        broadcaster.unsubscribe(voting_id, subscriber)
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
@@ -0,0 +1,157 @@
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Min, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from main.models import Voting, VoteVariant, VoteFact, VotingParticipation
+from main.rollups import record_rollups, rebuild_rollups
+from main.snapshots import forget_snapshot
+
+
+def record_vote(voting: Voting, variant_ids, created=None):
+    """
+    bump the denormalized tallies and rollups for one accepted ballot,
+    must be called in the same transaction that creates the VoteFact
+    :param voting: Voting the ballot belongs to
+    :param variant_ids: ids of the chosen VoteVariants
+    :param created: time the ballot was cast, now by default
+    """
+    record_votes(Counter({voting.id: 1}), Counter(variant_ids))
+    record_rollups([(voting.id, variant_ids, created or timezone.now())])
+
+
+def record_votes(voting_counts: Counter, variant_counts: Counter):
+    """
+    bump tallies of a whole batch with one UPDATE per distinct increment
+    """
+    for increment, ids in group_by_count(variant_counts).items():
+        VoteVariant.objects.filter(id__in=ids).update(votes=F('votes') + increment)
+    for increment, ids in group_by_count(voting_counts).items():
+        Voting.objects.filter(id__in=ids).update(
+            voters=F('voters') + increment, tally_version=F('tally_version') + 1
+        )
+    for voting_id in voting_counts:
+        transaction.on_commit(lambda voting_id=voting_id: forget_tally_state(voting_id))
+
+
+def group_by_count(counts: Counter):
+    groups = {}
+    for key, count in counts.items():
+        groups.setdefault(count, []).append(key)
+    return groups
+
+
+def tally_state_key(voting_id):
+    return f'tally_state:{voting_id}'
+
+
+def get_tally_state(voting_id):
+    """
+    cached (tally_version, finishes) pair of a voting, lets conditional
+    requests be answered without touching the database
+    :return: tuple or None if the voting does not exist
+    """
+    key = tally_state_key(voting_id)
+    state = cache.get(key)
+    if state is None:
+        state = Voting.objects.filter(id=voting_id).values_list('tally_version', 'finishes').first()
+        if state is None:
+            return None
+        if state[1] <= timezone.now():
+            timeout = settings.TALLY_STATE_FINISHED_TIMEOUT
+        else:
+            timeout = settings.TALLY_STATE_TIMEOUT
+        cache.set(key, state, timeout)
+    return state
+
+
+def forget_tally_state(voting_id):
+    cache.delete(tally_state_key(voting_id))
+
+
+def rebuild_tallies(voting_ids=None, batch_size=500):
+    """
+    recount tallies from the raw VoteFact rows
+    :param voting_ids: ids of the votings to rebuild, all votings if None
+    :param batch_size: number of votings rebuilt per transaction
+    :return: number of rebuilt votings
+    """
+    votings = Voting.objects.order_by('id')
+    if voting_ids is not None:
+        votings = votings.filter(id__in=voting_ids)
+    ids = list(votings.values_list('id', flat=True))
+    for start in range(0, len(ids), batch_size):
+        with transaction.atomic():
+            rebuild_batch(ids[start:start + batch_size])
+    return len(ids)
+
+
+def rebuild_batch(voting_ids):
+    """
+    recount with one UPDATE per table whose values come from subqueries, so there is no gap between
+    reading the counts and writing them where a concurrent record_vote increment could be lost.
+    Variants are updated before votings like record_vote does, to keep the lock order
+    """
+    through = VoteFact.variants.through
+    variant_votes = through.objects.filter(votevariant=OuterRef('pk')).order_by() \
+        .values('votevariant').annotate(total=Count('pk')).values('total')
+    VoteVariant.objects.filter(voting__in=voting_ids).update(votes=Coalesce(Subquery(variant_votes), 0))
+    voters = VoteFact.objects.filter(voting=OuterRef('pk')).order_by() \
+        .values('voting').annotate(total=Count('pk')).values('total')
+    Voting.objects.filter(id__in=voting_ids).update(
+        voters=Coalesce(Subquery(voters), 0), tally_version=F('tally_version') + 1
+    )
+    for voting_id in voting_ids:
+        transaction.on_commit(lambda voting_id=voting_id: forget_tally_state(voting_id))
+
+
+def recount_votings(voting_ids, participants=()):
+    """
+    bring tallies, rollups, frozen results and the participation ledger back in line with the
+    VoteFact rows after VoteFacts were added, edited or deleted without record_vote, e.g. in the admin
+    :param voting_ids: ids of the affected votings, None and ids of deleted votings are skipped
+    :param participants: (voting id, user id) pairs whose VoteFacts changed, pairs with None are skipped
+    """
+    voting_ids = {voting_id for voting_id in voting_ids if voting_id is not None}
+    if not voting_ids:
+        return
+    with transaction.atomic():
+        rebuild_tallies(voting_ids)
+        rebuild_rollups(voting_ids)
+        sync_participations(participants)
+        for voting_id in voting_ids:
+            forget_snapshot(voting_id)
+
+
+def sync_participations(participants):
+    """
+    a user keeps a participation in a voting exactly while having a VoteFact in it
+    """
+    participants = {(voting_id, user_id) for voting_id, user_id in participants
+                    if voting_id is not None and user_id is not None}
+    if not participants:
+        return
+    voting_ids = {voting_id for voting_id, _ in participants}
+    user_ids = {user_id for _, user_id in participants}
+    first_votes = {
+        (voting_id, user_id): created for voting_id, user_id, created in
+        VoteFact.objects.filter(voting__in=voting_ids, user__in=user_ids).values('voting_id', 'user_id')
+        .annotate(created=Min('created')).values_list('voting_id', 'user_id', 'created')
+    }
+    ledger = set(VotingParticipation.objects.filter(voting__in=voting_ids, user__in=user_ids)
+                 .values_list('voting_id', 'user_id'))
+    stale = [pair for pair in participants if pair in ledger and pair not in first_votes]
+    if stale:
+        condition = Q()
+        for voting_id, user_id in stale:
+            condition |= Q(voting=voting_id, user=user_id)
+        VotingParticipation.objects.filter(condition).delete()
+    VotingParticipation.objects.bulk_create([
+        VotingParticipation(voting_id=voting_id, user_id=user_id, created=first_votes[voting_id, user_id])
+        for voting_id, user_id in participants if (voting_id, user_id) in first_votes
+        and (voting_id, user_id) not in ledger
+    ])
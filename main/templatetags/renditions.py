@@ -0,0 +1,13 @@
+from django import template
+
+from main.images import srcset
+
+register = template.Library()
+
+
+@register.simple_tag
+def image_srcset(image, renditions, extension='jpg'):
+    """
+    usage: <img srcset="{% image_srcset voting.image voting.image_renditions 'jpg' %}">
+    """
+    return srcset(image, renditions, extension)
@@ -1,3 +1,1327 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import importlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import connection, IntegrityError, OperationalError
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from django.urls import resolve, reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from PIL import Image
+
+from main.admin import EstimatedCountPaginator
+from main.db_router import ReplicaRouter
+from main.export import export_votes
+from main.middleware import ReplicaMiddleware
+from main.importer import iter_json
+from main.images import drain as drain_images, get_spool as get_image_spool, rendition_names
+from main.models import Voting, VoteVariant, VoteFact, VotingParticipation, VotingResultSnapshot, User, \
+    VotingRollup, VariantRollup
+from main.services import create_voting, create_votings
+from main.session_votes import LEGACY_SESSION_KEY, SESSION_KEY, ranges_add, ranges_contain, ranges_from_ids
+from main.rollups import compact_rollups, get_turnout, rebuild_rollups
+from main.search import search_votings
+from main.series import get_series, order_series, query_series, walk_series
+from main.snapshots import create_due_snapshots
+from main.sse import ResultsBroadcaster, Subscriber, poll_tallies, tally_delta
+from main.tallies import rebuild_tallies, rebuild_batch as rebuild_tally_batch
+from main.variant_choices import get_variant_choices, variant_choices
+from main.spool import Spool
+from main import vote_queue
+from main.forms import VoteManyOfManyForm
+from main.management.commands.benchmark import Command as BenchmarkCommand, percentile
+
+
+class VotingTestData(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.author = User.objects.create_user('author', 'author@example.com', 'password')
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.voters = [
+            User.objects.create_user(f'voter{i}', f'voter{i}@example.com', 'password') for i in range(5)
+        ]
+        cls.voting = Voting.objects.create(
+            name='Voting',
+            description='Description',
+            author=cls.author,
+            type=Voting.CHECKBOXES,
+            published=now - datetime.timedelta(hours=1),
+            finishes=now + datetime.timedelta(hours=1),
+        )
+        cls.other_voting = Voting.objects.create(
+            name='Other voting',
+            description='Description',
+            author=cls.author,
+            type=Voting.RADIOS,
+            published=now - datetime.timedelta(hours=1),
+            finishes=now + datetime.timedelta(hours=1),
+        )
+        cls.variants = [VoteVariant.objects.create(voting=cls.voting, description=f'Variant {i}') for i in range(4)]
+        cls.other_variants = [VoteVariant.objects.create(voting=cls.other_voting, description=f'Other {i}') for i in range(3)]
+        # several votes per user and per variant so that N+1 patterns exceed the budgets
+        for i, voter in enumerate(cls.voters):
+            for voting, variants in ((cls.voting, cls.variants), (cls.other_voting, cls.other_variants)):
+                VotingParticipation.objects.create(voting=voting, user=voter)
+                fact = VoteFact.objects.create(voting=voting, user=voter)
+                fact.variants.add(variants[i % len(variants)], variants[(i + 1) % len(variants)])
+        rebuild_tallies()
+
+    def setUp(self):
+        cache.clear()
+        variant_choices.clear()
+
+
+@override_settings(MIDDLEWARE=['main.middleware.QueryBudgetMiddleware'] + [
+    middleware for middleware in settings.MIDDLEWARE if middleware != 'main.middleware.QueryBudgetMiddleware'
+])
+class QueryBudgetTests(VotingTestData):
+    def assertWithinBudget(self, url_name, url, method='get', data=None, status=200):
+        """
+        checks the count QueryBudgetMiddleware reports, savepoints of the atomic blocks
+        nested in the test transaction are counted like the middleware counts them
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data or {})
+        self.assertEqual(response.status_code, status)
+        count = int(response['X-Query-Count'])
+        budget = settings.QUERY_BUDGETS[url_name]
+        self.assertLessEqual(
+            count, budget,
+            f'{url_name} made {count} queries, budget is {budget}:\n' +
+            '\n'.join(query['sql'] for query in queries.captured_queries),
+        )
+        return response
+
+    def test_index(self):
+        self.assertWithinBudget('index', reverse('index'))
+        self.client.force_login(self.author)
+        self.assertWithinBudget('index', reverse('index'))
+
+    def test_votings_list(self):
+        self.client.force_login(self.author)
+        self.assertWithinBudget('votings_list', reverse('votings_list'))
+
+    def test_create_voting(self):
+        self.client.force_login(self.author)
+        self.assertWithinBudget('create_voting', reverse('create_voting'))
+
+    def test_voting_page(self):
+        url = reverse('voting_page', kwargs={'id': self.voting.id})
+        self.assertWithinBudget('voting_page', url)
+        self.client.force_login(self.voters[0])
+        self.assertWithinBudget('voting_page', url)
+
+    def test_voting_loaded_once(self):
+        # the voting is shared by the view, forms and eligibility check,
+        # variants are loaded only by the pages that show them, the vote form reads its cached choices
+        get_variant_choices(self.other_voting.id)
+        self.client.force_login(User.objects.create_user('late', 'late@example.com', 'password'))
+        for url_name, variant_queries in (('voting_page', 0), ('results_page', 1), ('vote', 0)):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse(url_name, kwargs={'id': self.other_voting.id}))
+            sql = [query['sql'] for query in queries.captured_queries]
+            self.assertEqual(len(sql), len(set(sql)), url_name)
+            self.assertEqual(len([query for query in sql if query.startswith('SELECT')
+                                  and 'FROM "main_voting" INNER JOIN' in query]), 1, url_name)
+            self.assertEqual(len([query for query in sql if 'FROM "main_votevariant"' in query]),
+                             variant_queries, url_name)
+
+    def test_voting_edit(self):
+        self.client.force_login(self.author)
+        self.assertWithinBudget('voting_edit', reverse('voting_edit', kwargs={'pk': self.voting.id}))
+
+    def test_vote(self):
+        url = reverse('vote', kwargs={'id': self.voting.id})
+        self.assertWithinBudget('vote', url)
+        self.assertWithinBudget('vote', url, 'post', {'choices': [v.id for v in self.variants]}, status=302)
+
+    def test_vote_authenticated(self):
+        url = reverse('vote', kwargs={'id': self.voting.id})
+        self.client.force_login(User.objects.create_user('late', 'late@example.com', 'password'))
+        self.assertWithinBudget('vote', url)
+        self.assertWithinBudget('vote', url, 'post', {'choices': [v.id for v in self.variants]}, status=302)
+
+    def test_results_page(self):
+        url = reverse('results_page', kwargs={'id': self.voting.id})
+        self.assertWithinBudget('results_page', url)
+        self.client.force_login(self.voters[0])
+        self.assertWithinBudget('results_page', url)
+        Voting.objects.filter(id=self.voting.id).update(finishes=timezone.now() - datetime.timedelta(hours=1))
+        self.assertWithinBudget('results_page', url)
+
+    def test_results_json(self):
+        self.assertWithinBudget('results_json', reverse('results_json', kwargs={'id': self.voting.id}))
+
+    def test_voting_search(self):
+        self.assertWithinBudget('voting_search', reverse('voting_search'))
+        self.assertWithinBudget('voting_search', reverse('voting_search'), data={'q': self.voting.id}, status=302)
+        self.client.force_login(self.voters[0])
+        self.assertWithinBudget('voting_search', reverse('voting_search'))
+        self.assertWithinBudget('voting_search', reverse('voting_search'), data={'q': 'voting'})
+
+    def test_series_page(self):
+        self.assertWithinBudget('series_page', reverse('series_page', kwargs={'id': self.voting.id}))
+
+    def test_profile_edit(self):
+        self.client.force_login(self.voters[0])
+        self.assertWithinBudget('profile_edit', reverse('profile_edit'))
+
+    def test_profile(self):
+        self.client.force_login(self.voters[0])
+        self.assertWithinBudget('profile', reverse('profile', kwargs={'id': self.voters[0].id}))
+
+    def test_logout(self):
+        self.client.force_login(self.voters[0])
+        self.assertWithinBudget('logout', reverse('logout'), status=302)
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.admin)
+        self.assertWithinBudget('admin:main_votefact_changelist', reverse('admin:main_votefact_changelist'))
+        self.assertWithinBudget('admin:main_voting_changelist', reverse('admin:main_voting_changelist'))
+
+    def test_register(self):
+        self.assertWithinBudget('register', reverse('register'))
+        self.assertWithinBudget('register', reverse('register'), 'post', {
+            'username': 'newcomer', 'email': 'newcomer@example.com',
+            'password1': 'Sup3r-secret', 'password2': 'Sup3r-secret',
+        }, status=302)
+        self.assertTrue(User.objects.filter(username='newcomer').exists())
+
+    def test_login(self):
+        self.assertWithinBudget('login', reverse('login'))
+        self.assertWithinBudget('login', reverse('login'), 'post',
+                                {'username': self.voters[0].email, 'password': 'password'}, status=302)
+
+    def test_password_reset(self):
+        self.assertWithinBudget('password_reset', reverse('password_reset'))
+        self.assertWithinBudget('password_reset', reverse('password_reset'), 'post',
+                                {'email': self.voters[0].email}, status=302)
+        self.assertWithinBudget('password_reset_done', reverse('password_reset_done'))
+        url = reverse('password_reset_confirm', kwargs={
+            'uidb64': urlsafe_base64_encode(force_bytes(self.voters[0].pk)),
+            'token': default_token_generator.make_token(self.voters[0]),
+        })
+        # the token is moved into the session and the form is served from a fixed URL
+        response = self.assertWithinBudget('password_reset_confirm', url, status=302)
+        self.assertWithinBudget('password_reset_confirm', response.url)
+        self.assertWithinBudget('password_reset_confirm', response.url, 'post', {
+            'new_password1': 'Sup3r-secret', 'new_password2': 'Sup3r-secret',
+        }, status=302)
+        self.assertWithinBudget('password_reset_complete', reverse('password_reset_complete'))
+
+    def test_voting_delete(self):
+        self.client.force_login(self.author)
+        self.assertWithinBudget('voting_delete', reverse('voting_delete', kwargs={'pk': self.voting.id}),
+                                'post', status=302)
+        self.assertFalse(Voting.objects.filter(id=self.voting.id).exists())
+
+    def test_export_votes(self):
+        self.client.force_login(self.author)
+        for export_format in ('csv', 'ndjson'):
+            self.assertWithinBudget('export_votes', reverse('export_votes', kwargs={
+                'id': self.voting.id, 'export_format': export_format,
+            }))
+
+    def test_media(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(MEDIA_ROOT=directory):
+            with open(os.path.join(directory, 'photo.jpg'), 'wb') as file:
+                file.write(b'jpeg')
+            self.assertWithinBudget('media', '/media/photo.jpg')
+            self.client.force_login(self.voters[0])
+            self.assertWithinBudget('media', '/media/photo.jpg')
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_percentile(self):
+        values = list(range(100, 0, -1))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile([7], 95), 7)
+
+    def test_compare(self):
+        def results(p95, queries, peak):
+            return {'views': {'vote': {'p95_ms': p95, 'max_queries': queries, 'peak_kb': peak}}}
+
+        command = BenchmarkCommand(stdout=io.StringIO())
+        self.assertEqual(command.compare(results(10, 5, 100), results(11, 5, 110), 0.2), [])
+        self.assertEqual(len(command.compare(results(10, 5, 100), results(13, 6, 130), 0.2)), 3)
+
+    def test_run(self):
+        # the command creates and drops its own test database, so it runs outside of this one
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            subprocess.run([
+                sys.executable, 'manage.py', 'benchmark', '--votings', '10', '--facts', '100', '--users', '10',
+                '--requests', '2', '--batch-size', '30', '--output', output,
+            ], cwd=settings.BASE_DIR, check=True, capture_output=True)
+            with open(output) as file:
+                results = json.load(file)
+            completed = subprocess.run([
+                sys.executable, 'manage.py', 'benchmark', '--votings', '10', '--facts', '100', '--users', '10',
+                '--requests', '2', '--batch-size', '30', '--compare', output, '--threshold', '1000',
+            ], cwd=settings.BASE_DIR, check=True, capture_output=True, text=True)
+        self.assertEqual(results['meta']['facts'], 100)
+        self.assertEqual(set(results['views']), {'vote', 'results_page', 'voting_page', 'profile', 'votings_list'})
+        self.assertTrue(all(stats['max_queries'] > 0 for stats in results['views'].values()))
+        self.assertIn('No regressions', completed.stdout)
+
+
+class AdminTests(VotingTestData):
+    def test_estimated_count(self):
+        facts = VoteFact.objects.order_by('id')
+        with mock.patch('main.admin.estimate_count', return_value=10 ** 6):
+            with self.assertNumQueries(0):
+                self.assertEqual(EstimatedCountPaginator(facts, 100).count, 10 ** 6)
+            # filtered changelists and small tables are counted exactly
+            self.assertEqual(EstimatedCountPaginator(facts.filter(voting=self.voting), 100).count,
+                             len(self.voters))
+        with mock.patch('main.admin.estimate_count', return_value=10):
+            self.assertEqual(EstimatedCountPaginator(facts, 100).count, facts.count())
+
+    def test_change_form_uses_raw_id_widgets(self):
+        self.client.force_login(self.admin)
+        fact = VoteFact.objects.filter(voting=self.voting).first()
+        response = self.client.get(reverse('admin:main_votefact_change', args=[fact.id]))
+        self.assertContains(response, 'vManyToManyRawIdAdminField')
+        self.assertNotContains(response, f'<option value="{self.voters[1].id}"')
+        response = self.client.get(reverse('admin:main_votefact_changelist'), {'created__year': fact.created.year})
+        self.assertContains(response, f'/admin/main/votefact/{fact.id}/change/')
+
+
+class TallyTests(VotingTestData):
+    def assertTalliesMatchFacts(self):
+        """
+        compares the denormalized counters with a recount of the VoteFact rows
+        """
+        for voting in Voting.objects.all():
+            self.assertEqual(voting.voters, VoteFact.objects.filter(voting=voting).count(), voting.name)
+        for variant in VoteVariant.objects.all():
+            self.assertEqual(variant.votes, VoteFact.objects.filter(variants=variant).count(), variant.description)
+
+    def test_rebuild_tallies(self):
+        Voting.objects.update(voters=0)
+        VoteVariant.objects.update(votes=42)
+        version = Voting.objects.get(id=self.voting.id).tally_version
+        self.assertEqual(rebuild_tallies([self.voting.id]), 1)
+        self.assertEqual(Voting.objects.get(id=self.voting.id).voters, len(self.voters))
+        self.assertEqual(Voting.objects.get(id=self.voting.id).tally_version, version + 1)
+        self.assertEqual(Voting.objects.get(id=self.other_voting.id).voters, 0)
+        self.assertEqual(rebuild_tallies(batch_size=1), 2)
+        self.assertTalliesMatchFacts()
+
+    def test_rebuild_reads_and_writes_in_one_statement(self):
+        # no separate read of the counts that a concurrent vote could invalidate before the write
+        VoteVariant.objects.update(votes=42)
+        with self.assertNumQueries(2):
+            rebuild_tally_batch([self.voting.id, self.other_voting.id])
+        self.assertTalliesMatchFacts()
+
+    def test_votes_keep_tallies(self):
+        self.client.force_login(User.objects.create_user('late', 'late@example.com', 'password'))
+        self.client.post(reverse('vote', kwargs={'id': self.voting.id}), {'choices': [self.variants[0].id]})
+        self.assertTalliesMatchFacts()
+
+    def test_repeated_choice_counted_once(self):
+        self.client.force_login(User.objects.create_user('late', 'late@example.com', 'password'))
+        rollup = VariantRollup.objects.filter(variant=self.variants[0])
+        votes = VoteVariant.objects.get(id=self.variants[0].id).votes
+        rollup_votes = sum(rollup.values_list('votes', flat=True))
+        self.client.post(reverse('vote', kwargs={'id': self.voting.id}), {'choices': [self.variants[0].id] * 3})
+        self.assertEqual(VoteVariant.objects.get(id=self.variants[0].id).votes, votes + 1)
+        self.assertEqual(sum(rollup.values_list('votes', flat=True)), rollup_votes + 1)
+        self.assertTalliesMatchFacts()
+
+    def test_admin_changes_recount_tallies(self):
+        self.client.force_login(self.admin)
+        fact = VoteFact.objects.filter(voting=self.voting).first()
+        self.client.post(reverse('admin:main_votefact_change', args=[fact.id]), {
+            'voting': self.other_voting.id, 'user': fact.user_id,
+            'variants': str(self.other_variants[0].id),
+            'created_0': fact.created.strftime('%Y-%m-%d'), 'created_1': fact.created.strftime('%H:%M:%S'),
+        })
+        self.assertEqual(list(VoteFact.objects.get(id=fact.id).variants.all()), [self.other_variants[0]])
+        self.assertTalliesMatchFacts()
+        self.client.post(reverse('admin:main_votefact_delete', args=[fact.id]), {'post': 'yes'})
+        self.assertTalliesMatchFacts()
+        facts = VoteFact.objects.filter(voting=self.voting)[:2]
+        self.client.post(reverse('admin:main_votefact_changelist'), {
+            'action': 'delete_selected', 'post': 'yes', '_selected_action': [fact.id for fact in facts],
+        })
+        self.assertEqual(VoteFact.objects.filter(voting=self.voting).count(), len(self.voters) - 3)
+        self.assertTalliesMatchFacts()
+        self.client.post(reverse('admin:auth_user_delete', args=[self.voters[4].id]), {'post': 'yes'})
+        self.assertFalse(User.objects.filter(id=self.voters[4].id).exists())
+        self.assertTalliesMatchFacts()
+
+    def test_admin_delete_drops_snapshot(self):
+        Voting.objects.filter(id=self.voting.id).update(finishes=timezone.now() - datetime.timedelta(days=1))
+        create_due_snapshots()
+        self.client.force_login(self.admin)
+        fact = VoteFact.objects.filter(voting=self.voting).first()
+        self.client.post(reverse('admin:main_votefact_delete', args=[fact.id]), {'post': 'yes'})
+        response = self.client.get(reverse('results_page', kwargs={'id': self.voting.id}))
+        self.assertEqual(response.context['voting'].voters, len(self.voters) - 1)
+        self.assertEqual(sum(response.context['facts'].values()), VoteFact.variants.through.objects.filter(
+            votefact__voting=self.voting).count())
+
+
+@override_settings(MIDDLEWARE=['main.middleware.QueryBudgetMiddleware'] + [
+    middleware for middleware in settings.MIDDLEWARE if middleware != 'main.middleware.QueryBudgetMiddleware'
+])
+class QueryBudgetMiddlewareTests(VotingTestData):
+    def test_headers(self):
+        response = self.client.get(reverse('voting_page', kwargs={'id': self.voting.id}))
+        self.assertIn('X-Query-Count', response)
+        self.assertTrue(response['X-Query-Time'].endswith('ms'))
+
+    @override_settings(QUERY_BUDGETS={'voting_page': 0})
+    def test_warns_over_budget(self):
+        with self.assertLogs('main.middleware', 'WARNING'):
+            self.client.get(reverse('voting_page', kwargs={'id': self.voting.id}))
+
+
+class ResultsJsonTests(VotingTestData):
+    def test_conditional_get(self):
+        url = reverse('results_json', kwargs={'id': self.voting.id})
+        response = self.client.get(url)
+        self.assertFalse(response.json()['finished'])
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response['ETag']), (304, etag))
+
+        # closing the voting changes the ETag without any new vote
+        Voting.objects.filter(id=self.voting.id).update(finishes=timezone.now() - datetime.timedelta(minutes=1))
+        cache.clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['finished'])
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class ResultsChartTests(VotingTestData):
+    def test_chart_cached_by_tally_version(self):
+        url = reverse('results_page', kwargs={'id': self.voting.id})
+        with mock.patch('main.views.create_chart', return_value='chart') as create_chart:
+            self.client.get(url)
+            response = self.client.get(url)
+            self.assertEqual(create_chart.call_count, 1)
+            self.assertEqual(response.context['plotly'], 'chart')
+            self.client.force_login(User.objects.create_user('late', 'late@example.com', 'password'))
+            self.client.post(reverse('vote', kwargs={'id': self.voting.id}), {'choices': [self.variants[0].id]})
+            self.client.get(url)
+            self.assertEqual(create_chart.call_count, 2)
+            self.assertEqual(create_chart.call_args[0][0]['Variant 0'],
+                             VoteVariant.objects.get(id=self.variants[0].id).votes)
+
+
+class VotingParticipationTests(VotingTestData):
+    def test_vote_writes_participation(self):
+        user = User.objects.create_user('late', 'late@example.com', 'password')
+        self.client.force_login(user)
+        self.client.post(reverse('vote', kwargs={'id': self.voting.id}), {'choices': [self.variants[0].id]})
+        self.assertTrue(VotingParticipation.objects.filter(voting=self.voting, user=user).exists())
+        self.assertEqual(VoteFact.objects.filter(voting=self.voting, user=user).count(), 1)
+
+    def test_second_vote_rejected(self):
+        self.client.force_login(self.voters[0])
+        response = self.client.post(reverse('vote', kwargs={'id': self.voting.id}), {'choices': [self.variants[0].id]})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(VoteFact.objects.filter(voting=self.voting, user=self.voters[0]).count(), 1)
+
+    def test_admin_changes_follow_participations(self):
+        self.client.force_login(self.admin)
+        fact = VoteFact.objects.get(voting=self.voting, user=self.voters[0])
+        self.client.post(reverse('admin:main_votefact_change', args=[fact.id]), {
+            'voting': self.voting.id, 'user': self.author.id, 'variants': str(self.variants[0].id),
+            'created_0': fact.created.strftime('%Y-%m-%d'), 'created_1': fact.created.strftime('%H:%M:%S'),
+        })
+        self.assertFalse(VotingParticipation.objects.filter(voting=self.voting, user=self.voters[0]).exists())
+        self.assertTrue(VotingParticipation.objects.filter(voting=self.voting, user=self.author).exists())
+        self.client.post(reverse('admin:main_votefact_delete', args=[fact.id]), {'post': 'yes'})
+        self.assertFalse(VotingParticipation.objects.filter(voting=self.voting, user=self.author).exists())
+        facts = VoteFact.objects.filter(voting=self.other_voting, user__in=self.voters[1:3])
+        self.client.post(reverse('admin:main_votefact_changelist'), {
+            'action': 'delete_selected', 'post': 'yes', '_selected_action': [fact.id for fact in facts],
+        })
+        self.assertEqual(VotingParticipation.objects.filter(voting=self.other_voting).count(), len(self.voters) - 2)
+        self.client.force_login(self.voters[0])
+        self.client.post(reverse('vote', kwargs={'id': self.voting.id}), {'choices': [self.variants[1].id]})
+        self.assertEqual(VoteFact.objects.filter(voting=self.voting, user=self.voters[0]).count(), 1)
+
+
+class VoteQueueTests(VotingTestData):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            VOTE_INGESTION='queue',
+            VOTE_SPOOL_PATH=os.path.join(directory.name, 'votes.sqlite3'),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user('late', 'late@example.com', 'password')
+
+    def test_drain_round_trip(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('vote', kwargs={'id': self.voting.id}), {'choices': [self.variants[0].id]})
+        self.assertFalse(VoteFact.objects.filter(user=self.user).exists())
+        self.assertEqual(vote_queue.drain(10)[:2], (1, 1))
+        self.assertEqual(vote_queue.drain(10), (0, 0, None))
+        fact = VoteFact.objects.get(user=self.user)
+        self.assertEqual(list(fact.variants.all()), [self.variants[0]])
+        self.assertTrue(VotingParticipation.objects.filter(voting=self.voting, user=self.user).exists())
+        self.assertEqual(Voting.objects.get(id=self.voting.id).voters, len(self.voters) + 1)
+
+    def test_participation_written_meanwhile(self):
+        vote_queue.enqueue_ballot(self.voting, self.user, [self.variants[0].id])
+        VotingParticipation.objects.create(voting=self.voting, user=self.user)
+        # the first attempt misses the participation of a concurrent sync vote and hits the unique constraint
+        voted = vote_queue.voted_pairs([self.voting.id], [self.user.id])
+        with mock.patch('main.vote_queue.voted_pairs', side_effect=[set(), voted]):
+            self.assertEqual(vote_queue.drain(10)[:2], (1, 0))
+        self.assertFalse(VoteFact.objects.filter(user=self.user).exists())
+        self.assertEqual(vote_queue.queue_lag()[0], 0)
+
+    def test_redrain_after_crash(self):
+        vote_queue.enqueue_ballot(self.voting, None, [self.variants[0].id])
+        with mock.patch.object(Spool, 'ack', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                vote_queue.drain(10)
+        # the batch stays claimed by the crashed worker until its lease runs out
+        self.assertEqual(vote_queue.drain(10), (0, 0, None))
+        with mock.patch('time.time', return_value=time.time() + settings.VOTE_SPOOL_LEASE + 1):
+            self.assertEqual(vote_queue.drain(10)[:2], (1, 0))
+        self.assertEqual(VoteFact.objects.filter(voting=self.voting, user=None).count(), 1)
+        self.assertEqual(vote_queue.queue_lag()[0], 0)
+
+    def test_repeated_choice_counted_once(self):
+        votes = VoteVariant.objects.get(id=self.variants[0].id).votes
+        vote_queue.enqueue_ballot(self.voting, self.user, [self.variants[0].id] * 2)
+        self.assertEqual(vote_queue.drain(10)[:2], (1, 1))
+        self.assertEqual(VoteVariant.objects.get(id=self.variants[0].id).votes, votes + 1)
+
+    def test_bad_ballot_rejected(self):
+        vote_queue.enqueue_ballot(self.voting, None, [self.variants[0].id])
+        vote_queue.get_spool().append({'ballot': 'broken', 'voting': self.voting.id, 'user': None,
+                                       'variants': [self.variants[1].id], 'created': 'yesterday'})
+        vote_queue.enqueue_ballot(self.voting, self.user, [self.variants[2].id])
+        with self.assertLogs('main.vote_queue', 'ERROR'):
+            self.assertEqual(vote_queue.drain(10)[:2], (3, 2))
+        self.assertEqual(VoteFact.objects.filter(voting=self.voting, user=None).count(), 1)
+        self.assertTrue(VoteFact.objects.filter(voting=self.voting, user=self.user).exists())
+        self.assertEqual(vote_queue.queue_lag()[0], 0)
+        self.assertEqual([payload['ballot'] for _, _, payload in vote_queue.get_spool().rejected()], ['broken'])
+
+
+@override_settings(VOTINGS_PAGE_SIZE=2)
+class VotingsListTests(VotingTestData):
+    def test_keyset_pagination(self):
+        now = timezone.now()
+        for i in range(3):
+            Voting.objects.create(name=f'Weekly {i}', description='Description', author=self.author,
+                                  published=now + datetime.timedelta(days=i), finishes=now + datetime.timedelta(days=i + 1))
+        self.client.force_login(self.author)
+        seen = []
+        response = self.client.get(reverse('votings_list'))
+        while True:
+            seen += [voting.id for voting in response.context['votings']]
+            if not response.context['next_cursor']:
+                break
+            response = self.client.get(reverse('votings_list'), {'cursor': response.context['next_cursor']})
+        expected = Voting.objects.filter(author=self.author).order_by('-published', '-id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_malformed_cursor(self):
+        self.client.force_login(self.author)
+        first_page = [voting.id for voting in self.client.get(reverse('votings_list')).context['votings']]
+        for cursor in ('x', '1.2.3', '99999999999999999999.1', '-99999999999999999999.1', '1.99999999999999999999'):
+            response = self.client.get(reverse('votings_list'), {'cursor': cursor})
+            self.assertEqual([voting.id for voting in response.context['votings']], first_page, cursor)
+
+    def test_status_annotation(self):
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('votings_list'))
+        self.assertEqual({voting.status for voting in response.context['votings']}, {Voting.IN_PROGRESS})
+
+
+class ResultSnapshotTests(VotingTestData):
+    def finish(self, voting):
+        Voting.objects.filter(id=voting.id).update(
+            published=timezone.now() - datetime.timedelta(days=2),
+            finishes=timezone.now() - datetime.timedelta(days=1),
+        )
+
+    def test_results_frozen_on_first_view(self):
+        self.finish(self.voting)
+        url = reverse('results_page', kwargs={'id': self.voting.id})
+        facts = self.client.get(url).context['facts']
+        snapshot = VotingResultSnapshot.objects.get(voting=self.voting)
+        self.assertEqual(dict(snapshot.facts), facts)
+        self.assertEqual(snapshot.voters, len(self.voters))
+        # later changes of the tallies do not reach a frozen result
+        VoteVariant.objects.filter(voting=self.voting).update(votes=100)
+        self.assertEqual(self.client.get(url).context['facts'], facts)
+
+    def test_served_from_snapshot_only(self):
+        self.finish(self.voting)
+        url = reverse('results_page', kwargs={'id': self.voting.id})
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.context['turnout'], VotingResultSnapshot.objects.get(voting=self.voting).turnout)
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'main_votevariant' in query['sql'] or 'rollup' in query['sql']])
+
+    def test_reopened_voting_frozen_again(self):
+        self.finish(self.voting)
+        url = reverse('results_page', kwargs={'id': self.voting.id})
+        self.client.get(url)
+        # the admin moves the end of the voting into the future and it takes another ballot
+        self.client.force_login(self.admin)
+        voting = Voting.objects.get(id=self.voting.id)
+        finishes = timezone.localtime() + datetime.timedelta(hours=1)
+        self.client.post(reverse('admin:main_voting_change', args=[voting.id]), {
+            'name': voting.name, 'description': voting.description, 'author': voting.author_id, 'type': voting.type,
+            'published_0': timezone.localtime(voting.published).strftime('%Y-%m-%d'),
+            'published_1': timezone.localtime(voting.published).strftime('%H:%M:%S'),
+            'finishes_0': finishes.strftime('%Y-%m-%d'), 'finishes_1': finishes.strftime('%H:%M:%S'),
+            'votevariant_set-TOTAL_FORMS': 4, 'votevariant_set-INITIAL_FORMS': 4,
+            **{f'votevariant_set-{i}-id': variant.id for i, variant in enumerate(self.variants)},
+            **{f'votevariant_set-{i}-voting': voting.id for i, variant in enumerate(self.variants)},
+            **{f'votevariant_set-{i}-description': variant.description for i, variant in enumerate(self.variants)},
+        })
+        self.assertEqual(Voting.objects.get(id=voting.id).finishes.replace(microsecond=0),
+                         finishes.replace(microsecond=0))
+        self.assertFalse(self.client.get(reverse('results_json', kwargs={'id': voting.id})).json()['finished'])
+        self.client.force_login(User.objects.create_user('late', 'late@example.com', 'password'))
+        self.client.post(reverse('vote', kwargs={'id': voting.id}), {'choices': [self.variants[3].id]})
+        self.finish(self.voting)
+        facts = self.client.get(url).context['facts']
+        self.assertEqual(facts['Variant 3'], VoteVariant.objects.get(id=self.variants[3].id).votes)
+        self.assertEqual(dict(VotingResultSnapshot.objects.get(voting=voting).facts), facts)
+
+    def test_open_voting_not_frozen(self):
+        self.client.get(reverse('results_page', kwargs={'id': self.voting.id}))
+        self.assertFalse(VotingResultSnapshot.objects.exists())
+
+    def test_command_freezes_finished_votings(self):
+        self.finish(self.other_voting)
+        self.assertEqual(create_due_snapshots(), 1)
+        self.assertEqual(create_due_snapshots(), 0)
+        self.assertTrue(VotingResultSnapshot.objects.filter(voting=self.other_voting).exists())
+
+    def test_command_counts_only_its_snapshots(self):
+        self.finish(self.voting)
+        self.finish(self.other_voting)
+        filter = VotingResultSnapshot.objects.filter
+
+        def freeze_meanwhile(*args, **kwargs):
+            # a results page freezes a voting after the command has read its batch
+            VotingResultSnapshot.objects.create(voting=self.other_voting, facts=[], voters=0)
+            return filter(*args, **kwargs)
+
+        with mock.patch.object(VotingResultSnapshot.objects, 'filter', side_effect=freeze_meanwhile):
+            self.assertEqual(create_due_snapshots(), 1)
+        self.assertEqual(VotingResultSnapshot.objects.count(), 2)
+
+
+class ResultsStreamTests(SimpleTestCase):
+    def test_tally_delta(self):
+        old = {1: ['a', 2], 2: ['b', 0]}
+        new = {1: ['a', 2], 2: ['b', 3], 3: ['c', 1]}
+        self.assertEqual(tally_delta(old, new), {2: 3, 3: 1})
+
+    def test_subscriber_coalesces_updates(self):
+        subscriber = Subscriber()
+        subscriber.push({'version': 1, 'voters': 1, 'variants': {1: 1}, 'finished': False})
+        subscriber.push({'version': 2, 'voters': 2, 'variants': {1: 2, 2: 1}, 'finished': False})
+        self.assertEqual(subscriber.take(), {'version': 2, 'voters': 2, 'variants': {1: 2, 2: 1}, 'finished': False})
+        self.assertFalse(subscriber.changed.is_set())
+
+    def test_poll_drops_stale_connections(self):
+        with mock.patch('main.sse.close_old_connections') as close_old_connections, \
+                mock.patch('main.sse.read_tallies', return_value=None):
+            self.assertIsNone(poll_tallies(1, 1))
+        self.assertEqual(close_old_connections.call_count, 2)
+
+    @override_settings(SSE_MAX_UPDATES_PER_SECOND=1000)
+    def test_poller_survives_errors(self):
+        polls = []
+
+        def poll_tallies(voting_id, known_version):
+            polls.append(known_version)
+            if len(polls) == 1:
+                raise OperationalError('server has gone away')
+            return (2, False, 3, {1: ['a', 5]}) if known_version == 1 else (2, False, 3, None)
+
+        async def scenario():
+            broadcaster = ResultsBroadcaster()
+            subscriber = broadcaster.subscribe(1, (1, False, 2, {1: ['a', 4]}))
+            await asyncio.wait_for(subscriber.changed.wait(), 1)
+            broadcaster.unsubscribe(1, subscriber)
+            return subscriber.take()
+
+        with mock.patch('main.sse.poll_tallies', poll_tallies), self.assertLogs('main.sse', 'ERROR'):
+            update = asyncio.run(scenario())
+        self.assertEqual(update, {'version': 2, 'voters': 3, 'variants': {1: 5}, 'finished': False})
+
+    def test_stopped_poller_replaced(self):
+        async def scenario():
+            broadcaster = ResultsBroadcaster()
+            waiting = broadcaster.subscribe(1, (1, False, 2, {1: ['a', 4], 2: ['b', 0]}))
+            broadcaster.pollers[1].cancel()
+            await asyncio.sleep(0)
+            subscriber = broadcaster.subscribe(1, (3, False, 4, {1: ['a', 5], 2: ['b', 1]}))
+            running = not broadcaster.pollers[1].done()
+            broadcaster.unsubscribe(1, waiting)
+            broadcaster.unsubscribe(1, subscriber)
+            return running, waiting.take()
+
+        running, update = asyncio.run(scenario())
+        self.assertTrue(running)
+        self.assertEqual(update, {'version': 3, 'voters': 4, 'variants': {1: 5, 2: 1}, 'finished': False})
+
+
+class AnonymousPageCacheTests(VotingTestData):
+    def test_voting_page_cached_until_edit(self):
+        url = reverse('voting_page', kwargs={'id': self.voting.id})
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), 'Voting')
+        self.voting.name = 'Renamed'
+        self.voting.save()
+        self.assertContains(self.client.get(url), 'Renamed')
+
+    def test_pages_expire_in_other_workers(self):
+        url = reverse('voting_page', kwargs={'id': self.voting.id})
+        self.client.get(url)
+        # another worker deletes the voting, its signal handlers clear only that worker's cache
+        with mock.patch('main.signals.forget_voting_pages'):
+            Voting.objects.filter(id=self.voting.id).delete()
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with mock.patch('time.time', return_value=time.time() + settings.PAGE_CACHE_TIMEOUT + 1):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_bypass_after_vote(self):
+        url = reverse('voting_page', kwargs={'id': self.voting.id})
+        self.assertTrue(self.client.get(url).context['eligible_to_vote'])
+        self.client.post(reverse('vote', kwargs={'id': self.voting.id}), {'choices': [self.variants[0].id]})
+        self.assertFalse(self.client.get(url).context['eligible_to_vote'])
+
+    def test_authenticated_not_cached(self):
+        url = reverse('voting_page', kwargs={'id': self.voting.id})
+        self.client.force_login(self.author)
+        self.client.get(url)
+        self.assertIsNotNone(self.client.get(url).context)
+
+
+class ExportVotesTests(VotingTestData):
+    def test_csv_export(self):
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('export_votes', kwargs={'id': self.voting.id, 'export_format': 'csv'}))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,user_id,username,created,variant_ids,variants')
+        self.assertEqual(len(lines), len(self.voters) + 1)
+
+    def test_ndjson_export_in_chunks(self):
+        lines = list(export_votes(self.voting.id, 'ndjson', chunk_size=2))
+        self.assertEqual(len(lines), len(self.voters))
+        self.assertIn('"variants": ["Variant 0", "Variant 1"]', lines[0])
+
+    def test_only_author_exports(self):
+        self.client.force_login(self.voters[0])
+        response = self.client.get(reverse('export_votes', kwargs={'id': self.voting.id, 'export_format': 'csv'}))
+        self.assertEqual(response.status_code, 403)
+
+
+class ImageRenditionTests(VotingTestData):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            MEDIA_ROOT=directory.name,
+            IMAGE_SPOOL_PATH=os.path.join(directory.name, 'spool', 'images.sqlite3'),
+            IMAGE_RENDITION_WIDTHS=(320, 640, 1280),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, width):
+        buffer = io.BytesIO()
+        Image.new('RGBA', (width, width // 2), 'red').save(buffer, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.voting.image = SimpleUploadedFile('photo.png', buffer.getvalue())
+            self.voting.save()
+
+    def test_renditions_created_by_worker(self):
+        self.upload(800)
+        self.assertEqual(drain_images(10), (1, 1))
+        self.voting.refresh_from_db()
+        self.assertEqual(self.voting.image_renditions['widths'], [320, 640])
+        for name in rendition_names(self.voting.image_renditions):
+            self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, name)))
+
+        response = self.client.get(reverse('voting_page', kwargs={'id': self.voting.id}))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, '-320.webp 320w')
+        self.assertContains(response, f'/media/{self.voting.image.name} 800w')
+
+    def test_replaced_image_skipped_and_cleared(self):
+        self.upload(800)
+        self.upload(400)
+        self.assertEqual(drain_images(10), (2, 1))
+        self.voting.refresh_from_db()
+        renditions = rendition_names(self.voting.image_renditions)
+        self.assertEqual(len(renditions), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.voting.image = None
+            self.voting.save()
+        self.voting.refresh_from_db()
+        self.assertEqual(self.voting.image_renditions, {})
+        for name in renditions:
+            self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, name)))
+
+    def test_oversized_image_does_not_block_queue(self):
+        self.upload(800)
+        self.upload(400)
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 100), self.assertLogs('main.images', 'WARNING'):
+            self.assertEqual(drain_images(10), (2, 0))
+        self.assertEqual(drain_images(10), (0, 0))
+
+    def test_claimed_by_one_worker(self):
+        self.upload(800)
+        self.assertEqual(len(get_image_spool().claim(10, settings.IMAGE_SPOOL_LEASE)), 1)
+        self.assertEqual(drain_images(10), (0, 0))
+        with mock.patch('time.time', return_value=time.time() + settings.IMAGE_SPOOL_LEASE + 1):
+            self.assertEqual(drain_images(10), (1, 1))
+
+    def test_unchanged_image_not_queued(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (800, 400), 'red').save(buffer, 'PNG')
+        profile = self.voters[0].profile
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.profile_image = SimpleUploadedFile('avatar.png', buffer.getvalue())
+            profile.save()
+            profile.save()
+        # the login of the user saves the profile loaded from the database
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_login(User.objects.get(id=self.voters[0].id))
+        self.assertEqual(get_image_spool().stats()[0], 1)
+
+
+class MediaServingTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        os.makedirs(os.path.join(directory.name, 'renditions', 'votings'))
+        self.name = 'renditions/votings/photo-0123456789-320.webp'
+        with open(os.path.join(directory.name, self.name), 'wb') as file:
+            file.write(bytes(range(100)))
+
+    def test_conditional_and_range_requests(self):
+        url = f'/media/{self.name}'
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(100)))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(95, 100)))
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=200-').status_code, 416)
+
+    def test_accel_redirect_and_traversal(self):
+        with override_settings(MEDIA_SERVE_MODE='nginx', MEDIA_ACCEL_PREFIX='/protected-media/'):
+            response = self.client.get(f'/media/{self.name}')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/renditions/missing.jpg').status_code, 404)
+
+
+class SessionVotesTests(VotingTestData):
+    def test_ranges(self):
+        ranges = ranges_from_ids([5, 1, 2, 9, 3])
+        self.assertEqual(ranges, [1, 4, 5, 6, 9, 10])
+        self.assertTrue(ranges_add(ranges, 4))
+        self.assertFalse(ranges_add(ranges, 4))
+        self.assertEqual(ranges, [1, 6, 9, 10])
+        self.assertEqual([i for i in range(12) if ranges_contain(ranges, i)], [1, 2, 3, 4, 5, 9])
+
+    @override_settings(SESSION_VOTES_MAX_RANGES=2)
+    def test_size_is_bounded(self):
+        self.assertEqual(ranges_from_ids([1, 3, 5, 7], []), [1, 2, 3, 4, 5, 6, 7, 8])
+        session = self.client.session
+        session[LEGACY_SESSION_KEY] = [1, 3, 5, 7]
+        session.save()
+        response = self.client.get(reverse('vote', kwargs={'id': self.voting.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session[SESSION_KEY], [5, 6, 7, 8])
+        self.assertNotIn(LEGACY_SESSION_KEY, self.client.session)
+
+    def test_legacy_list_migrated(self):
+        session = self.client.session
+        session[LEGACY_SESSION_KEY] = [self.voting.id]
+        session.save()
+        response = self.client.get(reverse('vote', kwargs={'id': self.voting.id}))
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.session[SESSION_KEY], [self.voting.id, self.voting.id + 1])
+
+    def test_logout_keeps_votes_of_open_votings(self):
+        self.voting.finishes = timezone.now() - datetime.timedelta(minutes=1)
+        self.voting.save()
+        self.client.force_login(self.voters[0])
+        self.client.get(reverse('logout'))
+        self.assertEqual(self.client.session[SESSION_KEY], [self.other_voting.id, self.other_voting.id + 1])
+
+        self.client.get(reverse('logout'))
+        self.assertEqual(self.client.session[SESSION_KEY], [self.other_voting.id, self.other_voting.id + 1])
+
+
+class CreateVotingTests(VotingTestData):
+    def voting_fields(self, **fields):
+        now = timezone.now()
+        return dict({
+            'author': self.author,
+            'name': 'Created',
+            'description': 'Description',
+            'type': Voting.RADIOS,
+            'published': now,
+            'finishes': now + datetime.timedelta(days=1),
+            'variants': ['One', 'Two', 'Three'],
+        }, **fields)
+
+    def test_variants_inserted_in_one_query(self):
+        # savepoint, voting, its full-text row, variants, release
+        with self.assertNumQueries(5):
+            voting = create_voting(**self.voting_fields())
+        self.assertEqual(list(voting.votevariant_set.order_by('id').values_list('description', flat=True)),
+                         ['One', 'Two', 'Three'])
+
+    def test_batch_queries(self):
+        votings = []
+        for i in range(3):
+            fields = self.voting_fields(name=f'Created {i}')
+            votings.append((Voting(**{name: value for name, value in fields.items() if name != 'variants'}),
+                            fields['variants']))
+        if connection.features.can_return_rows_from_bulk_insert:
+            # savepoint, votings, variants, release
+            expected = 4
+        else:
+            # savepoint, a voting and its full-text row per voting, variants, release
+            expected = 2 * len(votings) + 3
+        with self.assertNumQueries(expected):
+            saved = create_votings(votings)
+        self.assertEqual(VoteVariant.objects.filter(voting__in=saved).count(), 3 * len(votings))
+
+    def test_failure_leaves_nothing(self):
+        with mock.patch.object(VoteVariant.objects, 'bulk_create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                create_voting(**self.voting_fields())
+        self.assertFalse(Voting.objects.filter(name='Created').exists())
+
+    def test_variant_count_validated(self):
+        with self.assertRaises(ValidationError):
+            create_voting(**self.voting_fields(variants=['One']))
+        with self.assertRaises(ValidationError):
+            create_voting(**self.voting_fields(type=Voting.BUTTONS))
+
+    def test_page_shows_service_errors(self):
+        self.client.force_login(self.author)
+        start = timezone.localtime() + datetime.timedelta(hours=1)
+        response = self.client.post(reverse('create_voting'), {
+            'create': 1, 'type_of': '3', 'count3': 3, 'name': 'Created', 'desc': 'Description',
+            'start_time': start.strftime('%Y-%m-%dT%H:%M'),
+            'finish_time': (start + datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            '13-var': 'One', '23-var': 'Two', '33-var': 'Three',
+        })
+        self.assertContains(response, 'должен содержать ровно два варианта')
+        self.assertFalse(Voting.objects.filter(name='Created').exists())
+
+    def test_admin_checks_variants(self):
+        self.client.force_login(self.admin)
+        now = timezone.localtime()
+        data = {
+            'name': 'Created', 'description': 'Description', 'author': self.author.id, 'type': Voting.RADIOS,
+            'published_0': now.strftime('%Y-%m-%d'), 'published_1': now.strftime('%H:%M:%S'),
+            'finishes_0': (now + datetime.timedelta(days=1)).strftime('%Y-%m-%d'), 'finishes_1': '12:00:00',
+            'votevariant_set-TOTAL_FORMS': 2, 'votevariant_set-INITIAL_FORMS': 0,
+            'votevariant_set-0-description': 'One', 'votevariant_set-1-description': '',
+        }
+        response = self.client.post(reverse('admin:main_voting_add'), data)
+        self.assertContains(response, 'хотя бы два варианта')
+        self.assertFalse(Voting.objects.filter(name='Created').exists())
+        data['votevariant_set-1-description'] = 'Two'
+        response = self.client.post(reverse('admin:main_voting_add'), data)
+        self.assertEqual(response.status_code, 302)
+        voting = Voting.objects.get(name='Created')
+        self.assertEqual(list(voting.votevariant_set.order_by('id').values_list('description', flat=True)),
+                         ['One', 'Two'])
+        self.assertEqual(search_votings('created')[0], [voting])
+
+
+class ImportVotingsTests(VotingTestData):
+    def write(self, name, content):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def test_json_stream(self):
+        content = '[{"a": "' + 'x' * 100 + '"},\n {"b": [1, 2]}]'
+        self.assertEqual(list(iter_json(io.StringIO(content))), [{'a': 'x' * 100}, {'b': [1, 2]}])
+        with mock.patch('main.importer.READ_SIZE', 7):
+            self.assertEqual(len(list(iter_json(io.StringIO(content)))), 2)
+        self.assertEqual(len(list(iter_json(io.StringIO('{"a": 1}\n{"a": 2}\n')))), 2)
+
+    def test_json_import_with_series(self):
+        path = self.write('votings.json', json.dumps([
+            {'key': 'first', 'name': 'First', 'description': 'D', 'author': 'author', 'type': 'radios',
+             'published': '2030-01-01T10:00', 'finishes': '2030-01-02T10:00', 'variants': ['A', 'B', 'C'],
+             'next': 'second'},
+            {'key': 'second', 'name': 'Second', 'description': 'D', 'author': 'author', 'type': 'buttons',
+             'published': '2030-01-02T10:00', 'finishes': '2030-01-03T10:00', 'variants': ['Yes', 'No'],
+             'prev': 'first'},
+            {'key': 'bad', 'name': 'Bad', 'description': 'D', 'author': 'nobody',
+             'finishes': '2030-01-03T10:00', 'variants': ['Yes', 'No']},
+        ]))
+        report = os.path.join(os.path.dirname(path), 'report.csv')
+        call_command('import_votings', path, '--batch-size', '2', '--report', report, stdout=io.StringIO())
+        first, second = Voting.objects.get(name='First'), Voting.objects.get(name='Second')
+        self.assertEqual(first.next_voting, second)
+        self.assertEqual(second.prev_voting, first)
+        self.assertEqual(second.votevariant_set.count(), 2)
+        with open(report, encoding='utf-8') as file:
+            self.assertIn("3,bad,unknown author 'nobody'", file.read())
+
+    def test_csv_dry_run(self):
+        path = self.write('votings.csv', (
+            'key,name,description,author,type,published,finishes,variants,next\n'
+            'a,CSV voting,D,author,checkboxes,2030-01-01T10:00,2030-01-02T10:00,One|Two|Three,missing\n'
+            'b,,D,author,radios,2030-01-01T10:00,2030-01-02T10:00,One,\n'
+        ))
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch('sys.stderr', stderr):
+            call_command('import_votings', path, '--dry-run', stdout=stdout)
+        self.assertFalse(Voting.objects.filter(name='CSV voting').exists())
+        self.assertIn('Validated 1 votings', stdout.getvalue())
+        self.assertIn('2,b,missing fields: name', stderr.getvalue())
+        self.assertIn("1,a,next: unknown key 'missing'", stderr.getvalue())
+
+
+class VariantChoicesTests(VotingTestData):
+    def test_form_validates_from_cache(self):
+        get_variant_choices(self.voting.id)
+        with self.assertNumQueries(0):
+            form = VoteManyOfManyForm(self.voting.id, {'choices': [self.variants[0].id, self.variants[1].id]})
+            self.assertTrue(form.is_valid())
+            self.assertEqual(form.cleaned_data['choices'], [self.variants[0].id, self.variants[1].id])
+            form = VoteManyOfManyForm(self.voting.id, {'choices': [self.other_variants[0].id]})
+            self.assertFalse(form.is_valid())
+
+    def test_invalidated_on_edit(self):
+        self.assertEqual(get_variant_choices(self.voting.id)[0], (self.variants[0].id, self.variants[0].description))
+        self.variants[0].description = 'Changed'
+        self.variants[0].save()
+        self.assertEqual(get_variant_choices(self.voting.id)[0], (self.variants[0].id, 'Changed'))
+        self.variants[0].delete()
+        self.assertEqual(len(get_variant_choices(self.voting.id)), 3)
+
+    def test_variant_deleted_by_another_process(self):
+        choices, deleted_id = get_variant_choices(self.voting.id), self.variants[0].id
+        self.variants[0].delete()
+        # the signal forgets the choices in this process only, another process keeps them
+        variant_choices.set(self.voting.id, choices)
+        user = User.objects.create_user('late', 'late@example.com', 'password')
+        self.client.force_login(user)
+        url = reverse('vote', kwargs={'id': self.voting.id})
+        response = self.client.post(url, {'choices': [deleted_id]})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+        self.assertFalse(VotingParticipation.objects.filter(voting=self.voting, user=user).exists())
+        self.client.post(url, {'choices': [self.variants[1].id]})
+        self.assertTrue(VoteFact.objects.filter(voting=self.voting, user=user).exists())
+
+    @override_settings(VARIANT_CHOICES_CACHE_SIZE=1)
+    def test_bounded(self):
+        get_variant_choices(self.voting.id)
+        get_variant_choices(self.other_voting.id)
+        self.assertEqual(list(variant_choices.entries), [self.other_voting.id])
+
+
+@override_settings(REPLICA_DATABASE='replica', REPLICA_VIEWS=('results_page', 'admin:*_changelist'))
+class ReplicaRouterTests(SimpleTestCase):
+    def route(self, method, path, cookies=None, write=False):
+        """
+        :return: (database of reads before and after the view, response)
+        """
+        router, databases = ReplicaRouter(), []
+
+        def view(request):
+            databases.append(router.db_for_read(Voting))
+            if write:
+                router.db_for_write(Voting)
+                databases.append(router.db_for_read(Voting))
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)(path)
+        request.COOKIES.update(cookies or {})
+        request.resolver_match = resolve(path)
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = ReplicaMiddleware(get_response)
+        response = middleware(request)
+        return databases, response
+
+    def test_read_only_views_use_replica(self):
+        databases, response = self.route('get', '/voting/1/results/')
+        self.assertEqual(databases, ['replica'])
+        self.assertNotIn(ReplicaMiddleware.pin_cookie, response.cookies)
+        self.assertEqual(self.route('get', '/admin/main/voting/')[0], ['replica'])
+        self.assertEqual(self.route('get', '/voting/1/vote/')[0], ['default'])
+        self.assertEqual(ReplicaRouter().db_for_read(Voting), 'default')
+
+    def test_writes_pin_to_primary(self):
+        databases, response = self.route('get', '/voting/1/results/', write=True)
+        self.assertEqual(databases, ['replica', 'default'])
+        self.assertIn(ReplicaMiddleware.pin_cookie, response.cookies)
+
+        response = self.route('post', '/voting/1/vote/')[1]
+        self.assertIn(ReplicaMiddleware.pin_cookie, response.cookies)
+        databases, _ = self.route('get', '/voting/1/results/', cookies={ReplicaMiddleware.pin_cookie: '1'})
+        self.assertEqual(databases, ['default'])
+
+
+class RollupTests(VotingTestData):
+    def vote(self, variants):
+        self.client.cookies.clear()
+        url = reverse('vote', kwargs={'id': self.voting.id})
+        self.assertEqual(self.client.post(url, {'choices': [v.id for v in variants]}).status_code, 302)
+
+    def test_incremental_matches_backfill(self):
+        rebuild_rollups()
+        self.vote(self.variants[:2])
+        self.vote(self.variants[1:3])
+        incremental = set(VariantRollup.objects.values_list('variant_id', 'granularity', 'bucket', 'votes'))
+        rebuild_rollups()
+        self.assertEqual(set(VariantRollup.objects.values_list('variant_id', 'granularity', 'bucket', 'votes')),
+                         incremental)
+        buckets, voters, variants = get_turnout(self.voting.id)
+        self.assertEqual(sum(voters), len(self.voters) + 2)
+        self.assertEqual(sum(variants[self.variants[1].id]), VoteVariant.objects.get(id=self.variants[1].id).votes)
+
+        response = self.client.get(reverse('results_page', kwargs={'id': self.voting.id}))
+        self.assertContains(response, 'id="turnout-chart"')
+
+    def test_compaction_merges_old_minutes(self):
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(days=2)
+        for minute, voters in ((5, 2), (40, 3)):
+            VotingRollup.objects.create(voting=self.voting, granularity=VotingRollup.MINUTE,
+                                        bucket=hour + datetime.timedelta(minutes=minute), voters=voters)
+        VotingRollup.objects.create(voting=self.voting, granularity=VotingRollup.MINUTE,
+                                    bucket=timezone.now(), voters=1)
+        self.assertEqual(compact_rollups(batch_size=1), 2)
+        self.assertEqual(
+            list(VotingRollup.objects.order_by('bucket').values_list('granularity', 'bucket', 'voters')),
+            [(VotingRollup.HOUR, hour, 5),
+             (VotingRollup.MINUTE, VotingRollup.objects.get(granularity=VotingRollup.MINUTE).bucket, 1)],
+        )
+        buckets, voters, _ = get_turnout(self.voting.id)
+        self.assertEqual((buckets[0], voters), (hour, [5, 1]))
+
+    def test_rebuild_compacts_only_its_votings(self):
+        old = timezone.now() - datetime.timedelta(days=2)
+        VotingRollup.objects.create(voting=self.other_voting, granularity=VotingRollup.MINUTE, bucket=old, voters=1)
+        rebuild_rollups([self.voting.id])
+        self.assertTrue(VotingRollup.objects.filter(voting=self.other_voting, granularity=VotingRollup.MINUTE,
+                                                    bucket=old).exists())
+
+
+class SeriesTests(VotingTestData):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # links in both notations: voting -> other_voting by next_voting, other_voting -> last by prev_voting
+        cls.last = create_voting(cls.author, 'Last', 'Description', Voting.BUTTONS, cls.voting.published,
+                                 cls.voting.finishes, ['Yes', 'No'], prev_voting=cls.other_voting)
+        Voting.objects.filter(id=cls.voting.id).update(next_voting=cls.other_voting)
+
+    def test_traversal(self):
+        order = [self.voting.id, self.other_voting.id, self.last.id]
+        for voting_id in order:
+            self.assertEqual(get_series(voting_id), order)
+            self.assertEqual(order_series(walk_series(voting_id)), order)
+        self.assertEqual(get_series(0), [])
+
+        # a cycle is cut where the traversal meets itself
+        Voting.objects.filter(id=self.last.id).update(next_voting=self.voting)
+        self.assertEqual(order_series(query_series(self.other_voting.id)),
+                         [self.voting.id, self.other_voting.id, self.last.id])
+        self.assertEqual(order_series(walk_series(self.other_voting.id)),
+                         [self.voting.id, self.other_voting.id, self.last.id])
+
+    def test_page_aggregates_results(self):
+        response = self.client.get(reverse('series_page', kwargs={'id': self.last.id}))
+        facts = response.context['facts']
+        self.assertEqual(response.context['voters'], 2 * len(self.voters))
+        self.assertEqual(facts['Variant 0'], VoteVariant.objects.get(id=self.variants[0].id).votes)
+        self.assertEqual(list(facts)[-2:], ['Yes', 'No'])
+        self.assertContains(response, 'id="results-chart"')
+
+        # the chain is cached, only the votings and their variants are loaded
+        with self.assertNumQueries(2):
+            self.client.get(reverse('series_page', kwargs={'id': self.last.id}))
+
+    def test_edit_drops_cached_series(self):
+        self.assertEqual(len(get_series(self.voting.id)), 3)
+        self.client.force_login(self.author)
+        response = self.client.post(reverse('voting_edit', kwargs={'pk': self.voting.id}), {
+            'name': self.voting.name,
+            'description': self.voting.description,
+            'finishes': timezone.localtime(self.voting.finishes).strftime('%Y-%m-%dT%H:%M'),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(get_series(self.voting.id), [self.voting.id])
+        self.assertEqual(get_series(self.last.id), [self.other_voting.id, self.last.id])
+
+    def test_series_expire_in_other_workers(self):
+        self.assertEqual(len(get_series(self.voting.id)), 3)
+        # a link changed by another worker does not reach this worker's cache
+        Voting.objects.filter(id=self.voting.id).update(next_voting=None)
+        self.assertEqual(len(get_series(self.voting.id)), 3)
+        with mock.patch('time.time', return_value=time.time() + settings.SERIES_CACHE_TIMEOUT + 1):
+            self.assertEqual(get_series(self.voting.id), [self.voting.id])
+
+
+class SearchTests(VotingTestData):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        cls.weather, cls.lunch = create_votings([
+            (Voting(name='Погода на выходных', description='Какую погоду ждёте?', author=cls.author,
+                    published=now - datetime.timedelta(hours=1), finishes=now + datetime.timedelta(hours=1)),
+             ['Солнце', 'Дождь']),
+            (Voting(name='Обед', description='Где обедать, если погода плохая?', author=cls.author,
+                    published=now - datetime.timedelta(hours=1), finishes=now + datetime.timedelta(hours=1)),
+             ['Столовая', 'Кафе']),
+        ])
+        cls.future = create_voting(cls.author, 'Погода летом', 'Description', Voting.RADIOS,
+                                   now + datetime.timedelta(hours=1), now + datetime.timedelta(hours=2), ['Да', 'Нет'])
+
+    def test_ranked_prefix_search(self):
+        # name matches rank above description matches, unpublished votings are hidden
+        self.assertEqual(search_votings('погод')[0], [self.weather, self.lunch])
+        self.assertEqual(search_votings('ПОГОДА обед')[0], [self.lunch])
+        self.assertEqual(search_votings('voting other')[0], [self.other_voting])
+        self.assertEqual(search_votings('!!!'), ([], False))
+        self.assertEqual(search_votings('погод', page=1, page_size=1), ([self.weather], True))
+        self.assertEqual(search_votings('погод', page=2, page_size=1), ([self.lunch], False))
+
+    def test_index_follows_changes(self):
+        self.weather.name = 'Прогноз'
+        self.weather.save()
+        self.lunch.delete()
+        self.assertEqual(search_votings('погод')[0], [self.weather])
+        self.assertEqual(search_votings('прогноз')[0], [self.weather])
+
+    def test_fallback_without_index(self):
+        with mock.patch('main.search.ranked_ids', return_value=None):
+            self.assertEqual(set(search_votings('погод')[0]), {self.weather, self.lunch})
+
+    def test_page(self):
+        response = self.client.get(reverse('voting_search'), {'q': 'погода'})
+        self.assertContains(response, self.weather.name)
+        self.assertNotContains(response, self.future.name)
+        response = self.client.get(reverse('voting_search'), {'q': str(self.future.id)})
+        self.assertRedirects(response, reverse('voting_page', kwargs={'id': self.future.id}))
+
+    def test_malformed_numbers(self):
+        for params in ({'q': '²'}, {'q': str(2 ** 64)}, {'q': 'погода', 'page': '²'},
+                       {'q': 'погода', 'page': str(2 ** 64)}, {'q': 'погода', 'page': '-1'}):
+            self.assertEqual(self.client.get(reverse('voting_search'), params).status_code, 200)
+
+    def test_get_only(self):
+        response = self.client.post(reverse('voting_search'), {'voting_id': self.weather.id})
+        self.assertEqual(response.status_code, 405)
+
+
+class VoteFactVotingMigrationTests(TransactionTestCase):
+    """
+    backfill of VoteFact.voting in migration 0018, run on a database migrated back to 0017
+    """
+    migrate_from = [('main', '0017_vote_tallies')]
+    migrate_to = [('main', '0018_votefact_voting')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        self.apps = executor.loader.project_state(self.migrate_from).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_backfill(self):
+        User = self.apps.get_model('auth', 'User')
+        Voting = self.apps.get_model('main', 'Voting')
+        VoteVariant = self.apps.get_model('main', 'VoteVariant')
+        VoteFact = self.apps.get_model('main', 'VoteFact')
+        author = User.objects.create(username='author')
+        facts = {}
+        for name in ('first', 'second'):
+            voting = Voting.objects.create(name=name, description='', author=author, finishes=timezone.now())
+            variants = [VoteVariant.objects.create(voting=voting, description=str(i)) for i in range(2)]
+            for chosen in (variants[:1], variants, variants[1:]):
+                fact = VoteFact.objects.create(user=author)
+                fact.variants.add(*chosen)
+                facts[fact.id] = voting.id
+        empty = VoteFact.objects.create(user=author)
+
+        migration = importlib.import_module('main.migrations.0018_votefact_voting')
+        # chunks smaller than the data make the backfill commit several times
+        with mock.patch.object(migration, 'BACKFILL_CHUNK_SIZE', 4):
+            executor = MigrationExecutor(connection)
+            executor.migrate(self.migrate_to)
+        VoteFact = executor.loader.project_state(self.migrate_to).apps.get_model('main', 'VoteFact')
+        self.assertEqual(dict(VoteFact.objects.filter(id__in=facts).values_list('id', 'voting_id')), facts)
+        self.assertIsNone(VoteFact.objects.get(id=empty.id).voting_id)
@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from main.models import VoteVariant
+
+
+class VariantChoicesCache:
+    """
+    bounded LRU of (variant id, description) pairs of votings, local to the process.
+    Entries are dropped by signals of this process on edits, other worker processes
+    notice an edit after VARIANT_CHOICES_TIMEOUT at the latest
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, voting_id):
+        with self.lock:
+            entry = self.entries.get(voting_id)
+            if entry is None:
+                return None
+            expires, choices = entry
+            if expires < time.monotonic():
+                del self.entries[voting_id]
+                return None
+            self.entries.move_to_end(voting_id)
+            return choices
+
+    def set(self, voting_id, choices):
+        with self.lock:
+            self.entries[voting_id] = time.monotonic() + settings.VARIANT_CHOICES_TIMEOUT, choices
+            self.entries.move_to_end(voting_id)
+            while len(self.entries) > settings.VARIANT_CHOICES_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def forget(self, voting_id):
+        with self.lock:
+            self.entries.pop(voting_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+variant_choices = VariantChoicesCache()
+
+
+def get_variant_choices(voting_id, variants=None):
+    """
+    :param variants: already loaded variants of the voting, saves the query on a cache miss
+    :return: tuple of (variant id, description) pairs ordered by id
+    """
+    choices = variant_choices.get(voting_id)
+    if choices is None:
+        if variants is None:
+            variants = VoteVariant.objects.filter(voting=voting_id).values_list('id', 'description')
+        else:
+            variants = [(variant.id, variant.description) for variant in variants]
+        choices = tuple(sorted(variants))
+        variant_choices.set(voting_id, choices)
+    return choices
+
+
+def forget_variant_choices(voting_id):
+    variant_choices.forget(voting_id)
@@ -1,22 +1,43 @@
 import datetime
+import hashlib
+import os
+import stat
 
+from django.conf import settings
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.password_validation import validate_password
-from django.core.exceptions import PermissionDenied, ValidationError
-from django.db import IntegrityError
-from django.shortcuts import render, redirect, get_object_or_404, get_list_or_404
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied, SuspiciousFileOperation, ValidationError
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils._os import safe_join
 from django.utils.dateparse import parse_datetime
-from django.views.generic import TemplateView, FormView, UpdateView, DeleteView
-from plotly.subplots import make_subplots
-from plotly.io import to_html
-from main.extra_func import get_forms, check_valid_and_create, check_eligible_to_vote
+from django.utils.http import parse_etags, quote_etag
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_safe
+from django.views.generic import TemplateView, UpdateView, DeleteView
+from main.charts import create_chart
+from main.export import EXPORT_FORMATS, export_votes
+from main.extra_func import get_forms, check_valid_and_create, check_eligible_to_vote, get_votings_page, \
+    get_request_voting, parse_positive_int
+from main.media import accel_response, cache_control, file_etag, file_response
 from main.forms import InputForm, VotingContext, VoteOneOfTwoForm, \
-    VoteOneOfManyForm, VoteManyOfManyForm, ProfileEditForm, VotingEditForm, VotingSearchForm
-from main.models import Voting, VoteVariant, VoteFact, User
+    VoteOneOfManyForm, VoteManyOfManyForm, ProfileEditForm, VotingEditForm
+from main.models import Voting, VoteFact, VoteVariant, VotingParticipation, User
+from main.page_cache import anonymous_page_cache
+from main.session_votes import SESSION_KEY, get_session_votes, add_session_votes
+from main.search import search_votings
+from main.series import get_series, load_series, aggregate_results, forget_series
+from main.snapshots import snapshot_due, get_snapshot, render_turnout
+from main.tallies import record_vote, get_tally_state
+from main.variant_choices import forget_variant_choices
+from main.vote_queue import queue_enabled, enqueue_ballot
 from django_registration.backends.one_step.views import RegistrationView
 
 
@@ -32,6 +53,7 @@ def get_menu_context(auth=False):
     return pages
 
 
+@anonymous_page_cache
 def index_page(request):
     context = {
         'pagename': 'Опросы и голосования',
@@ -48,7 +70,7 @@ class TemplatePage(TemplateView):
     def get_context_data(self, **kwargs):
         return {
             'menu': get_menu_context(self.request.user.is_authenticated),
-            'voting': get_object_or_404(Voting, id=kwargs['id']),
+            'voting': get_request_voting(self.request, kwargs['id']),
             'today': timezone.now()
         }
 
@@ -59,9 +81,7 @@ class VotingPage(TemplatePage):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['pagename'] = 'Просмотр опроса'
-        context['eligible_to_vote'] = check_eligible_to_vote(
-            Voting.objects.get(id=kwargs['id']), self.request
-        )
+        context['eligible_to_vote'] = check_eligible_to_vote(context['voting'], self.request)
         return context
 
 
@@ -69,54 +89,121 @@ class VotingResults(VotingPage):
     template_name = 'pages/voting_results.html'
 
     def get_context_data(self, **kwargs):
-        facts = self.count_facts(**kwargs)
         context = super().get_context_data(**kwargs)
-        context['facts'] = facts
         context['pagename'] = 'Результаты опроса'
+        voting = context['voting']
+        if snapshot_due(voting):
+            # results of a finished voting never change, served entirely from the snapshot
+            snapshot = get_snapshot(voting)
+            if not snapshot.facts:
+                raise Http404('No VoteVariant matches the given query.')
+            context['facts'] = dict(snapshot.facts)
+            context['plotly'] = snapshot.chart
+            context['turnout'] = snapshot.turnout
+            return context
+        # only live results read the variants
+        get_request_voting(self.request, voting.id, variants=True)
+        facts = self.count_facts(voting)
+        context['facts'] = facts
         if len([value for value in facts.values() if value]):
-            context['plotly'] = self.create_chart(facts.copy())
+            context['plotly'] = self.get_chart(voting, facts)
+            context['turnout'] = self.get_turnout_chart(voting)
         return context
 
-    @staticmethod
-    def count_facts(**kwargs):
-        variants = get_list_or_404(VoteVariant, voting=kwargs['id'])
-        facts = {}
-        for variant in variants:
-            facts.update({
-                variant.description: variant.votefact_set.count()
-            })
-        return facts
+    def get_chart(self, voting: Voting, facts: dict):
+        """
+        rendered chart is cached until the next vote bumps the tally version,
+        finished votings can not change anymore so their chart never expires
+        """
+        key = f'results_chart:{voting.id}:{voting.tally_version}'
+        chart = cache.get(key)
+        if chart is None:
+            chart = create_chart(facts.copy())
+            timeout = None if voting.finishes <= timezone.now() else settings.RESULTS_CHART_TIMEOUT
+            cache.set(key, chart, timeout)
+        return chart
+
+    def get_turnout_chart(self, voting: Voting):
+        """
+        chart of votes over time read from the rollups, cached like the results chart
+        """
+        key = f'turnout_chart:{voting.id}:{voting.tally_version}'
+        chart = cache.get(key)
+        if chart is None:
+            chart = render_turnout(voting.id, voting.votevariant_set.all())
+            timeout = None if voting.finishes <= timezone.now() else settings.RESULTS_CHART_TIMEOUT
+            cache.set(key, chart, timeout)
+        return chart
 
     @staticmethod
-    def create_chart(facts: dict):
-        zero_keys = [key for key, value in facts.items() if value == 0]
-        [facts.pop(key) for key in zero_keys]
-        fig = make_subplots(rows=1, cols=2, specs=[
-            [{'type': 'xy'}, {'type': 'domain'}]
-        ])
-        fig.add_bar(
-            row=1, col=1,
-            x=list(facts.keys()),
-            y=list(facts.values()),
-            name='',
-            showlegend=False,
-            hovertemplate='Вариант: %{x}<br>Количество голосов: %{y}',
-            marker_color=['grey'] * len(list(facts.items())),
-            hoverlabel_font_color='white',
-        )
-        fig.add_pie(
-            row=1, col=2,
-            values=list(facts.values()),
-            labels=list(facts.keys()),
-            textposition="auto",
-            name='',
-            hovertemplate='Вариант: %{label}<br>Количество голосов: %{value}</br>%{percent}',
-        )
-        fig.update_layout(yaxis_tickformat=',d')
-        fig.update_traces(marker=dict(line=dict(color='#000000', width=1)))
-        fig.update_yaxes(row=1, col=1, title_text='Количество голосов')
-        fig.update_xaxes(row=1, col=1, title_text='Варианты ответов')
-        return to_html(fig, full_html=False, include_plotlyjs='cdn')
+    def count_facts(voting: Voting):
+        variants = voting.votevariant_set.all()
+        if not variants:
+            raise Http404('No VoteVariant matches the given query.')
+        return {variant.description: variant.votes for variant in variants}
+
+
+def results_json(request, **kwargs):
+    """
+    compact tallies of a voting, conditional requests with a matching
+    ETag are answered from the cached tally state without querying the database.
+    The ETag changes when the voting closes, so clients revalidating an open voting get "finished"
+    """
+    state = get_tally_state(kwargs['id'])
+    if state is None:
+        raise Http404('No Voting matches the given query.')
+    version, finishes = state
+    finished = finishes <= timezone.now()
+
+    if results_etag(kwargs['id'], version, finished) in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        voting = get_object_or_404(Voting.objects.only('voters', 'tally_version', 'finishes'), id=kwargs['id'])
+        version, finished = voting.tally_version, voting.finishes <= timezone.now()
+        variants = voting.votevariant_set.order_by('id').values_list('id', 'description', 'votes')
+        response = JsonResponse({
+            'id': voting.id,
+            'version': version,
+            'finished': finished,
+            'voters': voting.voters,
+            'variants': [list(variant) for variant in variants],
+        }, json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False})
+
+    response['ETag'] = results_etag(kwargs['id'], version, finished)
+    if finished:
+        patch_cache_control(response, public=True, max_age=settings.RESULTS_JSON_FINISHED_MAX_AGE)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.RESULTS_JSON_MAX_AGE)
+    return response
+
+
+def results_etag(voting_id, version, finished):
+    return quote_etag(f'{voting_id}-{version}-{"finished" if finished else "open"}')
+
+
+@require_safe
+def media_file(request, path):
+    """
+    uploaded files, sent by the front web server when MEDIA_SERVE_MODE is nginx or apache
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        file_stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('File does not exist.')
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404('File does not exist.')
+
+    if settings.MEDIA_SERVE_MODE in ('nginx', 'apache'):
+        response = accel_response(path, full_path)
+    else:
+        response = get_conditional_response(request, etag=file_etag(file_stat), last_modified=int(file_stat.st_mtime))
+        if response is None:
+            response = file_response(request, full_path, file_stat)
+        else:
+            response['ETag'] = file_etag(file_stat)
+    response['Cache-Control'] = cache_control(path)
+    return response
 
 
 def vote_page(request, **kwargs):
@@ -139,7 +226,8 @@ def vote_page(request, **kwargs):
             return VoteOneOfTwoForm
 
     # get the Voting to work with
-    voting: Voting = get_object_or_404(Voting, id=kwargs['id'])
+    # variants come from the choices cache of the vote forms
+    voting: Voting = get_request_voting(request, kwargs['id'])
 
     if not check_eligible_to_vote(voting, request):
         raise PermissionDenied('Can not vote on this voting')
@@ -148,52 +236,103 @@ def vote_page(request, **kwargs):
 
         # determine form type and create form from POST request
         form_type = get_vote_form_type(voting.type)
-        form = form_type(kwargs['id'], request.POST)
+        form = form_type(voting, request.POST)
 
         if form.is_valid():
             data = form.cleaned_data
             vote_fact_user = None
             if request.user.is_authenticated:
                 vote_fact_user = request.user
-            vote_fact = VoteFact(
-                created=timezone.now(),
-                user=vote_fact_user,
-            )
-            # save new vote fact to use it's id in the ManyToMany relationship
-            vote_fact.save()
-            if form_type == VoteOneOfTwoForm or form_type == VoteOneOfManyForm:
-                vote_fact.variants.add(data['choices'])
-            elif form_type == VoteManyOfManyForm:
-                vote_fact.variants.set(data['choices'])
-            vote_fact.save()
-
-            votes = request.session.get('votes')
-            if votes:
-                votes.append(voting.id)
-                request.session.modified = True
+            if form_type == VoteManyOfManyForm:
+                variant_ids = data['choices']
+            else:
+                variant_ids = [data['choices']]
+            if queue_enabled():
+                enqueue_ballot(voting, vote_fact_user, variant_ids)
             else:
-                request.session['votes'] = [voting.id]
+                try:
+                    with transaction.atomic():
+                        # the form checks the choices against the cache of this process only,
+                        # a variant deleted through another process may still be there
+                        if VoteVariant.objects.filter(voting=voting, id__in=variant_ids).count() != len(variant_ids):
+                            raise VoteVariant.DoesNotExist
+                        if vote_fact_user is not None:
+                            VotingParticipation.objects.create(voting=voting, user=vote_fact_user)
+                        vote_fact = VoteFact.objects.create(
+                            voting=voting,
+                            created=timezone.now(),
+                            user=vote_fact_user,
+                        )
+                        vote_fact.variants.add(*variant_ids)
+                        record_vote(voting, variant_ids, vote_fact.created)
+                except IntegrityError:
+                    # a concurrent request of the same user has already voted
+                    return redirect('results_page', id=voting.id)
+                except VoteVariant.DoesNotExist:
+                    # the form bound again to the fresh choices shows the deleted variant as an error
+                    forget_variant_choices(voting.id)
+                    context['voting'] = voting
+                    context['form'] = form_type(voting, request.POST)
+                    return render(request, 'pages/vote.html', context)
+
+            add_session_votes(request.session, [voting.id])
 
         # redirect user to results page after creating VoteFact
         return redirect('results_page', id=voting.id)
 
     else:
         context['voting'] = voting
-        form = get_vote_form_type(voting.type)(voting_id=voting.id)
+        form = get_vote_form_type(voting.type)(voting)
         context['form'] = form
         return render(request, 'pages/vote.html', context)
 
 
+def series_page(request, id):
+    """
+    all votings linked to the voting through next/prev links, with their votes summed
+    """
+    ids = get_series(id)
+    if not ids:
+        raise Http404('No Voting matches the given query.')
+    votings = load_series(ids)
+    voters, facts = aggregate_results(votings)
+    context = {
+        'menu': get_menu_context(request.user.is_authenticated),
+        'pagename': 'Серия опросов',
+        'voting_id': id,
+        'votings': votings,
+        'voters': voters,
+        'facts': facts,
+        'today': timezone.now(),
+    }
+    if any(facts.values()):
+        context['plotly'] = get_series_chart(votings, facts)
+    return render(request, 'pages/series.html', context)
+
+
+def get_series_chart(votings, facts: dict):
+    """
+    chart of the summed votes, cached until any voting of the series gets a vote
+    """
+    versions = ','.join(f'{voting.id}-{voting.tally_version}' for voting in votings)
+    key = f'series_chart:{hashlib.sha1(versions.encode()).hexdigest()}'
+    chart = cache.get(key)
+    if chart is None:
+        chart = create_chart(facts.copy())
+        cache.set(key, chart, settings.RESULTS_CHART_TIMEOUT)
+    return chart
+
+
 @login_required()
 def votings_page(request):
     context = {
         'pagename': 'Список опросов',
         'menu': get_menu_context(request.user.is_authenticated),
     }
-    user = request.user
-    if user is not None:
-        context['votings'] = Voting.objects.filter(author=user)
-        context['today'] = timezone.now()
+    context['votings'], context['next_cursor'] = get_votings_page(
+        request.user, request.GET.get('cursor'), settings.VOTINGS_PAGE_SIZE
+    )
+    context['paginated'] = 'cursor' in request.GET
     return render(request, 'pages/votings_list.html', context)
 
 
@@ -244,6 +383,8 @@ def create_voting_page(request):
                 context['errors'].append('Неправильное время начала опроса')
             elif error == 'finish_time':
                 context['errors'].append('Неправильное время окончания опроса')
+        # rules of the voting service, e.g. the number of variants
+        context['errors'] += voteinfo.non_field_errors()
         if voteinfo.is_valid():
             if timezone.now() >= parse_datetime(voteinfo.data['start_time']).astimezone() + datetime.timedelta(
                 minutes=3):
@@ -320,24 +461,48 @@ def profile_page(request, id):
     context['votings'] = votings
     context['votes'] = votes
     context['user'] = user
-    user_votings = set()
-    for votefact in votes:
-        user_votings.add(votefact.variants.all()[0].voting)
-    context['user_votings'] = list(user_votings)
+    context['user_votings'] = Voting.objects.filter(participations__user=user).only('id', 'name')
     return render(request, 'pages/profile.html', context)
 
 
-class VotingSearch(FormView):
+@login_required()
+def export_votes_page(request, id, export_format):
+    voting = get_object_or_404(Voting.objects.only('author_id'), id=id)
+    if request.user.id != voting.author_id and not request.user.is_superuser and not request.user.is_staff:
+        raise PermissionDenied('Вы не можете выгружать голоса этого опроса')
+    if export_format not in EXPORT_FORMATS:
+        raise Http404('Unknown export format')
+    response = StreamingHttpResponse(export_votes(id, export_format), content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="voting_{id}_votes.{export_format}"'
+    return response
+
+
+# search has no side effects, only GET is accepted so the page can be cached for anonymous visitors
+@method_decorator(anonymous_page_cache, name='dispatch')
+class VotingSearch(TemplateView):
+    """
+    full-text search over published votings by the q parameter,
+    a number in q leads straight to the voting with that ID
+    """
     template_name = 'pages/voting_search.html'
-    form_class = VotingSearchForm
+    http_method_names = ['get', 'head']
 
-    def form_valid(self, form):
-        return redirect('voting_page', form.cleaned_data['voting_id'])
+    def get(self, request, *args, **kwargs):
+        voting_id = parse_positive_int(request.GET.get('q', '').strip())
+        if voting_id is not None and Voting.objects.filter(id=voting_id).exists():
+            return redirect('voting_page', voting_id)
+        return super().get(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
         context = super(VotingSearch, self).get_context_data(**kwargs)
         context['pagename'] = 'Найти опрос'
         context['menu'] = get_menu_context(self.request.user.is_authenticated)
+        query = self.request.GET.get('q', '').strip()
+        if query:
+            page = min(parse_positive_int(self.request.GET.get('page', '')) or 1, settings.VOTING_SEARCH_MAX_PAGE)
+            context['query'] = query
+            context['page'] = page
+            context['results'], context['has_next'] = search_votings(query, page, settings.VOTING_SEARCH_PAGE_SIZE)
         return context
 
 
@@ -362,6 +527,12 @@ class VotingEdit(LoginRequiredMixin, UpdateView):
     def get_success_url(self):
         return reverse('voting_page', kwargs={'id': self.object.id})
 
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        if 'next_voting' in form.changed_data or 'prev_voting' in form.changed_data:
+            forget_series()
+        return response
+
     def get_context_data(self, **kwargs):
         if self.request.user == get_object_or_404(Voting, id=self.kwargs['pk']).author or self.request.user.is_staff or self.request.user.is_superuser:
             context = super().get_context_data(**kwargs)
@@ -383,21 +554,18 @@ class CustomRegistrationView(RegistrationView):
 
 class CustomLogoutView(TemplateView):
     def get(self, request, *args, **kwargs):
-        session_votes = request.session.get('votes')
-        if request.user.is_authenticated:
-            session_data = self.get_user_votes(request.user)
-            if session_votes:
-                session_data.update(session_votes)
-        else:
-            session_data = session_votes
+        session_votes = get_session_votes(request.session)
+        user_votes = self.get_user_votes(request.user) if request.user.is_authenticated else []
         logout(request)
-        self.request.session['votes'] = list(session_data)
+        # the session is flushed on logout, keep the votes so the same browser can't vote twice
+        if session_votes or user_votes:
+            request.session[SESSION_KEY] = session_votes
+            add_session_votes(request.session, user_votes)
         return redirect('index')
 
     @staticmethod
     def get_user_votes(user):
-        votes = set()
-        votefacts = VoteFact.objects.filter(user=user)
-        for votefact in votefacts:
-            votes.add(votefact.variants.all()[0].voting.id)
-        return votes
+        """
+        only votings still open matter, finished ones reject votes anyway
+        """
+        return list(user.participations.filter(voting__finishes__gt=timezone.now()).values_list('voting_id', flat=True))
@@ -0,0 +1,155 @@
+import logging
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction, DataError, IntegrityError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from main.models import Voting, VoteVariant, VoteFact, VotingParticipation, VotingResultSnapshot
+from main.rollups import record_rollups
+from main.spool import Spool
+from main.tallies import record_votes
+
+# a batch conflicting with ballots of sync requests is written again, skipping the users that voted meanwhile
+WRITE_ATTEMPTS = 3
+# errors of a ballot itself, a lost database connection is not one of them and leaves the batch queued
+BALLOT_ERRORS = (IntegrityError, DataError, KeyError, TypeError, ValueError)
+
+logger = logging.getLogger(__name__)
+
+
+def get_spool():
+    return Spool(settings.VOTE_SPOOL_PATH)
+
+
+def queue_enabled():
+    return settings.VOTE_INGESTION == 'queue'
+
+
+def enqueue_ballot(voting: Voting, user, variant_ids):
+    """
+    append a validated ballot to the spool, it is written to the database by the drain_votes worker
+    """
+    get_spool().append({
+        'ballot': uuid.uuid4().hex,
+        'voting': voting.id,
+        'user': user.id if user is not None else None,
+        'variants': list(variant_ids),
+        'created': timezone.now().isoformat(),
+    })
+
+
+def drain(batch_size):
+    """
+    write one batch of queued ballots to the database
+    :return: (number of processed ballots, number of written ballots, enqueue time of the oldest processed ballot)
+    """
+    spool = get_spool()
+    items = spool.claim(batch_size, settings.VOTE_SPOOL_LEASE)
+    if not items:
+        return 0, 0, None
+    ballots = [payload for _, _, payload in items]
+    for attempt in range(WRITE_ATTEMPTS):
+        try:
+            written = write_ballots(ballots)
+            break
+        except BALLOT_ERRORS:
+            if attempt == WRITE_ATTEMPTS - 1:
+                written = write_one_by_one(spool, items)
+    spool.ack([item_id for item_id, _, _ in items])
+    return len(items), written, items[0][1]
+
+
+def write_one_by_one(spool, items):
+    """
+    write the ballots of a failing batch separately, the ones that still fail are moved
+    to the rejected table of the spool so that they do not block the queue
+    :return: number of written ballots
+    """
+    written, rejected = 0, []
+    for item_id, _, ballot in items:
+        try:
+            written += write_ballots([ballot])
+        except BALLOT_ERRORS:
+            logger.exception('rejected queued ballot %s', item_id)
+            rejected.append(item_id)
+    spool.reject(rejected)
+    return written
+
+
+def voted_pairs(voting_ids, user_ids):
+    return set(
+        VotingParticipation.objects.filter(voting__in=voting_ids, user__in=user_ids)
+        .values_list('voting_id', 'user_id')
+    )
+
+
+def write_ballots(ballots):
+    variant_ids = {variant_id for ballot in ballots for variant_id in ballot['variants']}
+    variant_voting = dict(VoteVariant.objects.filter(id__in=variant_ids).values_list('id', 'voting_id'))
+    user_ids = {ballot['user'] for ballot in ballots if ballot['user'] is not None}
+    voting_ids = {ballot['voting'] for ballot in ballots}
+
+    with transaction.atomic():
+        # users could have passed the eligibility check again while their first ballot was queued
+        voted = voted_pairs(voting_ids, user_ids)
+        # ballots of a batch that was written before its worker could ack it
+        written = set(VoteFact.objects.filter(
+            ballot__in=[ballot['ballot'] for ballot in ballots if ballot.get('ballot')]
+        ).values_list('ballot', flat=True))
+        facts, choices, participations = [], [], []
+        for ballot in ballots:
+            chosen = [variant_id for variant_id in dict.fromkeys(ballot['variants'])
+                      if variant_voting.get(variant_id) == ballot['voting']]
+            if not chosen or ballot.get('ballot') in written:
+                continue
+            if ballot['user'] is not None:
+                if (ballot['voting'], ballot['user']) in voted:
+                    continue
+                voted.add((ballot['voting'], ballot['user']))
+                participations.append(VotingParticipation(
+                    voting_id=ballot['voting'],
+                    user_id=ballot['user'],
+                    created=parse_datetime(ballot['created']),
+                ))
+            facts.append(VoteFact(
+                voting_id=ballot['voting'],
+                user_id=ballot['user'],
+                created=parse_datetime(ballot['created']),
+                ballot=ballot.get('ballot'),
+            ))
+            choices.append(chosen)
+
+        VotingParticipation.objects.bulk_create(participations)
+        create_facts(facts)
+        through = VoteFact.variants.through
+        through.objects.bulk_create([
+            through(votefact_id=fact.id, votevariant_id=variant_id)
+            for fact, chosen in zip(facts, choices) for variant_id in chosen
+        ])
+        voting_counts = Counter(fact.voting_id for fact in facts)
+        record_votes(voting_counts, Counter(variant_id for chosen in choices for variant_id in chosen))
+        record_rollups((fact.voting_id, chosen, fact.created) for fact, chosen in zip(facts, choices))
+        # ballots drained after the results were frozen make the snapshot stale
+        VotingResultSnapshot.objects.filter(voting__in=list(voting_counts)).delete()
+    return len(facts)
+
+
+def create_facts(facts):
+    if connection.features.can_return_rows_from_bulk_insert:
+        VoteFact.objects.bulk_create(facts)
+    else:
+        # the backend can not report ids of bulk inserted rows, they are needed for the through table
+        for fact in facts:
+            fact.save(force_insert=True)
+
+
+def queue_lag():
+    """
+    :return: (number of queued ballots, age in seconds of the oldest queued ballot)
+    """
+    depth, oldest = get_spool().stats()
+    return depth, time.time() - oldest if oldest is not None else 0.0
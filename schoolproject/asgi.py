@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'schoolproject.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported after Django is set up, the stream handler uses the ORM
+from main.sse import STREAM_PATH, results_stream  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # live results are streamed outside of Django, its 3.2 request cycle can not hold a connection open
+    if scope['type'] == 'http':
+        match = STREAM_PATH.match(scope['path'])
+        if match:
+            return await results_stream(scope, receive, send, int(match['id']))
+    return await django_application(scope, receive, send)
@@ -51,6 +51,52 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+if DEBUG or bool(int(os.getenv('QUERY_BUDGET_MIDDLEWARE', 0))):
+    MIDDLEWARE.insert(0, 'main.middleware.QueryBudgetMiddleware')
+
+# maximum number of SQL queries per request, keyed by url name,
+# exceeding it is logged by QueryBudgetMiddleware and fails main.tests.
+# Budgets include the SAVEPOINT/RELEASE pairs the middleware sees when atomic blocks are nested,
+# as in the test suite, where every request runs inside the transaction of the test
+QUERY_BUDGET_DEFAULT = 20
+QUERY_BUDGETS = {
+    'index': 2,
+    'votings_list': 3,
+    'create_voting': 2,
+    'voting_page': 4,
+    'voting_edit': 7,
+    # a ballot of a signed in user: variants check, participation, fact, choices, tallies,
+    # one upsert per rollup table and the session, in two atomic blocks
+    'vote': 18,
+    # the first view of a finished voting freezes its results and turnout into a snapshot,
+    # later views read only the snapshot
+    'results_page': 9,
+    'results_json': 3,
+    'series_page': 3,
+    # ranked ids from the full-text index, then the votings themselves
+    'voting_search': 4,
+    'profile_edit': 3,
+    'profile': 7,
+    'logout': 9,
+    # the date hierarchy takes the date range and the distinct dates from the indexed column
+    'admin:main_votefact_changelist': 8,
+    'admin:main_voting_changelist': 7,
+    # the new user and the profile, then the user is signed in like on login
+    'register': 16,
+    # both authentication backends look the user up, saving last_login saves the profile too
+    'login': 12,
+    'password_reset': 1,
+    'password_reset_done': 0,
+    # the token check, the new password and the session of the signed in user
+    'password_reset_confirm': 8,
+    'password_reset_complete': 1,
+    # the PROTECT checks of the series links and one DELETE per related table
+    'voting_delete': 18,
+    # counted until the response starts, the votes are read chunk by chunk while it streams
+    'export_votes': 3,
+    'media': 0,
+}
+
 ROOT_URLCONF = 'schoolproject.urls'
 
 TEMPLATES = [
@@ -95,6 +141,130 @@ else:
         }
     }
 
+# Read replica
+# reads of the views in REPLICA_VIEWS go to the replica when one is configured: DB_REPLICA_HOST
+# in production, DB_REPLICA_NAME (an SQLite file next to db.sqlite3, e.g. a copy of it) with DEBUG
+if DEBUG and os.getenv('DB_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, os.getenv('DB_REPLICA_NAME')),
+        'TEST': {'MIRROR': 'default'},
+    }
+elif not DEBUG and os.getenv('DB_REPLICA_HOST'):
+    DATABASES['replica'] = dict(DATABASES['default'], HOST=os.getenv('DB_REPLICA_HOST'), TEST={'MIRROR': 'default'})
+
+REPLICA_DATABASE = 'replica' if 'replica' in DATABASES else None
+REPLICA_VIEWS = (
+    'results_page', 'voting_page', 'series_page', 'voting_search', 'profile', 'votings_list', 'admin:*_changelist',
+)
+# seconds a browser keeps reading from the primary after it has written something
+REPLICA_PIN_SECONDS = 10
+
+if REPLICA_DATABASE:
+    DATABASE_ROUTERS = ['main.db_router.ReplicaRouter']
+    MIDDLEWARE.insert(0, 'main.middleware.ReplicaMiddleware')
+
+# admin changelists of tables with at least this many rows show the row count estimated
+# by the database (MySQL, PostgreSQL) instead of counting them
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+# memcached shared by all workers when CACHE_MEMCACHED_LOCATION is set (host:port),
+# otherwise every worker process has its own local-memory cache that evicts least
+# recently used entries once MAX_ENTRIES is reached
+if os.getenv('CACHE_MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.getenv('CACHE_MEMCACHED_LOCATION'),
+            'TIMEOUT': 300,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'schoolproject',
+            'TIMEOUT': 300,
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 5000)),
+            },
+        }
+    }
+# entries dropped on edits are dropped for every worker only with a shared cache,
+# with a local-memory one other workers keep them until they expire
+SHARED_CACHE = 'locmem' not in CACHES['default']['BACKEND']
+
+# seconds to keep the rendered results chart of a voting that is still open,
+# charts of finished votings are cached without expiry
+RESULTS_CHART_TIMEOUT = 24 * 60 * 60
+
+# votings followed in each direction when a series is loaded, longer series are cut off
+SERIES_MAX_LENGTH = 500
+# seconds to keep the voting ids of a series, links changed by VotingEdit and the admin drop them
+# for every worker only with a shared cache, local-memory caches keep them briefly
+SERIES_CACHE_TIMEOUT = 24 * 60 * 60 if SHARED_CACHE else 10
+
+# votes are counted per minute in rollups, minute buckets older than this many seconds
+# are merged into hour buckets by `manage.py compact_rollups`
+ROLLUP_MINUTE_RETENTION = 6 * 60 * 60
+
+# seconds a worker trusts its cached tally version when answering conditional
+# requests to the results endpoint, other workers invalidate it only by expiry
+TALLY_STATE_TIMEOUT = 2
+TALLY_STATE_FINISHED_TIMEOUT = 60 * 60
+
+# Cache-Control max-age of the results endpoint for open and finished votings
+RESULTS_JSON_MAX_AGE = 2
+RESULTS_JSON_FINISHED_MAX_AGE = 24 * 60 * 60
+
+# seconds to keep pages rendered for anonymous visitors, pages of edited or deleted votings
+# are dropped at once only with a shared cache, so local-memory caches keep them briefly
+PAGE_CACHE_TIMEOUT = 10 * 60 if SHARED_CACHE else 5
+
+# seconds after a voting finishes before its results are frozen into a snapshot,
+# leaves time for ballots still waiting in the vote queue
+RESULT_SNAPSHOT_DELAY = 5 * 60
+
+# live results stream (served by schoolproject.asgi): how often connected
+# browsers may get an update and how often an idle connection is pinged
+SSE_MAX_UPDATES_PER_SECOND = 2
+SSE_HEARTBEAT = 15
+
+# vote form choices are kept in a per-process LRU of this many votings,
+# edits made by other processes are picked up after VARIANT_CHOICES_TIMEOUT seconds
+VARIANT_CHOICES_CACHE_SIZE = 2000
+VARIANT_CHOICES_TIMEOUT = 60
+
+# votings a browser has voted in are kept in its session as ranges of ids,
+# at most this many ranges are stored, the oldest are dropped first
+SESSION_VOTES_MAX_RANGES = 200
+
+# number of votings per page of the "My votings" list
+VOTINGS_PAGE_SIZE = 20
+
+# number of votings per page of search results and the deepest page served,
+# every deeper page makes the database rank more matches
+VOTING_SEARCH_PAGE_SIZE = 20
+VOTING_SEARCH_MAX_PAGE = 50
+
+# Vote ingestion
+# 'sync' writes every ballot inside the request, 'queue' appends it to a local
+# spool that is written to the database in batches by `manage.py drain_votes`
+VOTE_INGESTION = os.getenv('VOTE_INGESTION', 'sync')
+VOTE_SPOOL_PATH = os.getenv('VOTE_SPOOL_PATH', os.path.join(BASE_DIR, 'spool', 'votes.sqlite3'))
+# seconds a drain_votes worker holds a claimed batch, a batch it did not ack is drained again after that
+VOTE_SPOOL_LEASE = 60
+
+# Image renditions
+# uploaded images are resized to these widths (JPEG and WebP) by `manage.py process_images`
+IMAGE_RENDITION_WIDTHS = (320, 640, 1280)
+IMAGE_SPOOL_PATH = os.getenv('IMAGE_SPOOL_PATH', os.path.join(BASE_DIR, 'spool', 'images.sqlite3'))
+# seconds a process_images worker holds a claimed batch, resizing a batch must fit into it
+IMAGE_SPOOL_LEASE = 300
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -141,6 +311,15 @@ ACCOUNT_ACTIVATION_DAYS = 7
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# 'django' sends uploaded files from python, 'nginx' and 'apache' only answer with
+# X-Accel-Redirect / X-Sendfile and leave the transfer to the front web server.
+# For nginx MEDIA_ACCEL_PREFIX must be an internal location aliased to MEDIA_ROOT
+MEDIA_SERVE_MODE = os.getenv('MEDIA_SERVE_MODE', 'django')
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+# seconds browsers may reuse an uploaded file, renditions are named after their content and never change
+MEDIA_MAX_AGE = 60 * 60
+MEDIA_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
 DATA_UPLOAD_MAX_MEMORY_SIZE = 20971520
 FILE_UPLOAD_MAX_MEMORY_SIZE = 20971520
 
@@ -14,13 +14,13 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include, reverse
+from django.urls import path, re_path, include, reverse
 from django_registration.backends.one_step.views import RegistrationView
 
 from main import views
+from main.page_cache import anonymous_page_cache
 from django.contrib.auth import views as auth_views
 from django.conf import settings
-from django.conf.urls.static import static
 
 # base
 from main.forms import CustomRegistrationForm, CustomUserLoginForm
@@ -34,10 +34,13 @@ urlpatterns = [
 urlpatterns += [
     path('votings_list/', views.votings_page, name='votings_list'),
     path('create_voting/', views.create_voting_page, name='create_voting'),
-    path('voting/<int:id>/', views.VotingPage.as_view(), name='voting_page'),
+    path('voting/<int:id>/', anonymous_page_cache(views.VotingPage.as_view()), name='voting_page'),
     path('voting/<int:pk>/edit/', views.VotingEdit.as_view(), name='voting_edit'),
     path('voting/<int:id>/vote/', views.vote_page, name='vote'),
     path('voting/<int:id>/results/', views.VotingResults.as_view(), name='results_page'),
+    path('voting/<int:id>/results.json', views.results_json, name='results_json'),
+    path('voting/<int:id>/series/', views.series_page, name='series_page'),
+    path('voting/<int:id>/export.<str:export_format>', views.export_votes_page, name='export_votes'),
     path('voting_search/', views.VotingSearch.as_view(), name='voting_search'),
     path('voting/<int:pk>/delete', views.VotingDeleteView.as_view(), name='voting_delete')
 ]
@@ -121,4 +124,6 @@ urlpatterns += [
 ]
 
 # Нужно для отображения изображения на странице
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+urlpatterns += [
+    re_path(rf'^{settings.MEDIA_URL.lstrip("/")}(?P<path>.+)$', views.media_file, name='media'),
+]
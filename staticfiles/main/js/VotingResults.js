@@ -0,0 +1,115 @@
+const RESULTS_POLL_INTERVAL = 5000;
+
+function renderResultsTable(variants) {
+  const table = document.getElementById("results-table");
+  const counts = new Map();
+  for (const [, description, votes] of variants) {
+    counts.set(description, votes);
+  }
+  table.replaceChildren();
+  for (const [description, votes] of counts) {
+    const row = table.insertRow();
+    row.className = "align-middle";
+    const name = row.insertCell();
+    name.className = "text-break";
+    name.textContent = description;
+    row.insertCell().textContent = votes;
+  }
+  return counts;
+}
+
+function renderResultsChart(counts) {
+  const chart = document.getElementById("results-chart");
+  const labels = [];
+  const values = [];
+  for (const [description, votes] of counts) {
+    if (votes) {
+      labels.push(description);
+      values.push(votes);
+    }
+  }
+  if (!chart || !window.Plotly) {
+    // the first votes arrived, the server renders the initial chart
+    if (values.length) {
+      window.location.reload();
+    }
+    return;
+  }
+  Plotly.restyle(chart, {x: [labels], y: [values], "marker.color": [labels.map(() => "grey")]}, [0]);
+  Plotly.restyle(chart, {labels: [labels], values: [values]}, [1]);
+}
+
+function renderResults(variants) {
+  renderResultsChart(renderResultsTable(variants));
+}
+
+function pollResults(url, version) {
+  async function poll() {
+    let finished = false;
+    try {
+      // browser revalidates with If-None-Match and gets 304 while nothing changed
+      const response = await fetch(url, {cache: "no-cache"});
+      if (response.ok) {
+        const results = await response.json();
+        finished = results.finished;
+        if (results.version !== version) {
+          version = results.version;
+          renderResults(results.variants);
+        }
+      }
+    } catch (error) {
+      console.error(error);
+    }
+    if (!finished) {
+      setTimeout(poll, RESULTS_POLL_INTERVAL);
+    }
+  }
+
+  setTimeout(poll, RESULTS_POLL_INTERVAL);
+}
+
+function streamResults(url, streamUrl, version) {
+  // live updates are pushed when the site is served over ASGI, otherwise fall back to polling
+  const source = new EventSource(streamUrl);
+  let variants = null;
+  source.addEventListener("tally", (event) => {
+    const results = JSON.parse(event.data);
+    variants = results.variants;
+    if (results.version !== version) {
+      version = results.version;
+      renderResults(variants);
+    }
+    if (results.finished) {
+      source.close();
+    }
+  });
+  source.addEventListener("delta", (event) => {
+    const delta = JSON.parse(event.data);
+    if (delta.version !== undefined) {
+      version = delta.version;
+      for (const variant of variants) {
+        if (variant[0] in delta.variants) {
+          variant[2] = delta.variants[variant[0]];
+        }
+      }
+      renderResults(variants);
+    }
+    if (delta.finished) {
+      source.close();
+    }
+  });
+  source.onerror = () => {
+    if (variants === null) {
+      source.close();
+      pollResults(url, version);
+    }
+  };
+}
+
+function watchResults(url, streamUrl, version) {
+  if (window.EventSource) {
+    streamResults(url, streamUrl, version);
+  } else {
+    pollResults(url, version);
+  }
+}